@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Routes PRIVMSGs through CommandRouter with a growing number of commands,
+    next to checking the triggers one after another like on_privmsg used to.
+
+    Run from the repository root: python -m benchmarks.bench_commands
+"""
+
+import logging
+import random
+import time
+
+from piebot import irc
+from piebot.bot import IrcProtocol
+from piebot.commands import CommandRouter
+
+
+class FakeTransport(object):
+
+    def write(self, data):
+        pass
+
+
+def handler(protocol, msg, args):
+    return None
+
+
+def messages(names, count):
+    rng = random.Random(42)
+    lines = []
+    for i in range(count):
+        if i % 4 == 0:
+            text = "just talking, no command here"
+        elif i % 4 == 1:
+            text = "!nosuchcommand with arguments"
+        else:
+            text = "!{} some argument".format(rng.choice(names))
+        msg = irc.Message.from_string(":user{0}!u@h PRIVMSG #pie :{1}".format(i % 500, text))
+        msg.get("trailing")
+        lines.append(msg)
+    return lines
+
+
+def linear(names):
+    triggers = ["!" + name for name in names]
+
+    def dispatch(protocol, msg):
+        word = msg.message.partition(" ")[0]
+        for trigger in triggers:
+            if word == trigger:
+                return True
+        return False
+    return dispatch
+
+
+def main(count=100000, repeat=3):
+    logging.disable(logging.CRITICAL)
+    protocol = IrcProtocol(config={"encoding": "utf-8", "nick": "Pb42", "flood_rate": None}, endpoint=("bench", 0))
+    protocol._transport = FakeTransport()
+    print("{:>6}  {:>14}  {:>14}".format("commands", "router ns/msg", "linear ns/msg"))
+    for size in (10, 100, 1000, 10000):
+        names = ["command{}".format(i) for i in range(size)]
+        router = CommandRouter(user_rate=None)
+        for name in names:
+            router.add(name, handler, "*rest")
+        msgs = messages(names, count)
+        results = []
+        for dispatch in (router.dispatch, linear(names)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for msg in msgs:
+                    dispatch(protocol, msg)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.append(best / count * 1e9)
+        print("{:>8}  {:>14.0f}  {:>14.0f}".format(size, *results))
+
+
+if __name__ == "__main__":
+    main()
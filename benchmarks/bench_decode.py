@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Decoding throughput on corpora where a share of the users sends latin-1.
+
+    Run from the repository root: python -m benchmarks.bench_decode [count]
+"""
+
+import re
+import sys
+import time
+
+from piebot import irc
+from piebot.decoding import Decoder
+from tests.parser_corpus import generate_lines
+
+# Share of users (by their number in the generated hostmasks) sending latin-1.
+CORPORA = [("utf-8", 0), ("latin-1 5%", 5), ("latin-1 50%", 50), ("latin-1", 100)]
+
+_USER = re.compile(r"^:nick(\d+)!")
+
+
+def corpus(lines, percent):
+    result = []
+    for line in lines:
+        match = _USER.match(line)
+        latin1 = match is not None and int(match.group(1)) % 100 < percent
+        result.append(line.encode("latin-1" if latin1 else "utf-8"))
+    return result
+
+
+def measure(function, lines, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            function(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def main(count=200000):
+    lines = generate_lines(count, mix="privmsg")
+    print("{:<12} {:>9} ".format("corpus", "mangled") + " ".join("{:>14}".format(name) for name in [
+        "replace", "Decoder", "+ from_string", "from_bytes", "+ field access"]) + "   (lines/s)")
+    for name, percent in CORPORA:
+        data = corpus(lines, percent)
+        decoder = Decoder()
+        decode = decoder.decode
+        from_string = irc.Message.from_string
+        from_bytes = irc.Message.from_bytes
+        functions = [
+            lambda line: line.decode("utf-8", "replace"),
+            decode,
+            lambda line: from_string(decode(line)),
+            lambda line: from_bytes(line, decode),
+            lambda line: from_bytes(line, decode).get("trailing"),
+        ]
+        mangled = sum(1 for line in data if "�" in line.decode("utf-8", "replace")) / len(data)
+        rates = [measure(function, data) for function in functions]
+        print("{:<12} {:>8.1f}% ".format(name, mangled * 100) + " ".join("{:>14.0f}".format(rate) for rate in rates))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Feeds multi-megabyte bursts through IrcProtocol.data_received.
+
+    Run from the repository root: python -m benchmarks.bench_framing
+"""
+
+import logging
+import time
+
+from piebot import irc
+from piebot.bot import IrcProtocol
+
+
+class BenchProtocol(IrcProtocol):
+
+    def __init__(self, *args, **kwargs):
+        super(BenchProtocol, self).__init__(*args, **kwargs)
+        self.count = 0
+
+    def msg_received(self, msg):
+        self.count += 1
+
+
+class LegacyBenchProtocol(BenchProtocol):
+    """The previous bytes-concatenating framing, kept for comparison."""
+
+    def __init__(self, *args, **kwargs):
+        super(LegacyBenchProtocol, self).__init__(*args, **kwargs)
+        self._buffer = b""
+
+    def data_received(self, data):
+        self._buffer += data
+        while b"\r\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\r\n", 1)
+            line = self.decode(line.strip())
+            if line == "":
+                continue
+            self.msg_received(irc.Message.from_string(line))
+
+
+def make_burst(size):
+    """A NAMES/WHO-like burst of roughly size bytes."""
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        if i % 2:
+            line = ":irc.example.net 353 Pb42 = #channel :@op +voice nick{0} other{0} user{0}\r\n".format(i)
+        else:
+            line = ":irc.example.net 352 Pb42 #channel ~ident{0} host{0}.example.com irc.example.net nick{0} H :0 Real Name\r\n".format(i)
+        lines.append(line.encode("utf-8"))
+        total += len(lines[-1])
+        i += 1
+    return b"".join(lines), i
+
+
+def run(protocol_class, data, chunk_size):
+    protocol = protocol_class(config={"encoding": "utf-8"}, endpoint=("bench", 0))
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk_size):
+        protocol.data_received(data[offset:offset+chunk_size])
+    return time.perf_counter() - start, protocol.count
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    for megabytes in (1, 4, 8):
+        data, lines = make_burst(megabytes * 1024 * 1024)
+        for chunk_size in (4096, 65536, len(data)):
+            for protocol_class in (BenchProtocol, LegacyBenchProtocol):
+                if protocol_class is LegacyBenchProtocol and chunk_size == len(data) and megabytes > 1:
+                    continue  # quadratic, would take minutes
+                elapsed, count = run(protocol_class, data, chunk_size)
+                assert count == lines
+                print("{:<20} {:>2} MiB  chunk {:>8}  {:8.3f}s  {:>10.0f} lines/s".format(
+                    protocol_class.__name__, megabytes, chunk_size, elapsed, lines / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Joins many channels on a local fake server and reports the JOIN lines and time needed.
+
+    Run from the repository root: python -m benchmarks.bench_join
+"""
+
+import asyncio
+import logging
+
+from piebot.bot import ConnectionManager
+from tests.fakeserver import FakeIrcServer
+
+
+def run(loop, channels, flood_rate, stage_lines):
+    server = FakeIrcServer(loop, flood_rate=flood_rate, flood_burst=5).start()
+    endpoint = ("127.0.0.1", server.port)
+    manager = ConnectionManager(loop)
+    manager.add_endpoint(endpoint, {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie",
+                                    "channels": channels, "greeting": None, "flood_rate": flood_rate,
+                                    "join_stage_lines": stage_lines})
+    while endpoint not in manager._active_connections:
+        loop.run_until_complete(asyncio.sleep(0.001))
+    protocol = manager._active_connections[endpoint]
+    start = loop.time()
+    while protocol.joins is None or not protocol.joins.done:
+        loop.run_until_complete(asyncio.sleep(0.001))
+    elapsed = loop.time() - start
+    lines = sum(1 for _, line in server.lines if line.startswith("JOIN "))
+    manager.remove_endpoint(endpoint)
+    loop.run_until_complete(asyncio.sleep(0.01))
+    server.stop()
+    return lines, protocol.joins.stages, elapsed
+
+
+def main(count=500, flood_rate=2.0):
+    logging.disable(logging.CRITICAL)
+    loop = asyncio.new_event_loop()
+    channels = ["#channel{}".format(i) for i in range(count)]
+    print("{} channels, {} lines/s after a burst of 5 (one JOIN per channel: {} lines, ~{:.0f}s)".format(
+        count, flood_rate, count, (count - 5) / flood_rate))
+    for stage_lines in (1, 2, 4):
+        lines, stages, elapsed = run(loop, channels, flood_rate, stage_lines)
+        print("stage_lines={}  {:3} lines  {:3} stages  {:6.2f}s".format(stage_lines, lines, stages, elapsed))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
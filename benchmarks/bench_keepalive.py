@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Cost of keepalive timers for many connections: loop.call_later() per
+    connection against the shared TimerWheel. Every connection reschedules
+    its timer once per PONG, like Keepalive does.
+
+    Run from the repository root: python -m benchmarks.bench_keepalive [connections]
+"""
+
+import asyncio
+import sys
+import time
+
+from piebot.keepalive import TimerWheel
+
+
+def reschedule(call_later, connections, rounds=10):
+    timers = [call_later(60.0, print) for _ in range(connections)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for i, timer in enumerate(timers):
+            timer.cancel()
+            timers[i] = call_later(60.0, print)
+    elapsed = time.perf_counter() - start
+    for timer in timers:
+        timer.cancel()
+    return elapsed / (connections * rounds)
+
+
+def main(connections=10000):
+    loop = asyncio.new_event_loop()
+    wheel = TimerWheel(loop)
+    for name, call_later in [("loop.call_later", loop.call_later), ("TimerWheel", wheel.call_later)]:
+        per_timer = reschedule(call_later, connections)
+        print("{:<16} {} connections: {:.2f}us per reschedule".format(name, connections, per_timer * 1e6))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
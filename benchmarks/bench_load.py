@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Runs the bot against benchmarks.loadserver and reports end-to-end lines/s,
+    handler latency and memory, for one or many connections.
+
+    Run from the repository root, e.g.:
+        python -m benchmarks.bench_load --scenario privmsg_flood --connections 4
+        python -m benchmarks.bench_load --scenario replay --replay session.rec --speed 0
+
+    Sessions to replay are recorded with the "record" endpoint option, e.g.
+    "record": "sessions/{host}-{port}-{time}.rec".
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import time
+
+from piebot import irc
+from piebot.bot import ConnectionManager
+from piebot.metrics import ProtocolMetrics
+
+from benchmarks.loadserver import SCENARIOS, start_process
+
+
+def rss():
+    """(current, peak) resident set size in bytes, current is None without /proc."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None, peak
+    return current, max(current, peak)
+
+
+def run(loop, ports, sample_every):
+    done = set()
+
+    def on_ping(protocol, msg):
+        if msg.payload == "load-done":
+            done.add(protocol._endpoint)
+
+    manager = ConnectionManager(loop)
+    manager.handlers.register(irc.Ping, on_ping)
+    endpoints = [("127.0.0.1", port) for port in ports]
+    for endpoint in endpoints:
+        manager.add_endpoint(endpoint, {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie",
+                                        "channels": [], "greeting": None, "caps": (), "flood_rate": None,
+                                        "metrics_sample_every": sample_every})
+    while not manager._active_connections:
+        loop.run_until_complete(asyncio.sleep(0.001))
+    start = time.perf_counter()
+    while len(done) < len(endpoints):
+        loop.run_until_complete(asyncio.sleep(0.01))
+    elapsed = time.perf_counter() - start
+    memory = rss()
+    total = ProtocolMetrics()
+    for metrics, _ in manager.metrics().values():
+        total.merge(metrics)
+    for endpoint in endpoints:
+        manager.remove_endpoint(endpoint)
+    loop.run_until_complete(asyncio.sleep(0.01))
+    return total, elapsed, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="privmsg_flood")
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=None, help="lines/s per connection, unlimited by default")
+    parser.add_argument("--count", type=int, default=100000, help="lines per connection of synthetic scenarios")
+    parser.add_argument("--channels", type=int, default=None)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--replay", help="recording to replay with --scenario replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 replays as fast as possible")
+    parser.add_argument("--sample-every", type=int, default=1, help="measure latency of every n-th line")
+    args = parser.parse_args()
+
+    if args.scenario == "replay":
+        if args.replay is None:
+            parser.error("--scenario replay needs --replay")
+        options = {"path": args.replay, "speed": args.speed}
+    else:
+        options = {"count": args.count}
+        if args.channels is not None:
+            options["channels"] = args.channels
+        if args.users is not None:
+            options["users"] = args.users
+
+    logging.disable(logging.CRITICAL)
+    process, ports = start_process(args.scenario, args.rate, args.connections, **options)
+    loop = asyncio.new_event_loop()
+    try:
+        metrics, elapsed, (current, peak) = run(loop, ports, args.sample_every)
+    finally:
+        loop.close()
+        process.terminate()
+        process.join()
+
+    latency = metrics.handler_latency
+    print("{} x {}: {} lines in {:.2f}s, {:.0f} lines/s".format(
+        args.connections, args.scenario, metrics.lines_parsed, elapsed, metrics.lines_parsed / elapsed))
+    if latency.count:
+        print("handler latency p50 {:.1f}us  p99 {:.1f}us  ({} samples)".format(
+            latency.quantile(0.5) * 1e6, latency.quantile(0.99) * 1e6, latency.count))
+    print("rss {} peak {:.1f} MiB".format(
+        "{:.1f} MiB,".format(current / 2**20) if current is not None else "n/a,", peak / 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Measures the memory needed to hold parsed messages.
+
+    Run from the repository root: python -m benchmarks.bench_memory [count]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from piebot import irc
+from tests.parser_corpus import legacy_parse, generate_lines
+
+
+class LegacyMessage(object):
+    """Per-instance data dict plus subclass fields copied to __dict__, like the previous Message."""
+
+    def __init__(self, data):
+        self.data = data
+        if data["command"] == "PRIVMSG":
+            self.source = data["nick"]
+            self.target = data["params"][0]
+            self.message = data["trailing"]
+
+
+def hold(lines, build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    messages = [build(line) for line in lines]
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return messages, size, elapsed
+
+
+def main(count=1000000):
+    lines = generate_lines(count, mix="privmsg")
+    # Make the lines themselves part of the baseline, not of the measurement.
+    lines = [line[:] for line in lines]
+    results = [
+        ("legacy dict", lambda line: LegacyMessage(legacy_parse(line))),
+        ("irc.Message", irc.Message.from_string),
+    ]
+    for name, build in results:
+        messages, size, elapsed = hold(lines, build)
+        privmsg = next(m for m in messages if getattr(m, "message", None))
+        start = time.perf_counter()
+        for _ in range(count):
+            privmsg.message
+        access = (time.perf_counter() - start) / count * 1e9
+        print("{:<12} {:>8} msgs  {:8.1f} MiB  {:6.1f} bytes/msg  built in {:5.2f}s  attribute access {:5.1f} ns".format(
+            name, len(messages), size / 1048576, size / len(messages), elapsed, access))
+        del messages
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Measures the overhead of the metrics hooks on the receive path.
+
+    Run from the repository root: python -m benchmarks.bench_metrics
+"""
+
+import logging
+import time
+
+from piebot.bot import IrcProtocol
+from tests.parser_corpus import generate_lines
+
+
+class FakeTransport(object):
+
+    def write(self, data):
+        pass
+
+
+def run(data, **config):
+    config.update({"encoding": "utf-8", "flood_rate": None})
+    protocol = IrcProtocol(config=config, endpoint=("bench", 0))
+    protocol.handlers = IrcProtocol.default_handlers()
+    protocol._transport = FakeTransport()
+    protocol.nick = "Pb42"
+    start = time.perf_counter()
+    for offset in range(0, len(data), 16384):
+        protocol.data_received(data[offset:offset+16384])
+    return time.perf_counter() - start
+
+
+def main(count=300000, repeat=5):
+    logging.disable(logging.CRITICAL)
+    lines = generate_lines(count, mix="mixed")
+    data = "".join(line + "\r\n" for line in lines).encode("utf-8")
+    variants = [("disabled", {"metrics": False}), ("enabled", {}), ("every line", {"metrics_sample_every": 1})]
+    results = {}
+    # Interleave the variants so drifting machine load affects all of them alike.
+    for _ in range(repeat):
+        for name, config in variants:
+            elapsed = run(data, **config)
+            results[name] = min(results.get(name, elapsed), elapsed)
+    for name, elapsed in results.items():
+        overhead = (elapsed / results["disabled"] - 1) * 100
+        print("{:<11} {:8.0f} lines/s  overhead {:+5.1f}%".format(name, count / elapsed, overhead))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Reports lines/sec of the legacy and current irc parsers on generated traffic mixes.
+
+    Run from the repository root: python -m benchmarks.bench_parser
+"""
+
+import time
+
+from piebot import irc
+from tests.parser_corpus import legacy_parse, generate_lines, MIXES
+
+
+def measure(function, lines, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            function(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def main(count=200000):
+    parsers = [
+        ("legacy parse", legacy_parse),
+        ("irc.parse", irc.parse),
+        ("irc.tokenize", irc.tokenize),
+        ("from_string", irc.Message.from_string),
+        ("+ field access", lambda line: irc.Message.from_string(line).get("trailing")),
+    ]
+    print("{:<10} ".format("mix") + " ".join("{:>14}".format(name) for name, _ in parsers) + "   (lines/s)")
+    for mix in sorted(MIXES):
+        lines = generate_lines(count, mix=mix)
+        rates = [measure(function, lines) for _, function in parsers]
+        print("{:<10} ".format(mix) + " ".join("{:>14.0f}".format(rate) for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
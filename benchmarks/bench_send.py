@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Construct-and-send throughput for outgoing PRIVMSGs.
+
+    Run from the repository root: python -m benchmarks.bench_send [count]
+"""
+
+import logging
+import sys
+import time
+
+from piebot import irc
+from piebot.bot import IrcProtocol
+
+
+class NullTransport(object):
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def writelines(self, lines):
+        for data in lines:
+            self.written += len(data)
+
+
+class ReparsingPrivmsg(irc.Privmsg):
+    """Builds itself like the previous Message.update(): serialize, reparse, parse again."""
+    __slots__ = ()
+
+    def update(self, data):
+        fields = dict(self.data)
+        fields.update(data)
+        self._load(tuple(fields[field] for field in irc.FIELDS))
+        self._load(irc.tokenize(str(self)))
+        self.parse()
+
+
+class LegacyEncodingProtocol(IrcProtocol):
+
+    def send_msg(self, msg):
+        self.send_data(self.encode(str(msg)+"\r\n"))
+
+
+def run(protocol_class, message_class, count):
+    protocol = protocol_class(config={"encoding": "utf-8"}, endpoint=("bench", 0))
+    protocol._transport = NullTransport()
+    start = time.perf_counter()
+    for i in range(count):
+        protocol.send_msg(message_class("#channel", "reply number {} with some text".format(i)))
+    return time.perf_counter() - start
+
+
+def main(count=100000):
+    logging.disable(logging.CRITICAL)
+    for name, protocol_class, message_class in [
+        ("reparse + encode", LegacyEncodingProtocol, ReparsingPrivmsg),
+        ("direct + cached", IrcProtocol, irc.Privmsg),
+    ]:
+        elapsed = run(protocol_class, message_class, count)
+        print("{:<18} {} PRIVMSGs in {:.3f}s, {:.0f} msgs/s".format(name, count, elapsed, count / elapsed))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Measures state tracking during a netsplit: users rejoining many channels, then quitting.
+
+    Run from the repository root: python -m benchmarks.bench_state
+"""
+
+import time
+
+from piebot import irc
+from piebot.state import NetworkState
+
+
+def burst(users, channels):
+    lines = [":Pb42!pie@bot JOIN #chan{}".format(c) for c in range(channels)]
+    for u in range(users):
+        for c in range(u % channels, u % channels + 5):
+            lines.append(":user{0}!ident@host{0}.example JOIN #chan{1}".format(u, c % channels))
+    quits = [":user{0}!ident@host{0}.example QUIT :a.net b.net".format(u) for u in range(users)]
+    return [irc.Message.from_string(line) for line in lines], [irc.Message.from_string(line) for line in quits]
+
+
+def main(users=20000, channels=200, repeat=5):
+    best_join = best_quit = None
+    for _ in range(repeat):
+        joins, quits = burst(users, channels)
+        state = NetworkState("Pb42")
+        start = time.perf_counter()
+        for msg in joins:
+            state.update(msg)
+        joined = time.perf_counter()
+        for msg in quits:
+            state.update(msg)
+        done = time.perf_counter()
+        best_join = min(best_join or joined - start, joined - start)
+        best_quit = min(best_quit or done - joined, done - joined)
+    print("JOIN {:8.0f} msgs/s".format(len(joins) / best_join))
+    print("QUIT {:8.0f} msgs/s".format(len(quits) / best_quit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Fills a MessageStore and measures writes, reopening, range scans and nick lookups.
+
+    Run from the repository root: python -m benchmarks.bench_store [lines]
+"""
+
+import logging
+import random
+import sys
+import tempfile
+import time
+
+from piebot import irc
+from piebot.store import MessageStore
+
+
+def messages(count, channels, nicks):
+    # Parsing is not measured, reuse a pool of parsed messages.
+    pool = [irc.Message.from_string(":nick{0}!u@h PRIVMSG #channel{1} :message {2} of nick{0}".format(
+        i % nicks, i % channels, i)) for i in range(10007)]
+    for msg in pool:
+        msg.get("trailing")
+    for i in range(count):
+        yield pool[i % len(pool)]
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[-1]
+
+
+def main(count=2000000, channels=100, nicks=5000):
+    logging.disable(logging.CRITICAL)
+    now = [1.6e9]
+
+    def clock():
+        now[0] += 0.001
+        return now[0]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = MessageStore(directory, clock=clock)
+        start = time.perf_counter()
+        for msg in messages(count, channels, nicks):
+            store.append("net", msg)
+        queued = time.perf_counter() - start
+        store.sync()
+        written = time.perf_counter() - start
+        print("{} lines: append() {:.0f} lines/s on the loop, written at {:.0f} lines/s".format(
+            count, count / queued, count / written))
+        store.close()
+
+        start = time.perf_counter()
+        store = MessageStore(directory, clock=clock)
+        print("reopened in {:.2f}s".format(time.perf_counter() - start))
+
+        first, last = 1.6e9, now[0]
+        rng = random.Random(42)
+
+        def scan():
+            at = rng.uniform(first, last - 60)
+            store.history("net", "#channel{}".format(rng.randrange(channels)), start=at, end=at + 60)
+
+        def latest():
+            store.history("net", "#channel{}".format(rng.randrange(channels)), limit=100)
+
+        def seen():
+            store.last_seen("net", "nick{}".format(rng.randrange(nicks)))
+
+        for name, function in (("60s range scan", scan), ("last 100 lines", latest), ("last seen", seen)):
+            median, worst = timed(function, 1000)
+            print("{:<15} median {:7.3f}ms  max {:7.3f}ms".format(name, median * 1000, worst * 1000))
+        store.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""A local IRC server generating load: synthetic traffic or a replayed recording.
+
+    Scenarios are generators of (delay in seconds, raw line) tuples, run once
+    per client after registration. The server force-joins the client into the
+    scenario's channels first, so state tracking sees real traffic, and ends
+    with "PING :load-done", which tells the client that every line before it
+    has been handled.
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+
+from piebot.recorder import RECEIVED, read_recording
+
+DONE = b"PING :load-done"
+
+# Lines written between two drain() calls.
+CHUNK = 256
+
+
+def _channels(count):
+    return ["#load{}".format(i) for i in range(count)]
+
+
+def _join(nick, channel):
+    return ":{0}!load@load.example JOIN {1}".format(nick, channel).encode("utf-8")
+
+
+def privmsg_flood(nick, count=100000, channels=10, users=100):
+    """count PRIVMSGs from users different senders spread across channels."""
+    channels = _channels(channels)
+    for channel in channels:
+        yield 0, _join(nick, channel)
+    for i in range(count):
+        yield 0, ":user{0}!u{0}@host{0}.example PRIVMSG {1} :message number {2} to the channel".format(
+            i % users, channels[i % len(channels)], i).encode("utf-8")
+
+
+def netsplit(nick, count=100000, channels=10, users=500):
+    """users join all channels, split off with a QUIT each and join again, until count lines are sent."""
+    channels = _channels(channels)
+    for channel in channels:
+        yield 0, _join(nick, channel)
+    sent = 0
+    while sent < count:
+        for i, channel in itertools.product(range(users), channels):
+            yield 0, _join("user{}".format(i), channel)
+        for i in range(users):
+            yield 0, ":user{0}!load@load.example QUIT :hub.example leaf.example".format(i).encode("utf-8")
+        sent += users * len(channels) + users
+
+
+def names_burst(nick, count=100000, channels=100, users=1000):
+    """Joins channels with users members each, as RPL_NAMREPLY lines of up to 510 bytes, until count lines are sent."""
+    sent = 0
+    rounds = itertools.count()
+    while sent < count:
+        parted = next(rounds) > 0
+        for channel in _channels(channels):
+            if parted:
+                yield 0, ":{0}!load@load.example PART {1}".format(nick, channel).encode("utf-8")
+            yield 0, _join(nick, channel)
+            head = ":load.example 353 {} = {} :".format(nick, channel)
+            names = []
+            length = len(head)
+            for i in range(users):
+                name = ("@" if i % 50 == 0 else "") + "user{}".format(i)
+                if length + len(name) + 1 > 510:
+                    yield 0, (head + " ".join(names)).encode("utf-8")
+                    sent += 1
+                    names, length = [], len(head)
+                names.append(name)
+                length += len(name) + 1
+            if names:
+                yield 0, (head + " ".join(names)).encode("utf-8")
+            yield 0, ":load.example 366 {} {} :End of /NAMES list.".format(nick, channel).encode("utf-8")
+            sent += 3 + parted
+
+
+def replay(nick, path, speed=1.0):
+    """The received lines of a piebot.recorder recording, with their original
+        delays divided by speed. A speed of 0 replays as fast as possible.
+    """
+    for delay, direction, line in read_recording(path):
+        if direction == RECEIVED:
+            yield (delay / speed if speed else 0), line
+
+
+SCENARIOS = {
+    "privmsg_flood": privmsg_flood,
+    "netsplit": netsplit,
+    "names_burst": names_burst,
+    "replay": replay,
+}
+
+
+class LoadServer(object):
+    """Listens on connections ports of host. Every client is registered with
+        001 and 376, then gets SCENARIOS[scenario](nick, **options). rate limits
+        synthetic lines per second and client, None sends as fast as the client
+        reads them.
+    """
+
+    def __init__(self, loop, scenario, rate=None, connections=1, host="127.0.0.1", **options):
+        self._loop = loop
+        self._scenario = SCENARIOS[scenario]
+        self.rate = rate
+        self.connections = connections
+        self.host = host
+        self.options = options
+        self.ports = []
+        self._servers = []
+        self._tasks = set()
+
+    async def start(self):
+        for _ in range(self.connections):
+            server = await asyncio.start_server(self._handle, self.host, 0)
+            self._servers.append(server)
+            self.ports.append(server.sockets[0].getsockname()[1])
+        return self
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            nick = await self._register(reader, writer)
+            drain = self._loop.create_task(self._discard(reader))
+            await self._send(writer, self._scenario(nick, **self.options))
+            writer.write(DONE + b"\r\n")
+            await writer.drain()
+            await drain
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _register(self, reader, writer):
+        while True:
+            line = (await reader.readuntil(b"\n")).strip()
+            command, _, rest = line.partition(b" ")
+            if command.upper() == b"NICK":
+                nick = rest.lstrip(b":").decode("utf-8")
+                writer.write(":load.example 001 {0} :Welcome\r\n:load.example 376 {0} :End of /MOTD command.\r\n"
+                             .format(nick).encode("utf-8"))
+                return nick
+
+    async def _discard(self, reader):
+        # Whatever the client sends (PONGs, replies) only has to be read.
+        while await reader.read(65536):
+            pass
+
+    async def _send(self, writer, lines):
+        start = self._loop.time()
+        sent = 0
+        chunk = []
+        for delay, line in lines:
+            if delay:
+                writer.writelines(chunk)
+                chunk = []
+                await asyncio.sleep(delay)
+            chunk.append(line + b"\r\n")
+            sent += 1
+            if self.rate is not None:
+                # Keep to the rate in 10ms slices instead of sleeping per line.
+                ahead = sent / self.rate - (self._loop.time() - start)
+                if ahead > 0.01:
+                    writer.writelines(chunk)
+                    chunk = []
+                    await asyncio.sleep(ahead)
+            if len(chunk) >= CHUNK:
+                writer.writelines(chunk)
+                chunk = []
+                await writer.drain()
+        writer.writelines(chunk)
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        for task in self._tasks:
+            task.cancel()
+
+
+def _serve(pipe, scenario, rate, connections, options):
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(LoadServer(loop, scenario, rate, connections, **options).start())
+    pipe.send(server.ports)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+
+def start_process(scenario, rate=None, connections=1, **options):
+    """Runs a LoadServer in a separate process, so generating the load does
+        not compete with the measured client for the event loop. Returns the
+        process and the ports it listens on.
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(child, scenario, rate, connections, options), daemon=True)
+    process.start()
+    return process, parent.recv()
@@ -1,18 +1,42 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-import inspect
+import codecs
 import logging
+import ssl
+import time
 
 from . import irc
+from .caps import CapNegotiation, DEFAULT_CAPS
+from .commands import CommandRouter, ctcp_ping, ctcp_time, ctcp_version
+from .decoding import Decoder, DEFAULT_FALLBACKS
+from .events import HandlerRegistry
+from .flood import FloodControl, PRIORITY_KEEPALIVE, PRIORITY_CONTROL, PRIORITY_BULK
+from .framing import LineBuffer
+from .isupport import ISupport
+from .joins import JoinStager
+from .keepalive import Keepalive, shared_wheel
+from .metrics import ProtocolMetrics, render_prometheus
+from .reconnect import ReconnectScheduler
+from .recorder import Recorder, SENT
+from .sasl import SaslAuthentication
+from .state import NetworkState
+from .store import MessageStore
+from .tls import ResumingSSLContext, create_context
 
-logging.basicConfig(format="[%(asctime)s] [%(levelname)s] %(message)s", level=logging.DEBUG, datefmt="%d.%m.%Y %H:%M:%S")
 logger = logging.getLogger(__name__)
 
 
+# Messages that can change our nick or host, and with them prefix_length().
+PREFIX_CHANGES = frozenset([irc.Numeric001, irc.Nick, irc.Join])
+
+
 class ManagedProtocol(asyncio.Protocol):
     """Basic managed protocol handler, registers itself to ConnectionManager.
         Inherit this to overlay the management with actual protocol parsing.
+        Data passed to send_data() is queued and written with a single
+        transport.write() per event loop iteration, unless the transport
+        asked to pause writing.
     """
 
     def __init__(self, config=None, loop=None, connection_manager=None, endpoint=None):
@@ -21,35 +45,99 @@ class ManagedProtocol(asyncio.Protocol):
         self._endpoint = endpoint
         self._transport = None
         self._config = config
-
-    def log(self, msg):
-        host, port = self._endpoint
-        logger.info("[{}:{}] ".format(host, port)+str(msg))
+        self._write_queue = []
+        self._flush_scheduled = False
+        self._writing_paused = False
+        self.flushes = 0
+        self.tls_resumed = None
+        self.metrics = None
+        if config is None or config.get("metrics", True):
+            self.metrics = ProtocolMetrics((config or {}).get("metrics_sample_every", 16))
+
+    @property
+    def bytes_flushed(self):
+        return self.metrics.bytes_out if self.metrics is not None else 0
+
+    @property
+    def queue_depth(self):
+        """Number of chunks waiting for the next flush."""
+        return len(self._write_queue)
+
+    def log(self, msg, *args, level=logging.INFO):
+        """Logs msg % args prefixed with the endpoint. Formatting only happens if level is enabled."""
+        if logger.isEnabledFor(level):
+            host, port = self._endpoint
+            logger.log(level, "[%s:%s] " + msg, host, port, *args)
 
     def connection_made(self, transport):
         self._connection_manager.register_active_connection(self._endpoint, self)
         self._transport = transport
         self.log("Connection made!")
-        host, port = transport.get_extra_info("peername")
-        self.log("Connected to: {}:{}".format(host, port))
+        host, port = transport.get_extra_info("peername")[:2]
+        self.log("Connected to: %s:%s", host, port)
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            self.tls_resumed = ssl_object.session_reused
+            self.log("%s with %s, session %s.", ssl_object.version(), ssl_object.cipher()[0],
+                     "resumed" if self.tls_resumed else "new")
 
     def data_received(self, data):
-        #self.log("[R] "+str(data))
-        pass
+        #self.log("[R] %r", data, level=logging.DEBUG)
+        if self.metrics is not None:
+            self.metrics.bytes_in += len(data)
 
     def eof_received(self):
         self.log("Eof received!")
 
     def connection_lost(self, exc):
-        self.log("Connection lost! ("+str(exc)+")")
-        self._connection_manager.unregister_active_connection(self._endpoint)
+        self.log("Connection lost! (%s)", exc)
+        del self._write_queue[:]
+        ssl_object = self._transport.get_extra_info("ssl_object") if self._transport is not None else None
+        if ssl_object is not None and isinstance(ssl_object.context, ResumingSSLContext):
+            # Sessions (TLS 1.3 tickets) arrive after the handshake, keep the latest one for the next connection.
+            ssl_object.context.remember(ssl_object.server_hostname, ssl_object)
+        self._connection_manager.unregister_active_connection(self._endpoint, self)
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self.flush()
 
     def send_data(self, data):
-        #self.log("[W] "+str(data))
+        #self.log("[W] %r", data, level=logging.DEBUG)
+        self._write_queue.append(data)
+        if self._loop is None:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self.flush)
+
+    def flush(self, force=False):
+        """Writes all queued data at once. Does nothing while writing is paused unless forced."""
+        self._flush_scheduled = False
+        if not self._write_queue or self._transport is None:
+            return
+        if self._writing_paused and not force:
+            return
+        data = b"".join(self._write_queue)
+        del self._write_queue[:]
         self._transport.write(data)
-
-    def destroy(self):
-        """ Triggered by ConnectionManager.remove_endpoint(). Closes transport. """
+        if self.metrics is not None:
+            self.metrics.bytes_out += len(data)
+        self.flushes += 1
+
+    def destroy(self, abort=False):
+        """ Triggered by ConnectionManager.remove_endpoint(). Closes transport.
+            With abort the transport is dropped right away, without waiting for
+            queued data to be written, as a dead connection would never take it.
+        """
+        if abort:
+            del self._write_queue[:]
+            self._transport.abort()
+            return
+        self.flush(force=True)
         self._transport.close()
 
     def get_config(self):
@@ -58,121 +146,589 @@ class ManagedProtocol(asyncio.Protocol):
 
 class IrcProtocol(ManagedProtocol):
     """Implementation of the IRC protocol.
+        Outgoing messages pass a token bucket configured by the "flood_burst"
+        and "flood_rate" (lines per second) config keys, a "flood_rate" of
+        None disables it. Keepalive traffic skips ahead of queued messages.
+        Received lines are decoded by a Decoder with the "fallback_encodings"
+        of the config. With "lazy_decode" messages are dispatched by their
+        raw command and only decoded once a field of them is accessed.
+        Once registered the connection is kept alive and its lag measured by
+        a Keepalive pinging every "ping_interval" seconds, it is dropped if a
+        PING stays unanswered for "ping_timeout" seconds.
     """
 
-    def __init__(self, *args, **kwargs):
+    priorities = {
+        irc.Ping: PRIORITY_KEEPALIVE,
+        irc.Pong: PRIORITY_KEEPALIVE,
+        irc.Privmsg: PRIORITY_BULK,
+        irc.Notice: PRIORITY_BULK,
+    }
+
+    def __init__(self, *args, handlers=None, commands=None, store=None, **kwargs):
         super(IrcProtocol, self).__init__(*args, **kwargs)
+        self.handlers = handlers if handlers is not None else self.default_handlers()
+        self.commands = commands if commands is not None else self.default_commands()
         self.motd = False
         self.hello = False
+        self.joins = None
+        self.keepalive = None
+        self.recorder = None
+        caps = list(self._config.get("caps", DEFAULT_CAPS))
+        self.sasl = None
+        if self._config.get("sasl"):
+            self.sasl = SaslAuthentication(self, self._config["sasl"], self.sasl_done)
+            if "sasl" not in caps:
+                caps.append("sasl")
+        self.caps = CapNegotiation(self, caps)
+        self._batches = {}
+        self._prefix_length = None
         self._config = self.get_config()
-        self._buffer = b""
+        self.isupport = ISupport()
+        self.state = NetworkState(self._config.get("nick"), self.isupport)
+        self._buffer = LineBuffer(self._config.get("max_line_length", 8704))
+        self.decoder = Decoder(self._config["encoding"], self._config.get("fallback_encodings", DEFAULT_FALLBACKS))
+        self.lazy_decode = self._config.get("lazy_decode", False)
+        # A MessageStore, possibly shared by several endpoints told apart by network.
+        self.store = store if store is not None else self._config.get("store")
+        self.network = self._config.get("network") or "{}:{}".format(*(self._endpoint or ("", "")))
+        self._flood = None
+        flood_rate = self._config.get("flood_rate", 0.5)
+        if self._loop is not None and flood_rate:
+            self._flood = FloodControl(self._loop, self.send_data, flood_rate, self._config.get("flood_burst", 5))
+
+    @property
+    def nick(self):
+        """Our current nick, as tracked by state."""
+        return self.state.nick
+
+    @nick.setter
+    def nick(self, nick):
+        self.state.nick = nick
 
     def encode(self, str):
         return str.encode(self._config["encoding"], "replace")
 
     def decode(self, bytes):
-        return bytes.decode(self._config["encoding"], "replace")
+        return self.decoder.decode(bytes)
 
     def connection_made(self, transport):
         super(IrcProtocol, self).connection_made(transport)
+        if self._config.get("record"):
+            # One file per connection, e.g. "sessions/{host}-{port}-{time}.rec".
+            host, port = self._endpoint
+            self.recorder = Recorder(self._config["record"].format(host=host, port=port, time=int(time.time())))
+        if self.caps.wanted:
+            self.caps.start()
         self.send_msg(irc.User(self._config["ident"], self._config["realname"]))
         self.send_msg(irc.Nick(self._config["nick"]))
         self.nick = self._config["nick"]
 
     def data_received(self, data):
         super(IrcProtocol, self).data_received(data)
-        self._buffer += data
-        self.process_data()
-
-    def process_data(self):
-        while b"\r\n" in self._buffer:
-            line, self._buffer = self._buffer.split(b"\r\n", 1)
-            line = self.decode(line.strip())
-            if line == "":
+        lines = self._buffer.feed(data)
+        if self.recorder is not None:
+            self.recorder.record(lines)
+        self.process_data(lines)
+
+    def process_data(self, lines):
+        metrics = self.metrics
+        decode = self.decoder.decode
+        if self.lazy_decode:
+            from_bytes = irc.Message.from_bytes
+            parse = lambda line: from_bytes(line, decode)
+        else:
+            from_string = irc.Message.from_string
+            parse = lambda line: from_string(decode(line))
+        for line in lines:
+            line = line.strip()
+            if not line:
                 continue
-            msg = irc.Message.from_string(line)
+            if metrics is None:
+                self.msg_received(parse(line))
+                continue
+            metrics.lines_parsed += 1
+            if metrics.lines_parsed % metrics.sample_every:
+                self.msg_received(parse(line))
+                continue
+            start = time.perf_counter()
+            msg = parse(line)
+            parsed = time.perf_counter()
             self.msg_received(msg)
+            metrics.parse_time.observe(parsed - start)
+            metrics.handler_latency.observe(time.perf_counter() - parsed)
 
-    def send_msg(self, msg):
+    @property
+    def queue_depth(self):
+        depth = super(IrcProtocol, self).queue_depth
+        if self._flood is not None:
+            depth += len(self._flood)
+        return depth
+
+    def connection_lost(self, exc):
+        if self._flood is not None:
+            self._flood.clear()
+        if self.joins is not None:
+            self.joins.cancel()
+        if self.keepalive is not None:
+            self.keepalive.stop()
+        self._batches.clear()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        super(IrcProtocol, self).connection_lost(exc)
+
+    def send_msg(self, msg, priority=None):
         if isinstance(msg, irc.Message):
-            self.log(msg.__repr__())
-            data = self.encode(str(msg)+"\r\n")
-            self.send_data(data)
+            data = msg.encode(self._config["encoding"])
+            if type(msg) in (irc.Privmsg, irc.Notice):
+                messages = self.split(msg, data)
+                if messages is not None:
+                    for piece in messages:
+                        self.send_msg(piece, priority)
+                    return
+            self.log("%r", msg, level=logging.DEBUG)
+            if self.recorder is not None:
+                self.recorder.record([data[:-2]], SENT)
+            if self._flood is None:
+                self.send_data(data)
+            else:
+                if priority is None:
+                    priority = self.priorities.get(type(msg), PRIORITY_CONTROL)
+                self._flood.push(data, priority)
+
+    def prefix_length(self):
+        """Bytes of the ":nick!ident@host " prefix the server puts in front of our
+            messages when relaying them. While our host is unknown (before
+            the first JOIN) the longest host name is assumed. The tracked ident
+            has its "~" stripped, so a byte for it is always reserved. Cached
+            until a message that can change it is received.
+        """
+        if self._prefix_length is not None:
+            return self._prefix_length
+        nick = self.nick or self._config.get("nick", "")
+        user = self.state.user(nick)
+        if user is not None and user.host:
+            mask = "{}!~{}@{}".format(user.nick, user.ident, user.host)
+        else:
+            mask = "{}!~{}@{}".format(nick, self._config.get("ident", ""), "h" * 63)
+        self._prefix_length = len(mask.encode(self._config["encoding"], "replace")) + 2
+        return self._prefix_length
+
+    def split(self, msg, data):
+        """The pieces a PRIVMSG or NOTICE (encoded as data) has to be sent in to fit
+            LINELEN as relayed by the server, or None if it fits as it is.
+            Line breaks always split, CTCP messages stay CTCP in every piece.
+        """
+        # data ends with the only CR and LF a message without line breaks has.
+        if (len(data) + self.prefix_length() <= self.isupport.linelen
+                and data.count(b"\n") == 1 and data.count(b"\r") == 1):
+            return None
+        text = msg.get("trailing") or ""
+        encoding = self._config["encoding"]
+        before, after = "", ""
+        if len(text) > 2 and text.startswith("\x01") and text.endswith("\x01"):
+            tag, _, text = text[1:-1].partition(" ")
+            before, after = "\x01{} ".format(tag), "\x01"
+        # The command, target and CRLF around the text.
+        overhead = len(data) - len(msg.get("trailing").encode(encoding, "replace"))
+        limit = self.isupport.linelen - self.prefix_length() - overhead - len((before + after).encode(encoding))
+        encoded = text.encode(encoding, "replace")
+        utf8 = codecs.lookup(encoding).name == "utf-8"
+        cls = type(msg)
+        target = msg.get("params")[0]
+        return [cls(target, before + piece.decode(encoding, "replace") + after)
+                for piece in irc.split_text(encoded, limit, utf8)]
+
+    def batch(self, command, targets, keys=None, trailing=None):
+        """Messages sending command to all targets in as few lines as the server's
+            TARGMAX/MAXTARGETS and LINELEN allow, see irc.batch_targets().
+        """
+        return irc.batch_targets(command, targets, keys=keys, trailing=trailing,
+                                 max_targets=self.isupport.max_targets(command),
+                                 max_length=self.isupport.linelen - 2, encoding=self._config["encoding"])
+
+    def join_messages(self, channels, keys=None):
+        """As few JOIN messages as possible for channels. keys maps channels to their keys."""
+        keys = keys or {}
+        keyed = [channel for channel in channels if channel in keys]
+        messages = []
+        if keyed:
+            messages.extend(self.batch("JOIN", keyed, keys=[keys[channel] for channel in keyed]))
+        messages.extend(self.batch("JOIN", [channel for channel in channels if channel not in keys]))
+        return messages
+
+    def join(self, channels, keys=None):
+        """Joins channels with as few JOIN lines as possible, without waiting for confirmations."""
+        messages = self.join_messages(channels, keys)
+        for msg in messages:
+            self.send_msg(msg)
+        return messages
+
+    def send_to(self, targets, message, command="PRIVMSG"):
+        """Sends the same PRIVMSG (or NOTICE) to all targets with as few lines as possible."""
+        messages = self.batch(command, targets, trailing=message)
+        for msg in messages:
+            self.send_msg(msg)
+        return messages
+
+    @classmethod
+    def default_handlers(cls):
+        """Returns a new HandlerRegistry with the built-in behaviour registered."""
+        handlers = HandlerRegistry()
+        handlers.register(irc.Ping, cls.on_ping)
+        handlers.register(irc.Pong, cls.on_pong)
+        handlers.register(irc.Numeric376, cls.on_end_of_motd)
+        handlers.register(irc.Privmsg, cls.on_privmsg)
+        handlers.register(irc.Kick, cls.on_kick)
+        handlers.register(irc.Cap, cls.on_cap)
+        handlers.register(irc.Numeric001, cls.on_welcome)
+        handlers.register(irc.Authenticate, cls.on_authenticate)
+        handlers.register(irc.Numeric900, cls.on_logged_in)
+        handlers.register(irc.Numeric903, cls.on_sasl_success)
+        for error in irc.SASL_ERRORS:
+            handlers.register(error, cls.on_sasl_failure)
+        handlers.register(irc.Join, cls.on_join)
+        for error in irc.JOIN_ERRORS:
+            handlers.register(error, cls.on_join_error)
+        return handlers
+
+    @classmethod
+    def default_commands(cls):
+        """Returns a new CommandRouter with the built-in commands and CTCP replies."""
+        commands = CommandRouter(prefix="-")
+        commands.add("cycle", cls.cycle_command, help="Parts and rejoins the channel.")
+        commands.add("version", ctcp_version("HalloWelt lustiger Client v0.0.1"), ctcp=True)
+        commands.add("ping", ctcp_ping, "*payload", ctcp=True)
+        commands.add("time", ctcp_time, ctcp=True)
+        return commands
 
     def msg_received(self, msg):
-        self.log(msg.__repr__())
-        if isinstance(msg, irc.Ping):
-            self.send_msg(irc.Pong(msg))
-        if isinstance(msg, irc.Message) and msg.get('command') == "376":
-            self.ready()
-        if isinstance(msg, irc.Privmsg):
-            if msg.message == "-cycle":
-                self.send_msg(irc.Part(msg.target, "Hop!"))
-                self.send_msg(irc.Join(msg.target))
-        if isinstance(msg, irc.Privmsg):
-            if msg.message.startswith("\x01") and msg.message.endswith("\x01"):
-                text = msg.message.strip("\x01")
-                if text.upper() == "VERSION":
-                    self.send_msg(irc.Privmsg(msg.get("nick"), "\x01HalloWelt lustiger Client v0.0.1\x01"))
-        if isinstance(msg, irc.Kick):
-            if msg.target == self.nick:
-                self.send_msg(irc.Join(msg.channel))
-                self.send_msg(irc.Privmsg(msg.channel, "Hey, das war nicht nett!"))
+        self.log("%r", msg, level=logging.DEBUG)
+        if self.metrics is not None:
+            self.metrics.dispatched[type(msg).__name__] += 1
+        if self._batches:
+            batch = self._batches.get(msg.get("tags").get("batch"))
+            if batch is not None and not (type(msg) is irc.Batch and not msg.opening):
+                batch.messages.append(msg)
+                if type(msg) is irc.Batch:
+                    # A nested batch, handed over as part of the outer one.
+                    self._batches[msg.reference] = msg
+                return
+        if type(msg) is irc.Batch:
+            self.batch_received(msg)
+            return
+        # Handlers already see the state after this message.
+        self.state.update(msg)
+        if type(msg) in PREFIX_CHANGES:
+            self._prefix_length = None
+        if self.store is not None:
+            self.store.append(self.network, msg, self.isupport.chantypes)
+        self.handlers.dispatch(self, msg)
+
+    def batch_received(self, msg):
+        """Collects IRCv3 batches. Their messages are applied to the state and
+            the batch is dispatched to the handlers of irc.Batch as a whole
+            once it is closed, the messages are not dispatched one by one.
+        """
+        if msg.opening:
+            self._batches[msg.reference] = msg
+            return
+        batch = self._batches.pop(msg.reference, None)
+        if batch is None:
+            return
+        if batch.get("tags").get("batch") in self._batches:
+            # Nested, the outer batch already holds it.
+            return
+        self._apply_batch(batch)
+        self.handlers.dispatch(self, batch)
+
+    def _apply_batch(self, batch):
+        for member in batch.messages:
+            if type(member) is irc.Batch:
+                self._apply_batch(member)
+            else:
+                self.state.update(member)
+                if type(member) in PREFIX_CHANGES:
+                    self._prefix_length = None
+                if self.store is not None:
+                    self.store.append(self.network, member, self.isupport.chantypes)
+
+    def on_ping(self, msg):
+        self.send_msg(irc.Pong(msg))
+
+    def on_pong(self, msg):
+        if self.keepalive is not None:
+            self.keepalive.on_pong(msg)
+
+    def on_end_of_motd(self, msg):
+        self.ready()
+
+    def on_cap(self, msg):
+        if self.sasl is not None and msg.subcommand == "ACK" and "sasl" in msg.caps and self.sasl.succeeded is None:
+            # Registration has to wait for the outcome, CAP END is sent after it.
+            self.caps.hold()
+            self.sasl.start()
+        elif self.sasl_required() and self.sasl.succeeded is None and self._sasl_refused(msg):
+            # Before CAP END, so the server never registers us.
+            self.log("SASL is required but not available, giving up on this connection.", level=logging.ERROR)
+            self.destroy()
+            return
+        self.caps.on_cap(msg)
+
+    def sasl_required(self):
+        return self.sasl is not None and self._config["sasl"].get("required", False)
+
+    def _sasl_refused(self, msg):
+        """Whether msg means sasl can not be used: the last CAP LS line without it, or a NAK of it."""
+        if msg.subcommand == "LS" and not msg.more:
+            return "sasl" not in self.caps.available and "sasl" not in [cap.partition("=")[0] for cap in msg.caps]
+        return msg.subcommand == "NAK" and "sasl" in msg.caps
+
+    def on_authenticate(self, msg):
+        if self.sasl is not None:
+            self.sasl.on_authenticate(msg)
+
+    def on_logged_in(self, msg):
+        if self.sasl is not None:
+            self.sasl.on_logged_in(msg)
+        self.log("Logged in as %s.", msg.account)
+
+    def on_sasl_success(self, msg):
+        if self.sasl is not None:
+            self.sasl.on_success(msg)
+
+    def on_sasl_failure(self, msg):
+        if self.sasl is not None:
+            self.sasl.on_failure(msg)
+
+    def sasl_done(self, succeeded):
+        if not succeeded and self.sasl_required():
+            self.log("SASL is required, giving up on this connection.", level=logging.ERROR)
+            self.destroy()
+            return
+        self.caps.release()
+
+    def on_welcome(self, msg):
+        self.caps.finish()
+        if self.sasl_required() and not self.sasl.succeeded:
+            # A server without CAP support registered us right away.
+            self.log("SASL is required but the server registered us without it, giving up.", level=logging.ERROR)
+            self.destroy()
+            return
+        interval = self._config.get("ping_interval", 60)
+        if self._loop is not None and interval and self.keepalive is None:
+            wheel = self._config.get("timer_wheel")
+            if wheel is None:
+                wheel = shared_wheel(self._loop)
+            self.keepalive = Keepalive(self, wheel, interval, self._config.get("ping_timeout", 120))
+            self.keepalive.start()
+
+    def on_privmsg(self, msg):
+        if self.state.is_me(msg.source):
+            # Our own message, echoed by echo-message.
+            return
+        self.commands.dispatch(self, msg)
+
+    def cycle_command(self, msg, args):
+        if self.state.is_channel(msg.target):
+            self.send_msg(irc.Part(msg.target, "Hop!"))
+            self.send_msg(irc.Join(msg.target))
+
+    def on_kick(self, msg):
+        if self.state.is_me(msg.target):
+            self.send_msg(irc.Join(msg.channel))
+            self.send_msg(irc.Privmsg(msg.channel, "Hey, das war nicht nett!"))
+
+    def on_join(self, msg):
+        if self.joins is not None and self.state.is_me(msg.nick):
+            self.joins.confirm(msg.channel)
+
+    def on_join_error(self, msg):
+        if self.joins is not None:
+            self.joins.fail(msg.channel, msg.reason)
+
+    def greet(self, channels):
+        greeting = self._config.get("greeting", "Hallo Welt!")
+        if greeting:
+            self.send_to(channels, greeting)
 
     def ready(self):
-        for channel in self._config["channels"]:
-            self.send_msg(irc.Join(channel))
-            self.send_msg(irc.Privmsg(channel, "Hallo Welt!"))
+        """Joins the configured channels in stages of join_stage_lines JOIN lines,
+            see JoinStager. Failures end up in joins.failed.
+        """
+        self.joins = JoinStager(self, self._config["channels"], self._config.get("channel_keys"),
+                                stage_lines=self._config.get("join_stage_lines", 1),
+                                timeout=self._config.get("join_timeout", 30.0), on_stage=self.greet)
+        self.joins.start()
+
+    def update_channels(self, old_channels):
+        """Joins and parts channels after the "channels" config changed from
+            old_channels, the keys of new channels are taken from "channel_keys".
+        """
+        if self.joins is None:
+            # Not registered yet, ready() joins the new channels.
+            return
+        fold = self.state.fold
+        old = {fold(channel) for channel in old_channels}
+        new = {fold(channel) for channel in self._config["channels"]}
+        joins = [channel for channel in self._config["channels"] if fold(channel) not in old]
+        parts = [channel for channel in old_channels if fold(channel) not in new]
+        if joins:
+            self.join(joins, self._config.get("channel_keys"))
+        for msg in self.batch("PART", parts):
+            self.send_msg(msg)
 
 class ConnectionManager(object):
     """Takes care of known endpoints that a connections shall be established to.
         Stores configurations for every configuration.
+        When to (re)connect is decided by a ReconnectScheduler, available as
+        reconnects, which can be queried for per-endpoint failures and timing.
     """
 
-    def __init__(self, loop):
+    def __init__(self, loop, **reconnect_options):
         self._loop = loop
+        self.handlers = IrcProtocol.default_handlers()
+        self.commands = IrcProtocol.default_commands()
+        self.reconnects = ReconnectScheduler(loop, self._create_connection, **reconnect_options)
         self._endpoints = []
         self._configs = {}
         self._active_connections = {}
-        self._loop.set_exception_handler(self._handle_async_exception)
+        self._closed_metrics = {}
+        self._tls_contexts = {}
+        self._stores = {}
 
     def add_endpoint(self, endpoint, config):
-        logger.debug("Endpoint added: {}:{}".format(*endpoint))
+        logger.debug("Endpoint added: %s:%s", *endpoint)
         self._endpoints.append(endpoint)
         self._configs[endpoint] = config
-        self._create_connection(endpoint)
-
-    def _create_connection(self, endpoint):
-        protocol = IrcProtocol(config=self._configs[endpoint], loop=self._loop, connection_manager=self, endpoint=endpoint)
-        coroutine = self._loop.create_connection(lambda: protocol, *endpoint)
-        logger.debug("Coroutine for endpoint {}:{} created.".format(*endpoint))
-        asyncio.ensure_future(coroutine)
-        logger.debug("Coroutine for endpoint {}:{} ensured.".format(*endpoint))
+        self.reconnects.schedule(endpoint, immediately=True)
+
+    def update_endpoint(self, endpoint, config):
+        """Replaces the config of endpoint without reconnecting, for changes the
+            live connection can follow. Channel changes join and part channels.
+        """
+        old = self._configs[endpoint]
+        old_channels = list(old.get("channels", []))
+        # The connection holds the same dict.
+        old.clear()
+        old.update(config)
+        protocol = self._active_connections.get(endpoint)
+        if protocol is not None:
+            protocol.update_channels(old_channels)
+
+    def configs(self):
+        """The config of every endpoint."""
+        return dict(self._configs)
+
+    def tls_context(self, endpoint):
+        """The SSLContext for endpoint, or None for plaintext. Contexts built from
+            the config are kept per endpoint, so reconnects can resume TLS sessions.
+        """
+        config = self._configs[endpoint]
+        context = config.get("ssl")
+        if not context:
+            return None
+        if isinstance(context, ssl.SSLContext):
+            return context
+        if endpoint not in self._tls_contexts:
+            self._tls_contexts[endpoint] = create_context(config.get("ssl_cafile"), config.get("ssl_certfile"),
+                                                          config.get("ssl_keyfile"), config.get("ssl_verify", True))
+        return self._tls_contexts[endpoint]
+
+    def store(self, directory):
+        """The MessageStore in directory, shared by all endpoints configured with it."""
+        if directory not in self._stores:
+            self._stores[directory] = MessageStore(directory, loop=self._loop)
+        return self._stores[directory]
+
+    def close_stores(self):
+        for store in self._stores.values():
+            store.close()
+        self._stores.clear()
+
+    async def _create_connection(self, endpoint):
+        config = self._configs[endpoint]
+        # A directory from a config file, or a MessageStore passed in by code.
+        store = config.get("store")
+        if isinstance(store, str):
+            store = self.store(store)
+        protocol = IrcProtocol(config=config, loop=self._loop, connection_manager=self, endpoint=endpoint, handlers=self.handlers,
+                               commands=self.commands, store=store)
+        logger.debug("Connecting to endpoint %s:%s.", *endpoint)
+        context = self.tls_context(endpoint)
+        if context is None:
+            await self._loop.create_connection(lambda: protocol, *endpoint)
+        else:
+            await self._loop.create_connection(lambda: protocol, *endpoint, ssl=context,
+                                               server_hostname=config.get("ssl_server_hostname", endpoint[0]))
 
     def remove_endpoint(self, endpoint):
-        logger.debug("Endpoint removed: {}:{}".format(*endpoint))
+        logger.debug("Endpoint removed: %s:%s", *endpoint)
         self._endpoints.remove(endpoint)
         del self._configs[endpoint]
-        if endpoint in self._active_connections:
-            self._active_connections[endpoint].close()
+        self._closed_metrics.pop(endpoint, None)
+        self._tls_contexts.pop(endpoint, None)
+        self.reconnects.forget(endpoint)
+        # Unregistered right away, the endpoint may be added again before the connection is lost.
+        protocol = self._active_connections.pop(endpoint, None)
+        if protocol is not None:
+            protocol.destroy()
+
+    def close_all(self):
+        """Removes every endpoint and closes its connection, for shutting down."""
+        for endpoint in list(self._endpoints):
+            self.remove_endpoint(endpoint)
 
     def register_active_connection(self, endpoint, protocol):
         self._active_connections[endpoint] = protocol
+        self.reconnects.connected(endpoint)
 
-    def unregister_active_connection(self, endpoint):
+    def unregister_active_connection(self, endpoint, protocol):
+        if self._active_connections.get(endpoint) is not protocol:
+            # A connection of a removed endpoint, its loss is no failure of whatever runs there now.
+            return
         del self._active_connections[endpoint]
-        self._create_connection(endpoint)
-
-    def _handle_async_exception(self, loop, context):
-        """Trying to take care of connection related exceptions."""
-        logger.error("An async exception has been caught: "+str(context["exception"]))
-        stack = context["future"].get_stack()
-        if len(stack) > 1 and stack[1].f_code.co_name == "create_connection":
-            last_stackframe = stack[len(stack)-1]
-            call_args = inspect.getargvalues(last_stackframe)
-            host = call_args.locals["host"]
-            port = call_args.locals["port"]
-            logger.error("Bad endpoint: {}:{}".format(host, port))
-            self.remove_endpoint((host, port))
-        else:
-            loop.call_exception_handler(context)
+        if protocol.metrics is not None:
+            # Keep counting across reconnects.
+            self._closed_metrics.setdefault(endpoint, ProtocolMetrics()).merge(protocol.metrics)
+        if endpoint in self._configs:
+            self.reconnects.disconnected(endpoint)
+
+    def stats(self):
+        protocols = list(self._active_connections.values())
+        return {
+            "endpoints": len(self._endpoints),
+            "active": len(protocols),
+            "bytes_flushed": sum(protocol.bytes_flushed for protocol in protocols),
+            "queue_depth": sum(protocol.queue_depth for protocol in protocols),
+            "reconnect_attempts": sum(state["attempts"] for state in self.reconnects.states().values()),
+        }
+
+    def metrics(self):
+        """Per endpoint (ProtocolMetrics, gauges) tuples, counters include earlier connections."""
+        result = {}
+        states = self.reconnects.states()
+        for endpoint in self._endpoints:
+            metrics = ProtocolMetrics()
+            if endpoint in self._closed_metrics:
+                metrics.merge(self._closed_metrics[endpoint])
+            protocol = self._active_connections.get(endpoint)
+            if protocol is not None and protocol.metrics is not None:
+                metrics.merge(protocol.metrics)
+            state = states.get(endpoint, {})
+            gauges = {
+                "connected": int(protocol is not None),
+                "send_queue_depth": protocol.queue_depth if protocol is not None else 0,
+                "reconnect_attempts_total": state.get("attempts", 0),
+                "reconnect_failures": state.get("failures", 0),
+            }
+            keepalive = protocol.keepalive if protocol is not None else None
+            if keepalive is not None and keepalive.samples:
+                gauges["lag_seconds"] = keepalive.lag
+                gauges["lag_max_seconds"] = keepalive.max_lag
+            result["{}:{}".format(*endpoint)] = (metrics, gauges)
+        return result
+
+    def render_metrics(self):
+        """A Prometheus text format snapshot of metrics()."""
+        return render_prometheus(self.metrics())
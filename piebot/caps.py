@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from . import irc
+
+# Capabilities piebot understands, requested if the server offers them.
+DEFAULT_CAPS = ("multi-prefix", "userhost-in-names", "batch", "echo-message", "message-tags", "server-time",
+                "cap-notify")
+
+
+class CapNegotiation(object):
+    """IRCv3 capability negotiation of one connection. start() sends CAP LS
+        ahead of registration, the wanted capabilities the server lists are
+        requested and CAP END is sent once all of them are acknowledged or
+        refused. Steps that need to happen before CAP END (e.g. SASL) call
+        hold() and release(). available maps the listed capabilities to
+        their values, enabled holds the acknowledged ones.
+    """
+
+    def __init__(self, protocol, wanted=DEFAULT_CAPS):
+        self._protocol = protocol
+        self.wanted = tuple(wanted)
+        self.available = {}
+        self.enabled = set()
+        self.requested = set()
+        self.done = False
+        self._holds = 0
+
+    def start(self):
+        self._protocol.send_msg(irc.Cap("LS", "302"))
+
+    def hold(self):
+        self._holds += 1
+
+    def release(self):
+        self._holds -= 1
+        self._maybe_end()
+
+    def finish(self):
+        """Negotiation is over, either by CAP END or because the server registered us without it."""
+        self.done = True
+
+    def on_cap(self, msg):
+        subcommand = msg.subcommand
+        if subcommand in ("LS", "NEW"):
+            for cap in msg.caps:
+                name, _, value = cap.partition("=")
+                self.available[name] = value
+            if msg.more:
+                return
+            self._request([name for name in self.wanted if name in self.available and name not in self.enabled])
+            self._maybe_end()
+        elif subcommand == "ACK":
+            for name in msg.caps:
+                if name.startswith("-"):
+                    self.enabled.discard(name[1:])
+                else:
+                    self.enabled.add(name)
+                self.requested.discard(name.lstrip("-"))
+            self._protocol.log("Capabilities enabled: %s", " ".join(sorted(self.enabled)))
+            self._maybe_end()
+        elif subcommand == "NAK":
+            for name in msg.caps:
+                self.requested.discard(name)
+            self._protocol.log("Capabilities refused: %s", " ".join(msg.caps), level=logging.WARNING)
+            self._maybe_end()
+        elif subcommand == "DEL":
+            for name in msg.caps:
+                self.available.pop(name, None)
+                self.enabled.discard(name)
+
+    def _request(self, names):
+        # CAP REQ lines are limited to 510 bytes like any other line, leave room for the command.
+        line = []
+        length = 0
+        for name in names:
+            if line and length + len(name) + 1 > 500:
+                self._protocol.send_msg(irc.Cap("REQ", " ".join(line)))
+                line, length = [], 0
+            line.append(name)
+            length += len(name) + 1
+            self.requested.add(name)
+        if line:
+            self._protocol.send_msg(irc.Cap("REQ", " ".join(line)))
+
+    def _maybe_end(self):
+        if self.done or self.requested or self._holds:
+            return
+        self.done = True
+        self._protocol.send_msg(irc.Cap("END"))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import time
+
+from . import irc
+from .flood import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Argument types of command specs, e.g. "count:int".
+TYPES = {"str": str, "int": int, "float": float}
+
+
+class UsageError(ValueError):
+    """Arguments that do not match a command's spec."""
+
+
+class Command(object):
+    """A command triggered by prefix + name (or an alias) at the start of a
+        PRIVMSG, or a CTCP request if ctcp is set. handler is called as
+        handler(protocol, msg, args), args mapping the names of spec to the
+        parsed arguments. A spec like "nick count:int? *text" takes a word,
+        an optional integer and the rest of the line, "?" marks optional
+        arguments, which are None if missing. cooldown is the time in seconds
+        the command stays silent after it was used.
+    """
+    __slots__ = ("name", "handler", "spec", "aliases", "cooldown", "ctcp", "help", "last_used", "_args")
+
+    def __init__(self, name, handler, spec="", aliases=(), cooldown=0, ctcp=False, help=None):
+        self.name = name
+        self.handler = handler
+        self.spec = spec
+        self.aliases = tuple(aliases)
+        self.cooldown = cooldown
+        self.ctcp = ctcp
+        self.help = help
+        self.last_used = None
+        self._args = []
+        for token in spec.split():
+            rest = token.startswith("*")
+            optional = token.endswith("?")
+            name, _, kind = token.strip("*?").partition(":")
+            if kind and kind not in TYPES:
+                raise ValueError("unknown argument type {} in {!r}".format(kind, spec))
+            self._args.append((name, TYPES[kind or "str"], optional, rest))
+
+    def usage(self):
+        return "{} {}".format(self.name, self.spec).rstrip()
+
+    def parse(self, text):
+        """The arguments in text as a dict, raises UsageError if they do not fit the spec."""
+        args = {}
+        words = text.split()
+        for i, (name, kind, optional, rest) in enumerate(self._args):
+            if rest:
+                value = text.split(None, i)[i] if len(words) > i else None
+                words = []
+            else:
+                value = words.pop(0) if words else None
+            if value is None:
+                if not optional and not rest:
+                    raise UsageError("missing {}".format(name))
+                args[name] = "" if rest else None
+                continue
+            try:
+                args[name] = kind(value)
+            except ValueError:
+                raise UsageError("{} must be {}".format(name, kind.__name__))
+        if words:
+            raise UsageError("too many arguments")
+        return args
+
+
+class CommandRouter(object):
+    """Routes PRIVMSGs to Commands. The trigger is the first word of a message
+        starting with prefix, or of one addressed to the bot ("Pb42: help"),
+        looked up in a single dict, so routing costs the same for any number
+        of commands. CTCP requests go through the same table.
+
+        Every user can trigger user_burst commands at once and user_rate per
+        second after that, the buckets of the max_users most recently seen
+        users are kept. Commands that are cooling down or over the limit are
+        ignored silently, so they can not be used to flood the bot off.
+    """
+
+    def __init__(self, prefix="!", user_rate=0.5, user_burst=3, max_users=4096, clock=time.monotonic):
+        self.prefix = prefix
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self._clock = clock
+        self._table = {}
+        self._users = collections.OrderedDict()
+        self.routed = 0
+        self.limited = 0
+
+    def add(self, name, handler, spec="", aliases=(), cooldown=0, ctcp=False, help=None):
+        """Adds a command and returns it. CTCP commands are matched case-insensitively, like all others."""
+        command = Command(name, handler, spec, aliases, cooldown, ctcp, help)
+        for trigger in (name,) + command.aliases:
+            key = (ctcp, trigger.lower())
+            if key in self._table:
+                raise ValueError("{} is already a trigger of {}".format(trigger, self._table[key].name))
+            self._table[key] = command
+        return command
+
+    def command(self, name, spec="", **options):
+        """Decorator version of add()."""
+        def decorator(handler):
+            self.add(name, handler, spec, **options)
+            return handler
+        return decorator
+
+    def remove(self, name, ctcp=False):
+        command = self._table[(ctcp, name.lower())]
+        for trigger in (command.name,) + command.aliases:
+            del self._table[(ctcp, trigger.lower())]
+
+    def get(self, name, ctcp=False):
+        return self._table.get((ctcp, name.lower()))
+
+    def commands(self):
+        """The commands, without CTCP, each once."""
+        return sorted({id(command): command for (ctcp, _), command in self._table.items() if not ctcp}.values(),
+                      key=lambda command: command.name)
+
+    def _allowed(self, protocol, nick):
+        if not self.user_rate:
+            return True
+        key = (protocol.network, protocol.state.fold(nick))
+        users = self._users
+        bucket = users.get(key)
+        if bucket is None:
+            bucket = users[key] = TokenBucket(self.user_rate, self.user_burst, clock=self._clock)
+            if len(users) > self.max_users:
+                users.popitem(last=False)
+        else:
+            users.move_to_end(key)
+        return bucket.consume()
+
+    def dispatch(self, protocol, msg):
+        """Runs the command msg triggers, if any. Returns whether one ran."""
+        text = msg.message
+        if text.startswith("\x01"):
+            ctcp = True
+            text = text.strip("\x01")
+        elif self.prefix and text.startswith(self.prefix):
+            ctcp = False
+            text = text[len(self.prefix):]
+        else:
+            nick = protocol.nick
+            if not nick or not text.startswith(nick) or text[len(nick):len(nick)+1] not in (":", ","):
+                return False
+            ctcp = False
+            text = text[len(nick)+1:].lstrip()
+        trigger, _, text = text.partition(" ")
+        command = self._table.get((ctcp, trigger.lower()))
+        if command is None:
+            return False
+        now = self._clock()
+        if command.cooldown and command.last_used is not None and now - command.last_used < command.cooldown:
+            self.limited += 1
+            return False
+        if not self._allowed(protocol, msg.source):
+            self.limited += 1
+            return False
+        try:
+            args = command.parse(text)
+        except UsageError as e:
+            self.reply(protocol, msg, command, "{} (usage: {}{})".format(e, "" if ctcp else self.prefix,
+                                                                         command.usage()))
+            return True
+        command.last_used = now
+        self.routed += 1
+        result = command.handler(protocol, msg, args)
+        if result is not None:
+            self.reply(protocol, msg, command, result)
+        return True
+
+    def reply(self, protocol, msg, command, result):
+        """Sends result (a string, a Message or an iterable of them) in response to msg.
+            Strings go to the channel msg was sent to, or to its sender if it
+            was private. CTCP replies are NOTICEs to the sender.
+        """
+        if isinstance(result, (str, irc.Message)):
+            result = [result]
+        for item in result:
+            if isinstance(item, irc.Message):
+                protocol.send_msg(item)
+            elif command.ctcp:
+                body = "{} {}".format(command.name.upper(), item).rstrip()
+                protocol.send_msg(irc.Notice(msg.source, "\x01{}\x01".format(body)))
+            elif protocol.state.is_channel(msg.target):
+                protocol.send_msg(irc.Privmsg(msg.target, item))
+            else:
+                protocol.send_msg(irc.Privmsg(msg.source, item))
+
+
+def ctcp_version(version):
+    def reply(protocol, msg, args):
+        return version
+    return reply
+
+
+def ctcp_ping(protocol, msg, args):
+    return args["payload"]
+
+
+def ctcp_time(protocol, msg, args):
+    return time.strftime("%a %b %d %H:%M:%S %Y %z")
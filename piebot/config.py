@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import copy
+import json
+import logging
+import os
+import signal
+
+logger = logging.getLogger(__name__)
+
+# Config keys that are applied to a live connection, changing any other key reconnects.
+LIVE_KEYS = ("channels", "channel_keys", "greeting")
+
+REQUIRED = ("host", "nick", "ident", "realname")
+
+
+def _string(value):
+    return isinstance(value, str) and value != ""
+
+
+def _optional_string(value):
+    return value is None or _string(value)
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def _optional_number(value):
+    return value is None or _number(value)
+
+
+def _integer(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _bool(value):
+    return isinstance(value, bool)
+
+
+def _strings(value):
+    return isinstance(value, list) and all(_string(item) for item in value)
+
+
+def _encoding(value):
+    try:
+        codecs.lookup(value)
+    except (LookupError, TypeError):
+        return False
+    return True
+
+
+def _encodings(value):
+    return isinstance(value, list) and all(_encoding(item) for item in value)
+
+
+def _channel_keys(value):
+    return isinstance(value, dict) and all(_string(key) and _string(item) for key, item in value.items())
+
+
+def _sasl(value):
+    return (isinstance(value, dict) and set(value) <= {"mechanism", "username", "password", "required"}
+            and value.get("mechanism", "PLAIN") in ("PLAIN", "EXTERNAL"))
+
+
+# Validators of the endpoint keys, with what is expected for error messages.
+KEYS = {
+    "host": (_string, "a host name"),
+    "port": (lambda value: _integer(value) and value < 65536, "a port number"),
+    "encoding": (_encoding, "a known encoding"),
+    "fallback_encodings": (_encodings, "a list of known encodings"),
+    "lazy_decode": (_bool, "true or false"),
+    "nick": (_string, "a string"),
+    "ident": (_string, "a string"),
+    "realname": (_string, "a string"),
+    "channels": (_strings, "a list of channel names"),
+    "channel_keys": (_channel_keys, "an object of channel names to keys"),
+    "greeting": (_optional_string, "a string or null"),
+    "network": (_optional_string, "a string or null"),
+    "flood_rate": (_optional_number, "lines per second or null"),
+    "flood_burst": (_integer, "a positive integer"),
+    "max_line_length": (_integer, "a positive integer"),
+    "metrics": (_bool, "true or false"),
+    "metrics_sample_every": (_integer, "a positive integer"),
+    "join_stage_lines": (_integer, "a positive integer"),
+    "join_timeout": (_number, "seconds"),
+    "ping_interval": (_optional_number, "seconds or null"),
+    "ping_timeout": (_number, "seconds"),
+    "caps": (_strings, "a list of capabilities"),
+    "sasl": (_sasl, "an object of mechanism (PLAIN or EXTERNAL), username, password and required"),
+    "ssl": (_bool, "true or false"),
+    "ssl_cafile": (_optional_string, "a path or null"),
+    "ssl_certfile": (_optional_string, "a path or null"),
+    "ssl_keyfile": (_optional_string, "a path or null"),
+    "ssl_verify": (_bool, "true or false"),
+    "ssl_server_hostname": (_optional_string, "a host name or null"),
+    "record": (_optional_string, "a path template or null"),
+    "store": (_optional_string, "a directory or null"),
+}
+
+
+class ConfigError(ValueError):
+    """An invalid config file, problems lists everything that is wrong with it."""
+
+    def __init__(self, path, problems):
+        super().__init__("{}: {}".format(path, "; ".join(problems)))
+        self.path = path
+        self.problems = problems
+
+
+def parse_config(data, path="<config>"):
+    """Validates a config, as loaded from JSON, and returns a dict of
+        (host, port) endpoints to their configs. Every endpoint's config is
+        "defaults" updated with the endpoint's own keys. All problems are
+        collected and raised together as a ConfigError.
+    """
+    problems = []
+    if not isinstance(data, dict) or set(data) - {"defaults", "endpoints"}:
+        raise ConfigError(path, ["expected an object of \"defaults\" and \"endpoints\""])
+    defaults = data.get("defaults", {})
+    endpoints = data.get("endpoints", [])
+    if not isinstance(defaults, dict):
+        problems.append("\"defaults\" must be an object")
+        defaults = {}
+    if not isinstance(endpoints, list):
+        raise ConfigError(path, problems + ["\"endpoints\" must be a list"])
+    configs = {}
+    for i, endpoint in enumerate(endpoints):
+        where = "endpoints[{}]".format(i)
+        if not isinstance(endpoint, dict):
+            problems.append("{} must be an object".format(where))
+            continue
+        config = {"port": 6667, "encoding": "utf-8", "channels": []}
+        # Copies, endpoints must not share the lists of the defaults.
+        config.update(copy.deepcopy(defaults))
+        config.update(copy.deepcopy(endpoint))
+        for key in REQUIRED:
+            if key not in config:
+                problems.append("{} has no {}".format(where, key))
+        for key, value in sorted(config.items()):
+            if key not in KEYS:
+                problems.append("{}: unknown key {}".format(where, key))
+            elif not KEYS[key][0](value):
+                problems.append("{}: {} must be {}, not {!r}".format(where, key, KEYS[key][1], value))
+        if "host" not in config or "port" not in config:
+            continue
+        key = (config.pop("host"), config.pop("port"))
+        if key in configs:
+            problems.append("{}: {}:{} is configured twice".format(where, *key))
+        configs[key] = config
+    if problems:
+        raise ConfigError(path, problems)
+    return configs
+
+
+def load_config(path):
+    """Reads the JSON config file at path, see parse_config()."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except OSError as e:
+        raise ConfigError(path, [e.strerror or str(e)])
+    except ValueError as e:
+        raise ConfigError(path, ["invalid JSON: {}".format(e)])
+    return parse_config(data, path)
+
+
+def apply_config(connection_manager, configs):
+    """Brings connection_manager to configs by the smallest change: new
+        endpoints are added, missing ones removed, changes of LIVE_KEYS
+        only are applied to the running connection and endpoints with other
+        changes reconnect. Unchanged endpoints are left alone. Returns the
+        (added, removed, updated, reconnected) endpoints.
+    """
+    current = connection_manager.configs()
+    added = [endpoint for endpoint in configs if endpoint not in current]
+    removed = [endpoint for endpoint in current if endpoint not in configs]
+    updated, reconnected = [], []
+    for endpoint, config in configs.items():
+        old = current.get(endpoint)
+        if old is None or old == config:
+            continue
+        if {key: value for key, value in old.items() if key not in LIVE_KEYS} == \
+                {key: value for key, value in config.items() if key not in LIVE_KEYS}:
+            connection_manager.update_endpoint(endpoint, config)
+            updated.append(endpoint)
+        else:
+            reconnected.append(endpoint)
+    for endpoint in removed:
+        connection_manager.remove_endpoint(endpoint)
+    for endpoint in reconnected:
+        connection_manager.remove_endpoint(endpoint)
+        connection_manager.add_endpoint(endpoint, configs[endpoint])
+    for endpoint in added:
+        connection_manager.add_endpoint(endpoint, configs[endpoint])
+    return added, removed, updated, reconnected
+
+
+class ConfigReloader(object):
+    """Loads the config file at path into connection_manager and reloads it
+        on SIGHUP and, every poll_interval seconds, when its modification
+        time changed. An invalid file is logged and changes nothing.
+    """
+
+    def __init__(self, loop, connection_manager, path, poll_interval=2.0):
+        self._loop = loop
+        self._connection_manager = connection_manager
+        self.path = path
+        self.poll_interval = poll_interval
+        self._mtime = None
+        self._timer = None
+        self._signal = False
+
+    def start(self):
+        """Applies the config once, raising ConfigError if it is invalid, and starts watching it."""
+        self._mtime = self._stat()
+        apply_config(self._connection_manager, load_config(self.path))
+        if hasattr(signal, "SIGHUP"):
+            try:
+                self._loop.add_signal_handler(signal.SIGHUP, self.reload)
+                self._signal = True
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not on the main thread or not supported by the loop.
+                pass
+        if self.poll_interval:
+            self._timer = self._loop.call_later(self.poll_interval, self._poll)
+        return self
+
+    def stop(self):
+        if self._signal:
+            self._loop.remove_signal_handler(signal.SIGHUP)
+            self._signal = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _poll(self):
+        self._timer = self._loop.call_later(self.poll_interval, self._poll)
+        mtime = self._stat()
+        if mtime is not None and mtime != self._mtime:
+            self.reload()
+
+    def reload(self):
+        """Loads and applies the config file, returns whether it was valid."""
+        self._mtime = self._stat()
+        try:
+            configs = load_config(self.path)
+        except ConfigError as e:
+            logger.error("Not reloading invalid config %s", e)
+            return False
+        added, removed, updated, reconnected = apply_config(self._connection_manager, configs)
+        logger.info("Reloaded %s: %d added, %d removed, %d updated, %d reconnected.",
+                    self.path, len(added), len(removed), len(updated), len(reconnected))
+        return True
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import collections
+
+# Tried in order for lines that are not valid in the connection's encoding,
+# latin-1 decodes anything, so replacement characters are only left if it is removed.
+DEFAULT_FALLBACKS = ("cp1252", "latin-1")
+
+
+def sender_of(data):
+    """The nick (or server name) in the prefix of an undecoded line, lowercased, b"" without a prefix."""
+    start = 0
+    if data[0:1] == b"@":
+        start = data.find(b" ") + 1
+        while data[start:start+1] == b" ":
+            start += 1
+    if data[start:start+1] != b":":
+        return b""
+    end = data.find(b" ", start)
+    if end == -1:
+        end = len(data)
+    bang = data.find(b"!", start, end)
+    return data[start+1:bang if bang != -1 else end].lower()
+
+
+class Decoder(object):
+    """Decodes the received lines of a connection. Every line is decoded
+        strictly with encoding first, which is all it takes for the valid
+        UTF-8 most clients send. Lines that fail are decoded with the first
+        of fallbacks that fits, the fallback that worked is remembered for
+        the sender (the last max_senders of them) and tried first for their
+        next line, so a latin-1 user costs a single extra decode per line.
+        Only if all of them fail the line is decoded with replacement
+        characters.
+    """
+    __slots__ = ("encoding", "fallbacks", "max_senders", "fallback_lines", "replaced_lines", "_senders")
+
+    def __init__(self, encoding="utf-8", fallbacks=DEFAULT_FALLBACKS, max_senders=1024):
+        self.encoding = encoding
+        # Fallbacks that are the same codec as encoding could never succeed.
+        name = codecs.lookup(encoding).name
+        self.fallbacks = tuple(fallback for fallback in fallbacks if codecs.lookup(fallback).name != name)
+        self.max_senders = max_senders
+        self.fallback_lines = 0
+        self.replaced_lines = 0
+        self._senders = collections.OrderedDict()
+
+    def decode(self, data):
+        try:
+            return data.decode(self.encoding)
+        except UnicodeDecodeError:
+            return self._fallback(data)
+
+    def sender_encoding(self, sender):
+        """The fallback encoding that last worked for sender (a nick, any case), None if there is none."""
+        return self._senders.get(sender.encode(self.encoding, "replace").lower())
+
+    def _fallback(self, data):
+        sender = sender_of(data)
+        senders = self._senders
+        known = senders.get(sender)
+        candidates = self.fallbacks if known is None else (known,) + self.fallbacks
+        for encoding in candidates:
+            try:
+                text = data.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+            self.fallback_lines += 1
+            senders[sender] = encoding
+            senders.move_to_end(sender)
+            if len(senders) > self.max_senders:
+                senders.popitem(last=False)
+            return text
+        self.replaced_lines += 1
+        return data.decode(self.encoding, "replace")
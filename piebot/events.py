@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+
+from . import irc
+from .executors import HandlerExecutor, OffloadedHandler, INLINE
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_command(command):
+    """Returns the message class for a command name ("PRIVMSG", "376") or a class."""
+    if isinstance(command, type):
+        return command
+    command = command.upper()
+    if command.isdigit():
+        command = "NUMERIC" + command
+    try:
+        return irc.Message._command_map[command]
+    except KeyError:
+        raise KeyError("no message class registered for command {}".format(command))
+
+
+class HandlerRegistry(object):
+    """Maps message classes from irc.Message._command_map to the handlers
+        subscribed to them, so dispatching a message is a single dict lookup.
+        Handlers are called as handler(protocol, msg). If a handler returns a
+        coroutine it is scheduled as a task on the protocol's loop instead of
+        being waited for. Handlers registered with the "thread" or "process"
+        mode run in the pools of executor instead, see OffloadedHandler.
+    """
+
+    def __init__(self, executor=None):
+        self._handlers = {}
+        self._executor = executor
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = HandlerExecutor()
+        return self._executor
+
+    def register(self, command, handler, mode=INLINE):
+        cls = resolve_command(command)
+        if mode != INLINE:
+            handler = OffloadedHandler(handler, mode, self.executor)
+        # Tuples are replaced rather than mutated, so registering from within
+        # a handler does not affect the dispatch in progress.
+        self._handlers[cls] = self._handlers.get(cls, ()) + (handler,)
+
+    def unregister(self, command, handler):
+        cls = resolve_command(command)
+        handlers = list(self._handlers.get(cls, ()))
+        for registered in handlers:
+            if registered == handler or getattr(registered, "handler", None) == handler:
+                handlers.remove(registered)
+                break
+        else:
+            raise ValueError("{!r} is not registered for {}".format(handler, cls.__name__))
+        if handlers:
+            self._handlers[cls] = tuple(handlers)
+        else:
+            del self._handlers[cls]
+
+    def on(self, command, mode=INLINE):
+        """Decorator version of register()."""
+        def decorator(handler):
+            self.register(command, handler, mode)
+            return handler
+        return decorator
+
+    def handlers_for(self, command):
+        return self._handlers.get(resolve_command(command), ())
+
+    def dispatch(self, protocol, msg):
+        for handler in self._handlers.get(type(msg), ()):
+            try:
+                result = handler(protocol, msg)
+            except Exception:
+                logger.exception("Handler %r failed for %r", handler, msg)
+                continue
+            if asyncio.iscoroutine(result):
+                task = protocol._loop.create_task(result)
+                task.add_done_callback(_log_task_exception)
+
+
+def _log_task_exception(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Async handler failed", exc_info=task.exception())
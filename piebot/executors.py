@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import logging
+
+from . import irc
+
+logger = logging.getLogger(__name__)
+
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+
+
+class HandlerExecutor(object):
+    """Runs handlers in bounded thread and process pools.
+        Every pool accepts at most max_pending submissions that have not
+        finished yet, further submissions are rejected and counted.
+    """
+
+    def __init__(self, thread_workers=4, process_workers=2, max_pending=64):
+        self.max_pending = max_pending
+        self._workers = {THREAD: thread_workers, PROCESS: process_workers}
+        self._pools = {}
+        self.pending = {THREAD: 0, PROCESS: 0}
+        self.rejected = {THREAD: 0, PROCESS: 0}
+        self.completed = {THREAD: 0, PROCESS: 0}
+        self.failed = {THREAD: 0, PROCESS: 0}
+
+    def _pool(self, mode):
+        pool = self._pools.get(mode)
+        if pool is None:
+            if mode == THREAD:
+                pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers[THREAD])
+            elif mode == PROCESS:
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=self._workers[PROCESS])
+            else:
+                raise ValueError("unknown execution mode {}".format(mode))
+            self._pools[mode] = pool
+        return pool
+
+    def submit(self, mode, loop, function, *args):
+        """Runs function(*args) in the pool for mode and returns an asyncio future,
+            or None if the pool already has max_pending submissions.
+        """
+        if self.pending[mode] >= self.max_pending:
+            self.rejected[mode] += 1
+            return None
+        future = loop.run_in_executor(self._pool(mode), function, *args)
+        self.pending[mode] += 1
+        future.add_done_callback(lambda future: self._done(mode, future))
+        return future
+
+    def _done(self, mode, future):
+        self.pending[mode] -= 1
+        if future.cancelled() or future.exception() is not None:
+            self.failed[mode] += 1
+        else:
+            self.completed[mode] += 1
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+        self._pools = {}
+
+
+class OffloadedHandler(object):
+    """Wraps a handler registered with the thread or process execution mode.
+        The wrapped handler is called as handler(msg) in the pool, it must
+        not touch the protocol. Whatever it returns (a Message, an iterable
+        of Messages or None) is sent through the owning protocol once the
+        result is back on the loop. Process mode handlers have to be
+        picklable, i.e. defined at module level.
+    """
+
+    def __init__(self, handler, mode, executor):
+        self.handler = handler
+        self.mode = mode
+        self.executor = executor
+
+    def __call__(self, protocol, msg):
+        # Parsed on the loop, the pool and later handlers must not parse a lazy message at the same time.
+        msg.get("command")
+        future = self.executor.submit(self.mode, protocol._loop, self.handler, msg)
+        if future is None:
+            logger.warning("Rejected %r for %r, %s pool is full", self.handler, msg, self.mode)
+            return
+        future.add_done_callback(lambda future: self._send_result(protocol, msg, future))
+
+    def _send_result(self, protocol, msg, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Handler %r failed for %r", self.handler, msg, exc_info=future.exception())
+            return
+        result = future.result()
+        if result is None:
+            return
+        if isinstance(result, irc.Message):
+            result = [result]
+        for reply in result:
+            protocol.send_msg(reply)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import time
+
+PRIORITY_KEEPALIVE = 0
+PRIORITY_CONTROL = 1
+PRIORITY_BULK = 2
+
+
+class TokenBucket(object):
+    """Classic token bucket: holds up to burst tokens, refilled with rate tokens per second."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, tokens=1):
+        """Takes tokens out of the bucket if there are enough, returns whether it did."""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        """Seconds until the given amount of tokens is available."""
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+
+class FloodControl(object):
+    """Releases outgoing data through a token bucket, one token per line.
+        Data that can not be sent right away waits in one of several priority
+        lanes, lower lanes are drained first. Draining is driven by a single
+        loop timer, nothing ever blocks.
+    """
+
+    def __init__(self, loop, send, rate, burst, lanes=3):
+        self._loop = loop
+        self._send = send
+        self._bucket = TokenBucket(rate, burst, clock=loop.time)
+        self._lanes = [collections.deque() for _ in range(lanes)]
+        self._timer = None
+        self.sent = 0
+        self.delayed = 0
+
+    def __len__(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    def push(self, data, priority=PRIORITY_CONTROL):
+        if self._timer is None and self._bucket.consume():
+            # Nothing is waiting, so there is nothing to skip ahead of.
+            self._send(data)
+            self.sent += 1
+            return
+        self._lanes[priority].append(data)
+        self.delayed += 1
+        if self._timer is None:
+            self._drain()
+
+    def _drain(self):
+        self._timer = None
+        bucket = self._bucket
+        for lane in self._lanes:
+            while lane:
+                if not bucket.consume():
+                    self._timer = self._loop.call_later(bucket.delay(), self._drain)
+                    return
+                self._send(lane.popleft())
+                self.sent += 1
+
+    def clear(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for lane in self._lanes:
+            lane.clear()
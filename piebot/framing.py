@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+
+class LineBuffer(object):
+    """Splits a stream of received bytes into lines.
+        Data is appended to a single bytearray which is scanned from the
+        position the last scan stopped at and compacted once per feed() call,
+        so a large burst is handled in linear time. Both CRLF and bare LF are
+        accepted as line endings. Lines longer than max_line_length are dropped
+        instead of letting the buffer grow without limit.
+    """
+
+    def __init__(self, max_line_length=8704):
+        self.max_line_length = max_line_length
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._scan_offset = 0
+        self._discarding = False
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """Append data and return the list of complete lines, without line endings."""
+        buffer = self._buffer
+        buffer += data
+        lines = []
+        find = buffer.find
+        max_length = self.max_line_length
+        start = 0
+        pos = find(b"\n", self._scan_offset)
+        if pos != -1:
+            view = memoryview(buffer)
+            try:
+                while pos != -1:
+                    end = pos
+                    if end > start and buffer[end-1] == 13:
+                        end -= 1
+                    if self._discarding:
+                        # Tail of a line that already exceeded the limit.
+                        self._discarding = False
+                    elif end - start > max_length:
+                        self.dropped += 1
+                    else:
+                        lines.append(bytes(view[start:end]))
+                    start = pos + 1
+                    pos = find(b"\n", start)
+            finally:
+                view.release()
+            del buffer[:start]
+        if len(buffer) > max_length:
+            # No line ending within the limit, drop everything up to the next one.
+            del buffer[:]
+            if not self._discarding:
+                self._discarding = True
+                self.dropped += 1
+        self._scan_offset = len(buffer)
+        return lines
+
+    def clear(self):
+        del self._buffer[:]
+        self._scan_offset = 0
+        self._discarding = False
@@ -1,118 +1,436 @@
 # -*- coding: utf-8 -*-
 
-def parse(line):
-    """ This is the basic irc line parser function.
+import types
+from functools import lru_cache
+from operator import attrgetter
+
+FIELDS = ("prefix", "subject", "command", "params", "trailing", "nick", "ident", "host", "tags")
+
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def unescape_tag_value(value):
+    """Unescapes an IRCv3 message tag value."""
+    if "\\" not in value:
+        return value
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            char = next(chars, "")
+            result.append(_TAG_ESCAPES.get(char, char))
+        else:
+            result.append(char)
+    return "".join(result)
+
+
+_TAG_UNESCAPES = {";": "\\:", " ": "\\s", "\\": "\\\\", "\r": "\\r", "\n": "\\n"}
+
+
+def escape_tag_value(value):
+    """Escapes a value for the IRCv3 tag section, undone by unescape_tag_value()."""
+    return "".join(_TAG_UNESCAPES.get(char, char) for char in value)
+
+
+def format_tags(tags):
+    """The tag section (without the leading @) for a dict of tags."""
+    return ";".join(key + "=" + escape_tag_value(value) if value else key for key, value in tags.items())
+
+
+def parse_tags(tags):
+    """Parses the IRCv3 tag section (without the leading @) into a dict."""
+    result = {}
+    for tag in tags.split(";"):
+        if not tag:
+            continue
+        key, _, value = tag.partition("=")
+        result[key] = unescape_tag_value(value)
+    return result
+
+
+def unescape_isupport_value(value):
+    """Unescapes the \\xHH sequences of an RPL_ISUPPORT value."""
+    if "\\x" not in value:
+        return value
+    parts = value.split("\\x")
+    result = [parts[0]]
+    for part in parts[1:]:
+        digits = part[:2]
+        if len(digits) == 2 and all(c in "0123456789abcdefABCDEF" for c in digits):
+            result.append(chr(int(digits, 16)) + part[2:])
+        else:
+            result.append("\\x" + part)
+    return "".join(result)
+
+
+@lru_cache(maxsize=4096)
+def split_subject(subject):
+    """Splits a message subject into nick, ident and host.
+        Subjects without a "!" (server names) are returned for all three.
     """
-    prefix = ""
-    subject = ""
-    trailing = ""
-    command = ""
-    params = ""
+    nick, sep, rest = subject.partition("!")
+    if not sep:
+        return subject, subject, subject
+    ident, sep, host = rest.partition("@")
+    if sep:
+        ident = ident.strip("~")
+    return nick, ident, host
+
+
+def tokenize(line):
+    """Splits a line into a tuple ordered like FIELDS, scanning every part of the line once.
+        Tags are None if the line carries none.
+    """
+    tags = None
+    prefix = subject = trailing = ""
+    if line[0:1] == "@":
+        i = line.find(" ")
+        if i == -1:
+            tags, line = parse_tags(line[1:]), ""
+        else:
+            tags, line = parse_tags(line[1:i]), line[i+1:].lstrip(" ")
     if line[0:1] == ":":
         prefix = ":"
-        line = line[1:]
-        if " " in line:
-            subject, line = line.split(" ", 1)
-    if " :" in line:
-        line, trailing = line.split(" :", 1)
+        i = line.find(" ")
+        if i == -1:
+            line = line[1:]
+        else:
+            subject = line[1:i]
+            line = line[i+1:]
+    i = line.find(" :")
+    if i != -1:
+        trailing = line[i+2:]
+        line = line[:i]
     if " " in line:
-        command, *middle = line.split()
-        params = middle[:]
+        params = line.split()
+        command = params.pop(0) if params else ""
     else:
         command = line
-    # Now prepare parsing the subject if possible.
-    if subject != "" and "!" in subject:
-        s_nick, s_identname = subject.split("!", 1)
-        if "@" in s_identname:
-            s_identname, s_host = s_identname.split("@", 1)
-            s_identname = s_identname.strip("~")
-    else:
-        s_nick = s_identname = s_host = subject
-    result = {
+        params = ""
+    nick, ident, host = split_subject(subject)
+    return prefix, subject, command, params, trailing, nick, ident, host, tags
+
+
+def command_of(line):
+    """Returns the command of a line without tokenizing the rest of it.
+        Returns None if the line is unusual enough to need tokenize() for that.
+    """
+    start = 0
+    if line[0:1] == "@":
+        start = line.find(" ") + 1
+        if start == 0:
+            return None
+        while line[start:start+1] == " ":
+            start += 1
+    if line[start:start+1] == ":":
+        start = line.find(" ", start) + 1
+        if start == 0:
+            return None
+    end = line.find(" ", start)
+    command = line[start:end] if end != -1 else line[start:]
+    if command.isalnum():
+        return command
+    return None
+
+
+def raw_command_of(data):
+    """command_of() for an undecoded line, the command is returned as a string."""
+    start = 0
+    if data[0:1] == b"@":
+        start = data.find(b" ") + 1
+        if start == 0:
+            return None
+        while data[start:start+1] == b" ":
+            start += 1
+    if data[start:start+1] == b":":
+        start = data.find(b" ", start) + 1
+        if start == 0:
+            return None
+    end = data.find(b" ", start)
+    command = data[start:end] if end != -1 else data[start:]
+    if command.isalnum():
+        return command.decode("ascii")
+    return None
+
+
+class RawLine(object):
+    """An undecoded line waiting in a Message until one of its fields is needed."""
+    __slots__ = ("data", "decode")
+
+    def __init__(self, data, decode):
+        self.data = data
+        self.decode = decode
+
+    def __str__(self):
+        return self.decode(self.data)
+
+
+DEFAULT_CHANMODES = ("beI", "k", "l", "imnpst")
+DEFAULT_PREFIX = ("ov", "@+")
+
+
+def parse_modes(modes, args, chanmodes=DEFAULT_CHANMODES, prefix_modes=DEFAULT_PREFIX[0]):
+    """Splits a mode string and its arguments into a list of (adding, mode, argument)
+        tuples, argument being None for modes that take none. chanmodes are the
+        four CHANMODES groups (list modes, modes that always take an argument,
+        modes that only take one when set and modes that never take one),
+        prefix_modes the modes of PREFIX.
+    """
+    list_modes, always, when_set = chanmodes[0], chanmodes[1], chanmodes[2]
+    args = iter(args)
+    adding = True
+    changes = []
+    for mode in modes:
+        if mode == "+":
+            adding = True
+        elif mode == "-":
+            adding = False
+        elif mode in prefix_modes or mode in list_modes or mode in always or (adding and mode in when_set):
+            changes.append((adding, mode, next(args, None)))
+        else:
+            changes.append((adding, mode, None))
+    return changes
+
+
+def batch_targets(command, targets, keys=None, trailing=None, max_targets=None, max_length=510, encoding="utf-8"):
+    """Builds as few command messages as possible for all targets by joining
+        them with commas, each message carrying at most max_targets targets
+        (None for no limit) and staying within max_length bytes without CRLF.
+        keys, if given, holds one key per target and is sent as a second
+        comma separated parameter (JOIN).
+    """
+    cls = Message._command_map.get(command.upper(), Message)
+    base = len(command.encode(encoding))
+    if trailing is not None:
+        base += 2 + len(trailing.encode(encoding))
+    messages = []
+    chunk, chunk_keys, length = [], [], base
+
+    def build():
+        params = [",".join(chunk)]
+        if keys is not None:
+            params.append(",".join(chunk_keys))
+        data = {"command": command, "params": params}
+        if trailing is not None:
+            data["trailing"] = trailing
+        messages.append(cls(data=data))
+
+    for i, target in enumerate(targets):
+        # A separator (space before the first, comma before the others) plus the target and its key.
+        extra = 1 + len(target.encode(encoding))
+        if keys is not None:
+            extra += 1 + len(keys[i].encode(encoding))
+        if chunk and (length + extra > max_length or (max_targets is not None and len(chunk) >= max_targets)):
+            build()
+            chunk, chunk_keys, length = [], [], base
+        chunk.append(target)
+        if keys is not None:
+            chunk_keys.append(keys[i])
+        length += extra
+    if chunk:
+        build()
+    return messages
+
+
+def split_text(data, limit, utf8=True):
+    """Splits the encoded text data into pieces of at most limit bytes and
+        at line breaks, in a single pass. Pieces end at the last space that
+        fits, which is dropped, or else before the last UTF-8 character that
+        does not fit completely (any byte if utf8 is false). Empty lines are
+        left out.
+    """
+    if limit < 4:
+        raise ValueError("limit must leave room for a UTF-8 character")
+    pieces = []
+    for line in data.replace(b"\r\n", b"\n").replace(b"\r", b"\n").split(b"\n"):
+        start, end = 0, len(line)
+        while end - start > limit:
+            cut = start + limit
+            space = line.rfind(b" ", start + 1, cut + 1)
+            if space != -1:
+                pieces.append(line[start:space])
+                start = space + 1
+                continue
+            if utf8:
+                # Step back over at most three continuation bytes to the start of the character.
+                while line[cut] & 0xc0 == 0x80:
+                    cut -= 1
+            pieces.append(line[start:cut])
+            start = cut
+        if start < end:
+            pieces.append(line[start:])
+    return pieces
+
+
+def parse(line):
+    """ This is the basic irc line parser function.
+    """
+    prefix, subject, command, params, trailing, nick, ident, host, tags = tokenize(line)
+    return {
         "prefix": prefix,
         "subject": subject,
         "command": command,
         "params": params,
         "trailing": trailing,
-        "nick": s_nick,
-        "ident": s_identname,
-        "host": s_host
+        "nick": nick,
+        "ident": ident,
+        "host": host,
+        "tags": tags if tags is not None else {}
     }
-    return result
+
+
+_EMPTY_FIELDS = ("", "", "", "", "", "", "", "", None)
 
 
 class Message(object):
     """Handles translation between strings and Message instances
+        The parsed fields are kept in slots, subclasses declare __slots__ for
+        THEIR CUSTOM FIELDS so no instance carries a __dict__.
+        Messages created by from_string() only know their raw line and class,
+        the line is tokenized and parse() runs on first access of any field.
+        Messages created by from_bytes() even keep the line undecoded until then.
     """
+    __slots__ = ("_line", "_wire", "_prefix", "_subject", "_command", "_params", "_trailing", "_nick", "_ident", "_host", "_tags")
     _command_map = {}
 
     def __init__(self, data=None, *args, **kwargs):
+        self._line = None
         if data == None:
-            self.data = {
-                "prefix": "",
-                "subject": "",
-                "command": "",
-                "params": "",
-                "trailing": "",
-                "nick": "",
-                "ident": "",
-                "host": ""
-            }
+            self._load(_EMPTY_FIELDS)
         else:
-            self.data = data
+            self._load(tuple(data.get(field, "") for field in FIELDS[:-1]) + (data.get("tags") or None,))
             self.parse()
 
+    def _load(self, fields):
+        (self._prefix, self._subject, self._command, self._params, self._trailing,
+            self._nick, self._ident, self._host, self._tags) = fields
+
     @classmethod
     def from_string(cls, string):
-        data = parse(string)
-        command = data["command"].upper()
+        command = command_of(string)
+        if command is None:
+            fields = tokenize(string)
+            command = fields[2]
+        else:
+            fields = None
+        command = command.upper()
+        if command.isdigit():
+            command = "Numeric{}".format(command).upper()
+        klass = cls._command_map.get(command, cls)
+        instance = klass.__new__(klass)
+        if fields is None:
+            instance._line = string
+        else:
+            instance._line = None
+            instance._load(fields)
+            instance.parse()
+        return instance
+
+    @classmethod
+    def from_bytes(cls, data, decode):
+        """Like from_string(decode(data)), but the class is chosen by the raw command
+            and data is only decoded once a field is accessed.
+        """
+        command = raw_command_of(data)
+        if command is None:
+            return cls.from_string(decode(data))
+        command = command.upper()
         if command.isdigit():
             command = "Numeric{}".format(command).upper()
-        instance = cls._command_map.get(command, cls)(data=data)
+        klass = cls._command_map.get(command, cls)
+        instance = klass.__new__(klass)
+        instance._line = RawLine(data, decode)
         return instance
 
+    def __getattr__(self, name):
+        """Only called for unset slots, parses the pending raw line if there is one."""
+        if name == "_line" or name.startswith("__"):
+            raise AttributeError(name)
+        if self._line is None:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        self._materialize()
+        return getattr(self, name)
+
+    def _materialize(self):
+        """Tokenizes and parses the pending raw line into the slots."""
+        line = self._line
+        self._line = None
+        if type(line) is RawLine:
+            line = str(line)
+        self._load(tokenize(line))
+        self.parse()
+
+    @property
+    def data(self):
+        """A read-only mapping of the parsed fields, built on every access.
+            Fields are changed through update().
+        """
+        return types.MappingProxyType({field: self.get(field) for field in FIELDS})
+
     def __repr__(self):
-        items = self.__dict__.copy()
-        if len(items) == 1:
-            items = items["data"]
-            for e in ["prefix", "nick", "host", "ident"]: del items[e]
+        if self._line is not None:
+            # Do not parse just for a representation.
+            return "<" + self.__class__.__name__ + " '" + str(self._line) + "'>"
         e = []
-        for key in items:
-            if key == "data":
-                continue
-            e.append(key+"='"+str(items[key])+"'")
+        for cls in type(self).__mro__:
+            if cls is Message:
+                break
+            for key in getattr(cls, "__slots__", ()):
+                if hasattr(self, key):
+                    e.append(key+"='"+str(getattr(self, key))+"'")
+        if not e:
+            for key in ["subject", "command", "params", "trailing"]:
+                e.append(key+"='"+str(self.get(key))+"'")
         return "<" + self.__class__.__name__ + " " + ", ".join(e) + ">"
 
     def __str__(self):
-        data = self.data
         e = []
-        if data["subject"]:
-            e.append(data["subject"])
-        if data["command"]:
-            e.append(data["command"])
-        if data["params"] and len(data["params"]) > 0:
-            e.append(" ".join(data["params"]))
-        if data["trailing"]:
-            e.append(":{}".format(data["trailing"]))
+        if self._subject:
+            e.append(self._subject)
+        if self._command:
+            e.append(self._command)
+        if self._params:
+            e.append(" ".join(self._params))
+        if self._trailing:
+            e.append(":{}".format(self._trailing))
         result = " ".join(e)
-        if data["prefix"]:
-            result = data["prefix"] + result
+        if self._prefix:
+            result = self._prefix + result
+        if self._tags:
+            result = "@" + format_tags(self._tags) + " " + result
         return result
 
     def get(self, attr):
-        return self.data[attr]
+        return _FIELD_GETTERS[attr](self)
 
     def parse(self):
         """Empty parse method to override by subclasses for THEIR CUSTOM FIELDS."""
         pass
 
     def update(self, data):
-        self.data.update(data)
-        # Reparse self in order to get consistent data for subclasses
-        self.data.update(parse(str(self)))
-        # Now have the subclass parse the relevant values out of the self-interpretation
+        """Sets fields directly, subject derived fields are split again if the subject changes."""
+        if self._line is not None:
+            # The pending line would overwrite the new fields once parsed.
+            self._materialize()
+        for key, value in data.items():
+            setattr(self, "_" + key, value)
+        if "subject" in data:
+            self._nick, self._ident, self._host = split_subject(self._subject)
+        self._wire = None
+        # Now have the subclass parse the relevant values out of the new fields
         self.parse()
 
+    def encode(self, encoding):
+        """Returns the line including CRLF as bytes, built once and cached until the next update()."""
+        wire = getattr(self, "_wire", None)
+        if wire is None or wire[0] != encoding:
+            wire = (encoding, (str(self)+"\r\n").encode(encoding, "replace"))
+            self._wire = wire
+        return wire[1]
+
+_FIELD_GETTERS = {field: attrgetter("_" + field) for field in FIELDS}
+_FIELD_GETTERS["tags"] = lambda message: message._tags or {}
+
 def register_derivative(name, bases, attr):
     new_cls = type(name, bases, attr)
     for cls in bases:
@@ -125,6 +443,7 @@ def register_derivative(name, bases, attr):
     return new_cls
 
 class User(Message, metaclass=register_derivative):
+    __slots__ = ("ident", "realname")
     def __init__(self, ident="", realname="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -138,6 +457,7 @@ class User(Message, metaclass=register_derivative):
         self.realname = self.get("trailing")
 
 class Nick(Message, metaclass=register_derivative):
+    __slots__ = ("old_nick", "nick")
     def __init__(self, nick="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -147,9 +467,10 @@ class Nick(Message, metaclass=register_derivative):
             })
     def parse(self):
         self.old_nick = self.get("nick")
-        self.nick = self.get("trailing")
+        self.nick = self.get("trailing") or self.get("params")[0]
 
 class Ping(Message, metaclass=register_derivative):
+    __slots__ = ("payload",)
     def __init__(self, payload="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -161,10 +482,11 @@ class Ping(Message, metaclass=register_derivative):
         self.payload = self.get("trailing")
 
 class Pong(Message, metaclass=register_derivative):
+    __slots__ = ("payload",)
     def __init__(self, ping="", payload="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
-            if ping: payload = ping.data["trailing"]
+            if ping: payload = ping.get("trailing")
             self.update({
                 "command": "PONG",
                 "trailing": payload
@@ -173,6 +495,7 @@ class Pong(Message, metaclass=register_derivative):
         self.payload = self.get("trailing")
 
 class Privmsg(Message, metaclass=register_derivative):
+    __slots__ = ("source", "target", "message")
     def __init__(self, target="", message="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -187,6 +510,7 @@ class Privmsg(Message, metaclass=register_derivative):
         self.message = self.get("trailing")
 
 class Notice(Message, metaclass=register_derivative):
+    __slots__ = ("source", "target", "message")
     def __init__(self, target="", message="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -201,6 +525,7 @@ class Notice(Message, metaclass=register_derivative):
         self.message = self.get("trailing")
 
 class Kick(Message, metaclass=register_derivative):
+    __slots__ = ("source", "channel", "target", "message")
     def __init__(self, channel="", user="", message="KICK", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -216,6 +541,7 @@ class Kick(Message, metaclass=register_derivative):
         self.message = self.get("trailing")
 
 class Join(Message, metaclass=register_derivative):
+    __slots__ = ("nick", "channel")
     def __init__(self, channel="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -224,12 +550,13 @@ class Join(Message, metaclass=register_derivative):
                 "trailing": channel
             })
     def parse(self):
+        # With extended-join the trailing part is the realname, not the channel.
         self.nick = self.get("nick")
-        self.channel = self.get("trailing")
-        if self.channel.strip() == "":
-            self.channel = self.get("params")[0]
+        params = self.get("params")
+        self.channel = params[0] if params else self.get("trailing")
 
 class Part(Message, metaclass=register_derivative):
+    __slots__ = ("nick", "channel", "message")
     def __init__(self, channel="", message="PART", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -244,43 +571,39 @@ class Part(Message, metaclass=register_derivative):
         self.message = self.get("trailing")
 
 class Mode(Message, metaclass=register_derivative):
+    __slots__ = ("usermode", "source", "subject", "flags", "isupport")
     def __init__(self, subject="", modes=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
             self.update({
                 "command": "MODE",
+                "params": [subject] + (modes.split() if modes else []),
             })
+    def use_isupport(self, isupport):
+        """Parses the flags with the server's CHANMODES, PREFIX and CHANTYPES from an ISupport."""
+        self.isupport = isupport
+        if self._line is None:
+            self.parse()
     def parse(self):
-        #TODO: Implement this in a proper way!
-        self.usermode = False
-        self.source = self.get("nick")
-        self.subject = self.get("params")[0]
-        if(self.source == self.subject):
-            """Parsing user modes here."""
-            self.usermode = True
-            flags = self.get("trailing")
-            flag_modifier = flags[0:1] is "+"
-            self.flags = []
-            for flag in flags[1:]:
-                self.flags.append((flag, flag_modifier))
-        elif(len(self.get("params")) == 2):
-            """Parsing simple channel modes here."""
-            flags = self.get("params")[1]
-            flag_modifier = flags[0:1] is "+"
-            self.flags = []
-            for flag in flags[1:]:
-                self.flags.append((flag, flag_modifier))
+        # Without the server's ISupport the RFC 1459 defaults decide which modes take arguments.
+        isupport = getattr(self, "isupport", None)
+        if isupport is None:
+            chanmodes, prefix_modes, chantypes = DEFAULT_CHANMODES, DEFAULT_PREFIX[0], "#&"
         else:
-            """Parsing parameterized channel modes here."""
-            flags = self.get("params")[1]
-            flag_modifier = flags[0:1] is "+"
-            self.flags = []
-            i = 1
-            for flag in flags[1:]:
-                self.flags.append((flag, flag_modifier, self.get("params")[1+i]))
-                i += 1
+            chanmodes, prefix_modes, chantypes = isupport.chanmodes, isupport.prefix[0], isupport.chantypes
+        params = list(self.get("params") or ())
+        if self.get("trailing"):
+            params.append(self.get("trailing"))
+        self.source = self.get("nick")
+        self.subject = params[0] if params else ""
+        self.usermode = self.subject[0:1] not in chantypes
+        self.flags = []
+        modes = params[1] if len(params) > 1 else ""
+        for adding, mode, arg in parse_modes(modes, params[2:], chanmodes, prefix_modes):
+            self.flags.append((mode, adding) if arg is None else (mode, adding, arg))
 
 class Topic(Message, metaclass=register_derivative):
+    __slots__ = ("source", "channel", "topic")
     def __init__(self, channel="", topic="", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -295,6 +618,7 @@ class Topic(Message, metaclass=register_derivative):
         self.topic = self.get("trailing")
 
 class Quit(Message, metaclass=register_derivative):
+    __slots__ = ("nick", "message")
     def __init__(self, message="QUIT", *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "data" not in kwargs:
@@ -306,9 +630,211 @@ class Quit(Message, metaclass=register_derivative):
         self.nick = self.get("nick")
         self.message = self.get("trailing")
 
+class Numeric001(Message, metaclass=register_derivative):
+    """RPL_WELCOME"""
+    __slots__ = ("nick",)
+    def parse(self):
+        self.nick = self.get("params")[0]
+
 class Numeric005(Message, metaclass=register_derivative):
+    """RPL_ISUPPORT"""
+    __slots__ = ("tokens",)
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def parse(self):
-        pass
+        # tokens maps names to values, "" for tokens without one and None for negated ("-TOKEN") ones.
+        self.tokens = {}
+        for token in self.get("params")[1:]:
+            if token.startswith("-"):
+                self.tokens[token[1:]] = None
+                continue
+            key, _, value = token.partition("=")
+            self.tokens[key] = unescape_isupport_value(value)
+
+class Numeric376(Message, metaclass=register_derivative):
+    """RPL_ENDOFMOTD"""
+    __slots__ = ()
+
+class Numeric332(Message, metaclass=register_derivative):
+    """RPL_TOPIC"""
+    __slots__ = ("channel", "topic")
+    def parse(self):
+        self.channel = self.get("params")[1]
+        self.topic = self.get("trailing")
+
+class Numeric352(Message, metaclass=register_derivative):
+    """RPL_WHOREPLY"""
+    __slots__ = ("channel", "ident", "host", "server", "nick", "flags", "realname")
+    def parse(self):
+        params = self.get("params")
+        self.channel, self.ident, self.host, self.server, self.nick, self.flags = params[1:7]
+        # The trailing part starts with the hop count.
+        self.realname = self.get("trailing").partition(" ")[2]
+
+class Numeric353(Message, metaclass=register_derivative):
+    """RPL_NAMREPLY"""
+    __slots__ = ("channel", "names")
+    def parse(self):
+        self.channel = self.get("params")[-1]
+        self.names = self.get("trailing").split()
+
+class Numeric366(Message, metaclass=register_derivative):
+    """RPL_ENDOFNAMES"""
+    __slots__ = ("channel",)
+    def parse(self):
+        self.channel = self.get("params")[1]
+
+class ChannelError(Message):
+    """Base of the error numerics refusing to let us join a channel."""
+    __slots__ = ("channel", "reason")
+    def parse(self):
+        params = self.get("params")
+        self.channel = params[1] if len(params) > 1 else ""
+        self.reason = self.get("trailing")
+
+class Numeric403(ChannelError, metaclass=register_derivative):
+    """ERR_NOSUCHCHANNEL"""
+    __slots__ = ()
+
+class Numeric405(ChannelError, metaclass=register_derivative):
+    """ERR_TOOMANYCHANNELS"""
+    __slots__ = ()
+
+class Numeric437(ChannelError, metaclass=register_derivative):
+    """ERR_UNAVAILRESOURCE"""
+    __slots__ = ()
+
+class Numeric471(ChannelError, metaclass=register_derivative):
+    """ERR_CHANNELISFULL"""
+    __slots__ = ()
+
+class Numeric473(ChannelError, metaclass=register_derivative):
+    """ERR_INVITEONLYCHAN"""
+    __slots__ = ()
+
+class Numeric474(ChannelError, metaclass=register_derivative):
+    """ERR_BANNEDFROMCHAN"""
+    __slots__ = ()
+
+class Numeric475(ChannelError, metaclass=register_derivative):
+    """ERR_BADCHANNELKEY"""
+    __slots__ = ()
+
+class Numeric476(ChannelError, metaclass=register_derivative):
+    """ERR_BADCHANMASK"""
+    __slots__ = ()
+
+class Numeric477(ChannelError, metaclass=register_derivative):
+    """ERR_NEEDREGGEDNICK"""
+    __slots__ = ()
+
+class Numeric489(ChannelError, metaclass=register_derivative):
+    """ERR_SECUREONLYCHAN"""
+    __slots__ = ()
+
+JOIN_ERRORS = (Numeric403, Numeric405, Numeric437, Numeric471, Numeric473, Numeric474, Numeric475, Numeric476,
+               Numeric477, Numeric489)
+
+class Cap(Message, metaclass=register_derivative):
+    """IRCv3 capability negotiation. more is set on LS and LIST replies
+        that are continued on further lines.
+    """
+    __slots__ = ("subcommand", "caps", "more")
+    def __init__(self, subcommand="", caps="", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if "data" not in kwargs:
+            self.update({
+                "command": "CAP",
+                "params": [subcommand],
+                "trailing": caps
+            })
+    def parse(self):
+        params = self.get("params") or [""]
+        if len(params) == 1:
+            # Sent by us, there is no target.
+            self.subcommand = params[0].upper()
+            self.more = False
+            self.caps = self.get("trailing").split()
+            return
+        self.subcommand = params[1].upper()
+        self.more = len(params) > 2 and params[2] == "*"
+        caps = self.get("trailing")
+        if not caps and len(params) > 2 and params[-1] != "*":
+            caps = params[-1]
+        self.caps = caps.split()
+
+class Batch(Message, metaclass=register_derivative):
+    """IRCv3 BATCH. The protocol collects the messages tagged with an open
+        batch in messages and dispatches the batch once it is closed.
+    """
+    __slots__ = ("reference", "opening", "type", "arguments", "messages")
+    def __init__(self, reference="", type="", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if "data" not in kwargs:
+            self.update({
+                "command": "BATCH",
+                "params": [reference] + ([type] if type else []),
+            })
+    def parse(self):
+        params = list(self.get("params") or [""])
+        if self.get("trailing"):
+            params.append(self.get("trailing"))
+        self.opening = params[0][0:1] == "+"
+        self.reference = params[0].lstrip("+-")
+        self.type = params[1] if self.opening and len(params) > 1 else None
+        self.arguments = params[2:] if self.opening else []
+        self.messages = []
+
+class Authenticate(Message, metaclass=register_derivative):
+    __slots__ = ("payload",)
+    def __init__(self, payload="", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if "data" not in kwargs:
+            self.update({
+                "command": "AUTHENTICATE",
+                "params": [payload]
+            })
+    def parse(self):
+        params = self.get("params")
+        self.payload = params[0] if params else self.get("trailing")
+
+class SaslReply(Message):
+    """Base of the SASL result numerics."""
+    __slots__ = ("reason",)
+    def parse(self):
+        self.reason = self.get("trailing")
+
+class Numeric900(SaslReply, metaclass=register_derivative):
+    """RPL_LOGGEDIN"""
+    __slots__ = ("account",)
+    def parse(self):
+        super().parse()
+        params = self.get("params")
+        self.account = params[2] if len(params) > 2 else None
+
+class Numeric902(SaslReply, metaclass=register_derivative):
+    """ERR_NICKLOCKED"""
+    __slots__ = ()
+
+class Numeric903(SaslReply, metaclass=register_derivative):
+    """RPL_SASLSUCCESS"""
+    __slots__ = ()
+
+class Numeric904(SaslReply, metaclass=register_derivative):
+    """ERR_SASLFAIL"""
+    __slots__ = ()
+
+class Numeric905(SaslReply, metaclass=register_derivative):
+    """ERR_SASLTOOLONG"""
+    __slots__ = ()
+
+class Numeric906(SaslReply, metaclass=register_derivative):
+    """ERR_SASLABORTED"""
+    __slots__ = ()
+
+class Numeric907(SaslReply, metaclass=register_derivative):
+    """ERR_SASLALREADY"""
+    __slots__ = ()
+
+SASL_ERRORS = (Numeric902, Numeric904, Numeric905, Numeric906, Numeric907)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from . import irc
+
+# Commands whose targets may be merged into one comma separated parameter
+# when the server does not say otherwise, bounded by the line length only.
+UNLIMITED_TARGETS = ("JOIN", "PART")
+
+
+class ISupport(object):
+    """The RPL_ISUPPORT (005) tokens a server announced on one connection.
+        tokens holds the raw values, the attributes hold the parsed values
+        of the tokens piebot uses, or their RFC 1459 defaults.
+    """
+
+    def __init__(self):
+        self.tokens = {}
+        self._apply()
+
+    def update(self, tokens):
+        """Merges the tokens of one RPL_ISUPPORT line, None values remove a token."""
+        for key, value in tokens.items():
+            if value is None:
+                self.tokens.pop(key, None)
+            else:
+                self.tokens[key] = value
+        self._apply()
+
+    def _apply(self):
+        tokens = self.tokens
+        self.casemapping = tokens.get("CASEMAPPING") or "rfc1459"
+        self.chantypes = tokens.get("CHANTYPES", "#&")
+        self.network = tokens.get("NETWORK")
+        chanmodes = tokens.get("CHANMODES", "").split(",")
+        self.chanmodes = tuple(chanmodes[:4]) if len(chanmodes) >= 4 else irc.DEFAULT_CHANMODES
+        prefix = tokens.get("PREFIX", "")
+        modes, _, symbols = prefix[1:].partition(")")
+        if prefix.startswith("(") and len(modes) == len(symbols):
+            self.prefix = (modes, symbols)
+        else:
+            self.prefix = irc.DEFAULT_PREFIX
+        self.maxtargets = _int(tokens.get("MAXTARGETS"))
+        self.targmax = {}
+        for entry in tokens.get("TARGMAX", "").split(","):
+            command, sep, limit = entry.partition(":")
+            if sep:
+                self.targmax[command.upper()] = _int(limit)
+        self.linelen = _int(tokens.get("LINELEN")) or 512
+
+    def max_targets(self, command):
+        """How many targets one command line may carry, None meaning no limit."""
+        command = command.upper()
+        if command in self.targmax:
+            return self.targmax[command]
+        if command in ("PRIVMSG", "NOTICE") and "MAXTARGETS" in self.tokens:
+            return self.maxtargets
+        if command in UNLIMITED_TARGETS:
+            return None
+        return 1
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+
+
+class JoinStager(object):
+    """Joins a list of channels in stages. The channels are merged into as
+        few JOIN lines as the server allows (IrcProtocol.join_messages()),
+        every stage sends stage_lines of them, then waits until each of their
+        channels is confirmed by our JOIN or refused by an error numeric.
+        Channels without either after timeout seconds count as failed.
+        on_stage is called with the channels joined by every finished stage.
+    """
+
+    def __init__(self, protocol, channels, keys=None, stage_lines=1, timeout=30.0, on_stage=None):
+        self._protocol = protocol
+        self._fold = protocol.state.fold
+        self._messages = collections.deque(protocol.join_messages(channels, keys))
+        self.stage_lines = stage_lines
+        self.timeout = timeout
+        self.on_stage = on_stage
+        self.channels = len(channels)
+        self.stages = 0
+        self.joined = []
+        self.failed = {}
+        self.done = False
+        self._pending = {}
+        self._stage_joined = []
+        self._timer = None
+
+    def start(self):
+        self._next_stage()
+
+    def _next_stage(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._stage_joined and self.on_stage is not None:
+            self.on_stage(self._stage_joined)
+        self._stage_joined = []
+        if not self._messages:
+            self.done = True
+            self._protocol.log("Joined %s of %s channels in %s stages, %s failed.", len(self.joined), self.channels,
+                               self.stages, len(self.failed), level=logging.INFO if not self.failed else logging.WARNING)
+            return
+        self.stages += 1
+        for _ in range(min(self.stage_lines, len(self._messages))):
+            msg = self._messages.popleft()
+            for channel in msg.get("params")[0].split(","):
+                self._pending[self._fold(channel)] = channel
+            self._protocol.send_msg(msg)
+        loop = self._protocol._loop
+        if loop is not None and self.timeout is not None:
+            self._timer = loop.call_later(self.timeout, self._timed_out)
+
+    def confirm(self, channel):
+        """Called for our own JOIN of channel."""
+        channel = self._pending.pop(self._fold(channel), None)
+        if channel is None:
+            return
+        self.joined.append(channel)
+        self._stage_joined.append(channel)
+        if not self._pending:
+            self._next_stage()
+
+    def fail(self, channel, reason):
+        """Called for an error numeric refusing channel."""
+        channel = self._pending.pop(self._fold(channel), None)
+        if channel is None:
+            return
+        self.failed[channel] = reason
+        self._protocol.log("Joining %s failed: %s", channel, reason, level=logging.WARNING)
+        if not self._pending:
+            self._next_stage()
+
+    def _timed_out(self):
+        self._timer = None
+        for channel in list(self._pending.values()):
+            self.fail(channel, "no reply within {}s".format(self.timeout))
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._messages.clear()
+        self._pending.clear()
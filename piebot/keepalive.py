@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import weakref
+
+from . import irc
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the payload of our PINGs, followed by the loop time they were sent at.
+PING_PREFIX = "LAG"
+
+
+class WheelTimer(object):
+    """A callback scheduled on a TimerWheel."""
+    __slots__ = ("callback", "args", "rounds", "cancelled", "_wheel")
+
+    def __init__(self, wheel, rounds, callback, args):
+        self._wheel = wheel
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._wheel._cancelled(self)
+
+
+class TimerWheel(object):
+    """Hashed timing wheel: timers are put into one of slots buckets of
+        resolution seconds each, a single loop timer advances the wheel by a
+        bucket per tick and runs what is due there. Scheduling and cancelling
+        are O(1) and the loop only ever sees one timer, however many
+        connections keep their timers here. Timers never fire early, but up
+        to resolution seconds late. The wheel stops ticking while it is empty.
+    """
+
+    def __init__(self, loop, resolution=1.0, slots=512):
+        self._loop = loop
+        self.resolution = resolution
+        self._slots = [[] for _ in range(slots)]
+        self._current = 0
+        self._next_tick = None
+        self._handle = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def call_later(self, delay, callback, *args):
+        """Runs callback(*args) after delay seconds, returns a WheelTimer that can be cancelled."""
+        if self._handle is None:
+            self._next_tick = self._loop.time() + self.resolution
+            self._handle = self._loop.call_at(self._next_tick, self._tick)
+        # Ticks to wait after the next one, so the timer fires at or after its deadline.
+        ticks = max(0, math.ceil((self._loop.time() + delay - self._next_tick) / self.resolution))
+        slots = len(self._slots)
+        timer = WheelTimer(self, ticks // slots, callback, args)
+        self._slots[(self._current + 1 + ticks) % slots].append(timer)
+        self._count += 1
+        return timer
+
+    def _cancelled(self, timer):
+        # The timer stays in its slot until the wheel comes by.
+        self._count -= 1
+        if self._count == 0 and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+            for slot in self._slots:
+                del slot[:]
+
+    def _tick(self):
+        self._current = (self._current + 1) % len(self._slots)
+        slot = self._slots[self._current]
+        due = []
+        waiting = []
+        for timer in slot:
+            if timer.cancelled:
+                continue
+            if timer.rounds:
+                timer.rounds -= 1
+                waiting.append(timer)
+            else:
+                due.append(timer)
+        slot[:] = waiting
+        # Due timers keep counting until they run, so an earlier callback
+        # of this tick can still cancel them. New timers scheduled by the
+        # callbacks start the wheel again.
+        self._handle = None
+        for timer in due:
+            if timer.cancelled:
+                continue
+            # Cancelling it now does nothing.
+            timer.cancelled = True
+            self._count -= 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                logger.exception("Timer callback %r failed.", timer.callback)
+        if self._count and self._handle is None:
+            self._next_tick += self.resolution
+            self._handle = self._loop.call_at(self._next_tick, self._tick)
+
+
+_wheels = weakref.WeakKeyDictionary()
+
+
+def shared_wheel(loop):
+    """The TimerWheel shared by everything on loop, ticking every second."""
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        wheel = _wheels[loop] = TimerWheel(loop)
+    return wheel
+
+
+class Keepalive(object):
+    """Pings the server every interval seconds, with the loop time as payload,
+        and measures the lag from the PONG to it. The current lag is the
+        round trip time of the last PING, or the age of the one still
+        unanswered if that is longer. If a PING is not answered within
+        timeout seconds the connection is considered dead and destroyed,
+        so it is reconnected even if the TCP connection never reports the
+        loss. All timers are kept on wheel.
+    """
+
+    def __init__(self, protocol, wheel, interval=60.0, timeout=120.0):
+        self._protocol = protocol
+        self._wheel = wheel
+        self.interval = interval
+        self.timeout = timeout
+        self.last_lag = None
+        self.max_lag = None
+        self.samples = 0
+        self._total = 0.0
+        self._sent = None
+        self._payload = None
+        self._timer = None
+
+    def start(self):
+        self._schedule(self.interval, self._ping)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._sent = self._payload = None
+
+    def _schedule(self, delay, callback):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._wheel.call_later(delay, callback)
+
+    @property
+    def lag(self):
+        """The current lag in seconds, None before the first PING."""
+        if self._sent is None:
+            return self.last_lag
+        waiting = self._protocol._loop.time() - self._sent
+        return waiting if self.last_lag is None else max(self.last_lag, waiting)
+
+    @property
+    def average_lag(self):
+        return self._total / self.samples if self.samples else None
+
+    def _ping(self):
+        self._timer = None
+        self._sent = self._protocol._loop.time()
+        self._payload = "{}{:.6f}".format(PING_PREFIX, self._sent)
+        self._protocol.send_msg(irc.Ping(self._payload))
+        self._schedule(self.timeout, self._timed_out)
+
+    def on_pong(self, msg):
+        """Called for every PONG, returns whether it answered one of our PINGs."""
+        payload = msg.payload
+        if not payload.startswith(PING_PREFIX):
+            return False
+        try:
+            sent = float(payload[len(PING_PREFIX):])
+        except ValueError:
+            return False
+        lag = self._protocol._loop.time() - sent
+        self.last_lag = lag
+        self.max_lag = lag if self.max_lag is None else max(self.max_lag, lag)
+        self.samples += 1
+        self._total += lag
+        if payload == self._payload:
+            self._sent = self._payload = None
+            self._schedule(self.interval, self._ping)
+        return True
+
+    def _timed_out(self):
+        self._timer = None
+        self._protocol.log("No PONG for %.1fs, dropping the connection.", self.lag, level=logging.WARNING)
+        self._protocol.destroy(abort=True)
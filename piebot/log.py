@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import logging.handlers
+import queue
+
+FORMAT = "[%(asctime)s] [%(levelname)s] %(message)s"
+DATEFMT = "%d.%m.%Y %H:%M:%S"
+
+_handler = None
+_listener = None
+_settings = None
+
+
+def configure_logging(level=logging.INFO, filename=None, fmt=FORMAT, datefmt=DATEFMT):
+    """Opt-in logging setup. Records are handed to a QueueHandler and written
+        to stderr (and filename, if given) by a QueueListener thread, so the
+        event loop never waits for log I/O. Returns the started listener.
+    """
+    global _handler, _listener, _settings
+    stop_logging()
+    _settings = {"level": level, "filename": filename, "fmt": fmt, "datefmt": datefmt}
+    formatter = logging.Formatter(fmt, datefmt=datefmt)
+    handlers = [logging.StreamHandler()]
+    if filename is not None:
+        handlers.append(logging.FileHandler(filename, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    records = queue.Queue()
+    _handler = logging.handlers.QueueHandler(records)
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def settings():
+    """The arguments of the active configure_logging() call, None if logging is not configured."""
+    return None if _settings is None else dict(_settings)
+
+
+def configure_worker_logging(settings):
+    """Sets up logging in a worker process with settings() of its parent.
+        A forked worker inherits the parent's handler but not its listener
+        thread; the handler is dropped without touching its queue, which
+        may have been locked at fork time.
+    """
+    global _handler, _listener, _settings
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+    _handler = _listener = _settings = None
+    if settings is not None:
+        configure_logging(**settings)
+
+
+def stop_logging():
+    """Writes out all queued records and removes the handler installed by configure_logging()."""
+    global _handler, _listener, _settings
+    _settings = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
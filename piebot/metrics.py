@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+import collections
+
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.1, 1.0)
+
+
+# Values ConnectionManager reads at export time rather than counting on the hot path.
+GAUGES = {
+    "connected": ("gauge", "Whether the endpoint is connected."),
+    "send_queue_depth": ("gauge", "Lines waiting in the write and flood control queues."),
+    "reconnect_attempts_total": ("counter", "Connection attempts made."),
+    "reconnect_failures": ("gauge", "Consecutive failed or unstable connections."),
+    "lag_seconds": ("gauge", "Current lag, measured by client PINGs."),
+    "lag_max_seconds": ("gauge", "Highest lag of the connection."),
+}
+
+
+class Histogram(object):
+    """Fixed-bucket histogram, counts are per bucket and made cumulative on export."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Estimates the q-quantile (0 <= q <= 1) by interpolating within its bucket,
+            like Prometheus' histogram_quantile(). None without observations.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    # Beyond the largest bound, which is all that is known.
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class ProtocolMetrics(object):
+    """Counters of a single connection. Parse time and handler latency are
+        only measured for every sample_every-th line to keep the hooks cheap.
+    """
+
+    def __init__(self, sample_every=16):
+        self.sample_every = sample_every
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_parsed = 0
+        self.dispatched = collections.Counter()
+        self.parse_time = Histogram()
+        self.handler_latency = Histogram()
+
+    def merge(self, other):
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.lines_parsed += other.lines_parsed
+        self.dispatched.update(other.dispatched)
+        self.parse_time.merge(other.parse_time)
+        self.handler_latency.merge(other.handler_latency)
+
+
+def _labels(labels):
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for key, value in labels) + "}"
+
+
+def render_prometheus(endpoints):
+    """Renders Prometheus text format. endpoints maps an endpoint label to a
+        (ProtocolMetrics, gauges) tuple, gauges being a dict of name to value.
+    """
+    lines = []
+
+    def family(name, kind, help):
+        lines.append("# HELP {} {}".format(name, help))
+        lines.append("# TYPE {} {}".format(name, kind))
+
+    counters = [
+        ("piebot_bytes_received_total", "bytes_in", "Bytes received."),
+        ("piebot_bytes_sent_total", "bytes_out", "Bytes written to the transport."),
+        ("piebot_lines_parsed_total", "lines_parsed", "Lines parsed into messages."),
+    ]
+    for name, attribute, help in counters:
+        family(name, "counter", help)
+        for endpoint, (metrics, _) in sorted(endpoints.items()):
+            lines.append("{}{} {}".format(name, _labels([("endpoint", endpoint)]), getattr(metrics, attribute)))
+
+    family("piebot_messages_dispatched_total", "counter", "Messages dispatched, by message class.")
+    for endpoint, (metrics, _) in sorted(endpoints.items()):
+        for command, count in sorted(metrics.dispatched.items()):
+            lines.append("piebot_messages_dispatched_total{} {}".format(
+                _labels([("endpoint", endpoint), ("command", command)]), count))
+
+    histograms = [
+        ("piebot_parse_seconds", "parse_time", "Time to parse a line (sampled)."),
+        ("piebot_handler_seconds", "handler_latency", "Time to dispatch a message to its handlers (sampled)."),
+    ]
+    for name, attribute, help in histograms:
+        family(name, "histogram", help)
+        for endpoint, (metrics, _) in sorted(endpoints.items()):
+            histogram = getattr(metrics, attribute)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(name, _labels([("endpoint", endpoint), ("le", bound)]), cumulative))
+            lines.append("{}_sum{} {}".format(name, _labels([("endpoint", endpoint)]), histogram.sum))
+            lines.append("{}_count{} {}".format(name, _labels([("endpoint", endpoint)]), histogram.count))
+
+    for name, (kind, help) in sorted(GAUGES.items()):
+        family("piebot_" + name, kind, help)
+        for endpoint, (_, gauges) in sorted(endpoints.items()):
+            if name in gauges:
+                lines.append("piebot_{}{} {}".format(name, _labels([("endpoint", endpoint)]), gauges[name]))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    """Serves ConnectionManager.render_metrics() over HTTP on host:port, or on
+        a Unix socket if path is given. Every request gets the current snapshot.
+    """
+
+    def __init__(self, connection_manager, host="127.0.0.1", port=9105, path=None):
+        self._connection_manager = connection_manager
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+
+    async def start(self):
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def _handle(self, reader, writer):
+        try:
+            # Read the request head, its content does not matter.
+            while (await reader.readline()).strip():
+                pass
+            body = self._connection_manager.render_metrics().encode("utf-8")
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n")
+            writer.write("Content-Length: {}\r\n\r\n".format(len(body)).encode("ascii") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import logging
+import random
+import ssl
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointState(object):
+    """Connection bookkeeping of a single endpoint."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.failures = 0
+        self.attempts = 0
+        self.connected = False
+        self.connected_since = None
+        self.last_error = None
+        self.next_attempt = None
+        self.failed = False
+        self.timer = None
+        self.task = None
+
+    def as_dict(self):
+        return {
+            "failures": self.failures,
+            "attempts": self.attempts,
+            "connected": self.connected,
+            "connected_since": self.connected_since,
+            "last_error": self.last_error,
+            "next_attempt": self.next_attempt,
+            "failed": self.failed,
+        }
+
+
+class ReconnectScheduler(object):
+    """Decides when to (re)connect which endpoint.
+        Every failed attempt, and every connection that dropped before being
+        up for stable_after seconds, doubles the delay of the next attempt,
+        starting at base_delay and capped at max_delay. Delays are jittered
+        between half and all of that value so endpoints failing together do
+        not retry together. At most max_in_flight attempts run at a time,
+        the rest wait in line. connect(endpoint) is a coroutine function
+        establishing the connection, network errors and timeouts it raises
+        are failures of that endpoint. Anything else is a bug or a broken
+        config that retrying will not fix, it is logged and the endpoint is
+        marked failed and not tried again until it is scheduled anew.
+    """
+
+    def __init__(self, loop, connect, base_delay=2.0, max_delay=300.0, max_in_flight=4, stable_after=60.0,
+                 random=random.random):
+        self._loop = loop
+        self._connect = connect
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_in_flight = max_in_flight
+        self.stable_after = stable_after
+        self._random = random
+        self._states = {}
+        self._waiting = collections.deque()
+        self._tasks = {}
+        self.in_flight = 0
+
+    def delay(self, endpoint):
+        """Jittered delay before the next attempt for endpoint, based on its failures."""
+        failures = self._states[endpoint].failures
+        delay = min(self.max_delay, self.base_delay * 2 ** failures)
+        return delay / 2 + self._random() * delay / 2
+
+    def schedule(self, endpoint, immediately=False):
+        state = self._states.get(endpoint)
+        if state is None:
+            state = self._states[endpoint] = EndpointState(endpoint)
+        if state.timer is not None:
+            state.timer.cancel()
+        state.failed = False
+        delay = 0 if immediately else self.delay(endpoint)
+        state.next_attempt = self._loop.time() + delay
+        state.timer = self._loop.call_later(delay, self._start, endpoint)
+        logger.debug("Connecting %s:%s in %.1fs.", endpoint[0], endpoint[1], delay)
+
+    def _start(self, endpoint):
+        state = self._states.get(endpoint)
+        if state is None:
+            return
+        state.timer = None
+        if self.in_flight >= self.max_in_flight:
+            self._waiting.append(endpoint)
+            return
+        self.in_flight += 1
+        state.attempts += 1
+        state.next_attempt = None
+        state.task = self._loop.create_task(self._attempt(endpoint))
+        self._tasks[state.task] = endpoint
+
+    async def _attempt(self, endpoint):
+        try:
+            await self._connect(endpoint)
+        except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+            state = self._states.get(endpoint)
+            if state is not None:
+                state.failures += 1
+                state.last_error = str(e)
+                logger.error("Connecting %s:%s failed (%s), attempt %s.", endpoint[0], endpoint[1], e, state.failures)
+                self.schedule(endpoint)
+        except Exception as e:
+            state = self._states.get(endpoint)
+            if state is not None:
+                state.failures += 1
+                state.last_error = "{}: {}".format(type(e).__name__, e)
+                state.failed = True
+            logger.exception("Connecting %s:%s failed, not retrying.", endpoint[0], endpoint[1])
+        finally:
+            self.in_flight -= 1
+            state = self._states.get(endpoint)
+            if state is not None:
+                self._tasks.pop(state.task, None)
+                state.task = None
+            while self._waiting and self.in_flight < self.max_in_flight:
+                self._start(self._waiting.popleft())
+
+    def connected(self, endpoint):
+        state = self._states[endpoint]
+        state.connected = True
+        state.connected_since = self._loop.time()
+
+    def disconnected(self, endpoint):
+        """Schedules the next attempt, with backoff unless the connection had been stable."""
+        state = self._states[endpoint]
+        if state.connected_since is not None and self._loop.time() - state.connected_since >= self.stable_after:
+            state.failures = 0
+        else:
+            state.failures += 1
+        state.connected = False
+        state.connected_since = None
+        self.schedule(endpoint)
+
+    def forget(self, endpoint):
+        state = self._states.pop(endpoint, None)
+        if state is None:
+            return
+        if state.timer is not None:
+            state.timer.cancel()
+        if state.task is not None:
+            state.task.cancel()
+            self._tasks.pop(state.task, None)
+        if endpoint in self._waiting:
+            self._waiting.remove(endpoint)
+
+    def endpoint_of(self, task):
+        """The endpoint a connection attempt task belongs to, or None."""
+        return self._tasks.get(task)
+
+    def state(self, endpoint):
+        return self._states[endpoint].as_dict()
+
+    def states(self):
+        return {endpoint: state.as_dict() for endpoint, state in self._states.items()}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import logging
+import queue
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PIEREC1\n"
+
+RECEIVED = 0
+SENT = 1
+
+# Milliseconds since the previous record, direction, line length.
+_HEADER = struct.Struct("<IBH")
+
+
+class Recorder(object):
+    """Writes the raw lines of a session to a gzip compressed file, each
+        prefixed with the milliseconds since the previous line, its direction
+        and its length. The event loop only packs the records, compressing
+        and writing them is left to a writer thread. close() waits for it.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self._file = gzip.open(path, "wb")
+        self._file.write(MAGIC)
+        self._clock = clock
+        self._last = clock()
+        self.records = 0
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._run, name="piebot-recorder", daemon=True)
+        self._writer.start()
+
+    def record(self, lines, direction=RECEIVED):
+        now = self._clock()
+        delay = min(int((now - self._last) * 1000), 0xffffffff)
+        self._last = now
+        data = []
+        for line in lines:
+            line = line[:0xffff]
+            data.append(_HEADER.pack(delay, direction, len(line)))
+            data.append(line)
+            delay = 0
+        self._queue.put(b"".join(data))
+        self.records += len(lines)
+
+    def _run(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    return
+                self._file.write(data)
+        except Exception:
+            logger.exception("Writing the recording %s failed.", self.path)
+        finally:
+            self._file.close()
+
+    def close(self):
+        """Writes out everything recorded and closes the file."""
+        self._queue.put(None)
+        self._writer.join()
+
+
+def read_recording(path):
+    """Yields (delay in seconds, direction, raw line) for every record of a recording."""
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a piebot recording".format(path))
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            delay, direction, length = _HEADER.unpack(header)
+            yield delay / 1000.0, direction, f.read(length)
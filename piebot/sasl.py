@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import logging
+
+from . import irc
+
+MECHANISMS = ("PLAIN", "EXTERNAL")
+
+# AUTHENTICATE payloads are sent in chunks of 400 bytes.
+CHUNK = 400
+
+
+class SaslAuthentication(object):
+    """SASL PLAIN or EXTERNAL during CAP negotiation. config is the endpoint's
+        "sasl" dict: mechanism, and username and password for PLAIN. EXTERNAL
+        authenticates with the client certificate of the TLS connection.
+        done is called with whether authentication succeeded.
+    """
+
+    def __init__(self, protocol, config, done):
+        self._protocol = protocol
+        self.mechanism = config.get("mechanism", "PLAIN").upper()
+        if self.mechanism not in MECHANISMS:
+            raise ValueError("unsupported SASL mechanism {}".format(self.mechanism))
+        self._username = config.get("username", "")
+        self._password = config.get("password", "")
+        self._done = done
+        self.account = None
+        self.succeeded = None
+
+    def start(self):
+        self._protocol.send_msg(irc.Authenticate(self.mechanism))
+
+    def payload(self):
+        if self.mechanism == "PLAIN":
+            return "{0}\0{0}\0{1}".format(self._username, self._password).encode("utf-8")
+        return b""
+
+    def on_authenticate(self, msg):
+        if msg.payload != "+" or self.succeeded is not None:
+            return
+        data = base64.b64encode(self.payload()).decode("ascii")
+        for i in range(0, len(data), CHUNK):
+            self._protocol.send_msg(irc.Authenticate(data[i:i+CHUNK]))
+        if len(data) % CHUNK == 0:
+            # Empty payloads and payloads ending on a chunk boundary are terminated by "+".
+            self._protocol.send_msg(irc.Authenticate("+"))
+
+    def on_logged_in(self, msg):
+        self.account = msg.account
+
+    def on_success(self, msg):
+        self._finish(True)
+
+    def on_failure(self, msg):
+        self._protocol.log("SASL %s authentication failed: %s", self.mechanism, msg.reason, level=logging.ERROR)
+        self._finish(False)
+
+    def _finish(self, succeeded):
+        if self.succeeded is not None:
+            return
+        self.succeeded = succeeded
+        self._done(succeeded)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import multiprocessing
+
+from . import log
+from .bot import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(conn, shard, setup, logging_settings=None):
+    """Entry point of a worker process: one loop, one ConnectionManager, driven through conn.
+        Logging is configured with logging_settings, see log.settings().
+    """
+    log.configure_worker_logging(logging_settings)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    manager = ConnectionManager(loop)
+    if setup is not None:
+        setup(manager)
+
+    def handle_command():
+        try:
+            command, *args = conn.recv()
+        except EOFError:
+            # The supervisor is gone.
+            loop.stop()
+            return
+        if command == "add":
+            manager.add_endpoint(*args)
+        elif command == "remove":
+            manager.remove_endpoint(*args)
+        elif command == "update":
+            manager.update_endpoint(*args)
+        elif command == "stats":
+            conn.send(("stats", shard, manager.stats()))
+        elif command == "stop":
+            manager.close_all()
+            loop.stop()
+
+    loop.add_reader(conn.fileno(), handle_command)
+    try:
+        loop.run_forever()
+    finally:
+        loop.remove_reader(conn.fileno())
+        manager.close_stores()
+        loop.close()
+        log.stop_logging()
+
+
+class Shard(object):
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.endpoints = {}
+        self.restarts = 0
+        self.stats = {}
+
+
+class ShardedConnectionManager(object):
+    """Spreads endpoints over worker processes, each running its own loop and
+        ConnectionManager. Offers the add_endpoint()/remove_endpoint()/
+        update_endpoint()/configs() interface of ConnectionManager, so the
+        same configuration, and ConfigReloader, can be used with it.
+        Crashed workers are restarted with their endpoints and stats are
+        collected from all workers every check_interval seconds. setup is
+        called with every worker's ConnectionManager, e.g. to register
+        handlers; it has to be picklable.
+    """
+
+    def __init__(self, loop, workers=None, setup=None, check_interval=1.0):
+        self._loop = loop
+        self._setup = setup
+        self._check_interval = check_interval
+        self._assignments = {}
+        self._shards = [Shard(i) for i in range(workers or multiprocessing.cpu_count())]
+        for shard in self._shards:
+            self._start(shard)
+        self._timer = self._loop.call_later(self._check_interval, self._check)
+
+    def _start(self, shard):
+        conn, child_conn = multiprocessing.Pipe()
+        args = (child_conn, shard.index, self._setup, log.settings())
+        shard.process = multiprocessing.Process(target=_worker_main, args=args,
+                                                name="piebot-shard-{}".format(shard.index), daemon=True)
+        shard.process.start()
+        child_conn.close()
+        shard.conn = conn
+        self._loop.add_reader(conn.fileno(), self._receive, shard)
+        for endpoint, config in shard.endpoints.items():
+            conn.send(("add", endpoint, config))
+        logger.debug("Shard %s started (pid %s).", shard.index, shard.process.pid)
+
+    def _receive(self, shard):
+        try:
+            message = shard.conn.recv()
+        except (EOFError, OSError):
+            self._loop.remove_reader(shard.conn.fileno())
+            return
+        if message[0] == "stats":
+            shard.stats = message[2]
+
+    def _check(self):
+        for shard in self._shards:
+            if not shard.process.is_alive():
+                logger.error("Shard %s died with exit code %s, restarting.", shard.index, shard.process.exitcode)
+                self._loop.remove_reader(shard.conn.fileno())
+                shard.conn.close()
+                shard.restarts += 1
+                self._start(shard)
+            else:
+                self._send(shard, ("stats",))
+        self._timer = self._loop.call_later(self._check_interval, self._check)
+
+    def _send(self, shard, message):
+        try:
+            shard.conn.send(message)
+        except (BrokenPipeError, OSError):
+            # Picked up by the next _check().
+            pass
+
+    def add_endpoint(self, endpoint, config):
+        shard = min(self._shards, key=lambda shard: len(shard.endpoints))
+        logger.debug("Endpoint %s:%s assigned to shard %s.", endpoint[0], endpoint[1], shard.index)
+        self._assignments[endpoint] = shard
+        shard.endpoints[endpoint] = config
+        self._send(shard, ("add", endpoint, config))
+
+    def remove_endpoint(self, endpoint):
+        shard = self._assignments.pop(endpoint)
+        del shard.endpoints[endpoint]
+        self._send(shard, ("remove", endpoint))
+
+    def update_endpoint(self, endpoint, config):
+        """Hands a config the live connection can follow to the worker of endpoint,
+            see ConnectionManager.update_endpoint().
+        """
+        shard = self._assignments[endpoint]
+        shard.endpoints[endpoint] = config
+        self._send(shard, ("update", endpoint, config))
+
+    def configs(self):
+        """The config of every endpoint."""
+        return {endpoint: shard.endpoints[endpoint] for endpoint, shard in self._assignments.items()}
+
+    def shard_of(self, endpoint):
+        return self._assignments[endpoint].index
+
+    def stats(self):
+        """The latest stats reported by every worker, by shard index."""
+        return {shard.index: dict(shard.stats, endpoints=len(shard.endpoints), restarts=shard.restarts,
+                                  pid=shard.process.pid) for shard in self._shards}
+
+    def stop(self, timeout=5):
+        self._timer.cancel()
+        for shard in self._shards:
+            self._loop.remove_reader(shard.conn.fileno())
+            self._send(shard, ("stop",))
+        for shard in self._shards:
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.conn.close()
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+from . import irc
+from .isupport import ISupport
+
+_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_LOWER = "abcdefghijklmnopqrstuvwxyz"
+
+# Translation tables of the CASEMAPPING values servers announce, unknown values fall back to ascii.
+CASEMAPPINGS = {
+    "ascii": str.maketrans(_UPPER, _LOWER),
+    "rfc1459": str.maketrans(_UPPER + "[]\\~", _LOWER + "{}|^"),
+    "strict-rfc1459": str.maketrans(_UPPER + "[]\\", _LOWER + "{}|"),
+}
+
+
+class Channel(object):
+    """A channel we are in. members maps casefolded nicks to the set of
+        prefix modes (e.g. "o", "v") the member has in this channel.
+    """
+    __slots__ = ("name", "topic", "modes", "members", "synced")
+
+    def __init__(self, name):
+        self.name = name
+        self.topic = None
+        self.modes = {}
+        self.members = {}
+        self.synced = False
+
+    def __repr__(self):
+        return "<Channel {} ({} members)>".format(self.name, len(self.members))
+
+
+class User(object):
+    """A user sharing at least one channel with us. channels holds the
+        casefolded names of those channels.
+    """
+    __slots__ = ("nick", "ident", "host", "realname", "channels")
+
+    def __init__(self, nick, ident=None, host=None):
+        self.nick = nick
+        self.ident = ident
+        self.host = host
+        self.realname = None
+        self.channels = set()
+
+    def __repr__(self):
+        return "<User {} ({} channels)>".format(self.nick, len(self.channels))
+
+
+class NetworkState(object):
+    """Channels, members, modes and our own nick on one connection, updated
+        from every received message by update(). Channels and users are
+        indexed by their names casefolded according to the server's
+        CASEMAPPING, and each side keeps the keys of the other, so membership
+        lookups are single dict lookups and a QUIT only touches the channels
+        of the quitting user. isupport is the connection's ISupport, which
+        is kept up to date from RPL_ISUPPORT.
+    """
+
+    def __init__(self, nick=None, isupport=None):
+        self.nick = nick
+        self.isupport = isupport if isupport is not None else ISupport()
+        self.modes = set()
+        self.channels = {}
+        self.users = {}
+        self.set_prefix(*self.isupport.prefix)
+        self.casemapping = None
+        self._table = None
+        self.set_casemapping(self.isupport.casemapping)
+        self._updaters = {
+            irc.Numeric001: self.on_welcome,
+            irc.Numeric005: self.on_isupport,
+            irc.Numeric332: self.on_topic,
+            irc.Numeric352: self.on_who_reply,
+            irc.Numeric353: self.on_names_reply,
+            irc.Numeric366: self.on_end_of_names,
+            irc.Nick: self.on_nick,
+            irc.Join: self.on_join,
+            irc.Part: self.on_part,
+            irc.Kick: self.on_kick,
+            irc.Quit: self.on_quit,
+            irc.Mode: self.on_mode,
+            irc.Topic: self.on_topic,
+        }
+
+    def fold(self, name):
+        """name casefolded according to the server's CASEMAPPING."""
+        return name.translate(self._table)
+
+    def set_casemapping(self, casemapping):
+        """Switches to another CASEMAPPING, rebuilding the indexes if it changes anything."""
+        casemapping = casemapping.lower()
+        if casemapping == self.casemapping:
+            return
+        self.casemapping = casemapping
+        self._table = CASEMAPPINGS.get(casemapping, CASEMAPPINGS["ascii"])
+        if not self.channels:
+            return
+        fold, users, channels = self.fold, self.users, self.channels
+        for channel in channels.values():
+            channel.members = {fold(users[key].nick): modes for key, modes in channel.members.items()}
+        for user in users.values():
+            user.channels = {fold(channels[key].name) for key in user.channels}
+        self.users = {fold(user.nick): user for user in users.values()}
+        self.channels = {fold(channel.name): channel for channel in channels.values()}
+
+    def set_prefix(self, modes, symbols):
+        """Sets the prefix modes (e.g. "ov") and their nick prefixes (e.g. "@+"), as announced by PREFIX."""
+        self.prefix_modes = modes
+        self.prefix_symbols = symbols
+        self._symbol_modes = dict(zip(symbols, modes))
+
+    def update(self, msg):
+        """Applies a received message to the state."""
+        updater = self._updaters.get(type(msg))
+        if updater is not None:
+            updater(msg)
+
+    # Lookups
+
+    def is_me(self, nick):
+        return self.nick is not None and self.fold(nick) == self.fold(self.nick)
+
+    def is_channel(self, name):
+        return name[0:1] in self.isupport.chantypes
+
+    def channel(self, name):
+        """The Channel called name, or None if we are not in it."""
+        return self.channels.get(self.fold(name))
+
+    def user(self, nick):
+        """The User called nick, or None if they share no channel with us."""
+        return self.users.get(self.fold(nick))
+
+    def is_on(self, nick, channel):
+        """Whether nick is in channel."""
+        channel = self.channels.get(self.fold(channel))
+        return channel is not None and self.fold(nick) in channel.members
+
+    def modes_of(self, nick, channel):
+        """The prefix modes nick has in channel, an empty set if nick is not in it."""
+        channel = self.channels.get(self.fold(channel))
+        if channel is None:
+            return set()
+        return channel.members.get(self.fold(nick), set())
+
+    def channels_of(self, nick):
+        """Names of the channels nick shares with us."""
+        user = self.users.get(self.fold(nick))
+        if user is None:
+            return []
+        return [self.channels[key].name for key in user.channels]
+
+    def common_channels(self, nick, other):
+        """Names of the channels (among ours) both nick and other are in."""
+        user = self.users.get(self.fold(nick))
+        other = self.users.get(self.fold(other))
+        if user is None or other is None:
+            return []
+        return [self.channels[key].name for key in user.channels & other.channels]
+
+    # Index maintenance
+
+    def _add_member(self, channel, nick, ident=None, host=None, modes=()):
+        key = self.fold(nick)
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = User(nick, ident, host)
+        elif ident is not None:
+            user.ident, user.host = ident, host
+        channel_key = self.fold(channel.name)
+        user.channels.add(channel_key)
+        members = channel.members
+        if key in members:
+            members[key].update(modes)
+        else:
+            members[key] = set(modes)
+        return user
+
+    def _remove_member(self, channel, nick):
+        channel_key = self.fold(channel)
+        channel = self.channels.get(channel_key)
+        if channel is None:
+            return
+        key = self.fold(nick)
+        channel.members.pop(key, None)
+        user = self.users.get(key)
+        if user is not None:
+            user.channels.discard(channel_key)
+            if not user.channels:
+                del self.users[key]
+
+    def _remove_channel(self, channel):
+        channel_key = self.fold(channel)
+        channel = self.channels.pop(channel_key, None)
+        if channel is None:
+            return
+        users = self.users
+        for key in channel.members:
+            user = users.get(key)
+            if user is not None:
+                user.channels.discard(channel_key)
+                if not user.channels:
+                    del users[key]
+
+    # Updaters
+
+    def on_welcome(self, msg):
+        self.nick = msg.nick
+
+    def on_isupport(self, msg):
+        self.isupport.update(msg.tokens)
+        self.set_prefix(*self.isupport.prefix)
+        self.set_casemapping(self.isupport.casemapping)
+
+    def on_nick(self, msg):
+        old, new = msg.old_nick, msg.nick
+        if self.is_me(old):
+            self.nick = new
+        old_key, new_key = self.fold(old), self.fold(new)
+        user = self.users.pop(old_key, None)
+        if user is None:
+            return
+        user.nick = new
+        self.users[new_key] = user
+        if old_key == new_key:
+            return
+        for channel_key in user.channels:
+            members = self.channels[channel_key].members
+            members[new_key] = members.pop(old_key)
+
+    def on_join(self, msg):
+        name = msg.channel
+        channel = self.channels.get(self.fold(name))
+        if channel is None:
+            if not self.is_me(msg.nick):
+                return
+            channel = self.channels[self.fold(name)] = Channel(name)
+        self._add_member(channel, msg.nick, msg.get("ident"), msg.get("host"))
+
+    def on_part(self, msg):
+        if self.is_me(msg.nick):
+            self._remove_channel(msg.channel)
+        else:
+            self._remove_member(msg.channel, msg.nick)
+
+    def on_kick(self, msg):
+        if self.is_me(msg.target):
+            self._remove_channel(msg.channel)
+        else:
+            self._remove_member(msg.channel, msg.target)
+
+    def on_quit(self, msg):
+        key = self.fold(msg.nick)
+        user = self.users.pop(key, None)
+        if user is None:
+            return
+        channels = self.channels
+        for channel_key in user.channels:
+            channels[channel_key].members.pop(key, None)
+
+    def on_mode(self, msg):
+        msg.use_isupport(self.isupport)
+        if msg.usermode:
+            if self.is_me(msg.subject):
+                for flag in msg.flags:
+                    if flag[1]:
+                        self.modes.add(flag[0])
+                    else:
+                        self.modes.discard(flag[0])
+            return
+        channel = self.channels.get(self.fold(msg.subject))
+        if channel is None:
+            return
+        prefix_modes, list_modes = self.prefix_modes, self.isupport.chanmodes[0]
+        for flag in msg.flags:
+            mode, adding, arg = flag if len(flag) == 3 else flag + (None,)
+            if mode in prefix_modes:
+                if arg is None:
+                    continue
+                member = channel.members.get(self.fold(arg))
+                if member is not None:
+                    if adding:
+                        member.add(mode)
+                    else:
+                        member.discard(mode)
+            elif mode in list_modes:
+                # List modes (bans, exceptions, ...) are not tracked.
+                continue
+            elif adding:
+                channel.modes[mode] = arg if arg is not None else True
+            else:
+                channel.modes.pop(mode, None)
+
+    def on_topic(self, msg):
+        channel = self.channels.get(self.fold(msg.channel))
+        if channel is not None:
+            channel.topic = msg.topic
+
+    def on_names_reply(self, msg):
+        channel = self.channels.get(self.fold(msg.channel))
+        if channel is None:
+            return
+        symbol_modes = self._symbol_modes
+        for name in msg.names:
+            modes = []
+            while name[0:1] in symbol_modes:
+                modes.append(symbol_modes[name[0]])
+                name = name[1:]
+            if "!" in name:
+                nick, ident, host = irc.split_subject(name)
+                self._add_member(channel, nick, ident, host, modes)
+            else:
+                self._add_member(channel, name, modes=modes)
+
+    def on_end_of_names(self, msg):
+        channel = self.channels.get(self.fold(msg.channel))
+        if channel is not None:
+            channel.synced = True
+
+    def on_who_reply(self, msg):
+        channel = self.channels.get(self.fold(msg.channel))
+        if channel is None:
+            return
+        symbol_modes = self._symbol_modes
+        modes = [symbol_modes[symbol] for symbol in msg.flags if symbol in symbol_modes]
+        user = self._add_member(channel, msg.nick, msg.ident, msg.host, modes)
+        user.realname = msg.realname
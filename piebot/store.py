@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+
+import array
+import asyncio
+import bisect
+import glob
+import logging
+import mmap
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+
+from . import irc
+from .state import CASEMAPPINGS
+
+logger = logging.getLogger(__name__)
+
+# Record length including this header, time in ms, command, lengths of network, channel, nick and text.
+_HEADER = struct.Struct("<IqBBBBH")
+_LENGTH = struct.Struct("<I")
+_MAX_RECORD = _HEADER.size + 3 * 0xff + 0xffff
+
+SEGMENT_SIZE = 64 * 2**20
+
+COMMANDS = ("PRIVMSG", "NOTICE", "JOIN", "PART", "KICK", "TOPIC", "QUIT", "NICK")
+
+# Stored message classes, with their command and a function returning (channel, nick, text).
+_EXTRACT = {
+    irc.Privmsg: (0, lambda msg: (msg.target, msg.source, msg.message)),
+    irc.Notice: (1, lambda msg: (msg.target, msg.source, msg.message)),
+    irc.Join: (2, lambda msg: (msg.channel, msg.nick, None)),
+    irc.Part: (3, lambda msg: (msg.channel, msg.nick, msg.message)),
+    irc.Kick: (4, lambda msg: (msg.channel, msg.source, "{} {}".format(msg.target, msg.message or "").rstrip())),
+    irc.Topic: (5, lambda msg: (msg.channel, msg.source, msg.topic)),
+    irc.Quit: (6, lambda msg: (None, msg.nick, msg.message)),
+    irc.Nick: (7, lambda msg: (None, msg.old_nick, msg.nick)),
+}
+
+# Commands that may be sent to a nick instead of a channel, those private messages are not stored.
+_TARGETED = (0, 1)
+
+
+class Record(object):
+    """A stored message. time is in seconds since the epoch, channel is
+        empty for QUIT and NICK, text is the new nick for NICK.
+    """
+    __slots__ = ("time", "network", "channel", "nick", "command", "text")
+
+    def __init__(self, time, network, channel, nick, command, text):
+        self.time = time
+        self.network = network
+        self.channel = channel
+        self.nick = nick
+        self.command = command
+        self.text = text
+
+    def __repr__(self):
+        return "<Record {:.3f} {} {} {} {} {!r}>".format(self.time, self.network, self.channel, self.nick,
+                                                          self.command, self.text)
+
+
+def _encode(time_ms, command, network, channel, nick, text):
+    network = network.encode("utf-8")[:0xff]
+    channel = channel.encode("utf-8")[:0xff]
+    nick = nick.encode("utf-8")[:0xff]
+    text = text.encode("utf-8")[:0xffff]
+    length = _HEADER.size + len(network) + len(channel) + len(nick) + len(text)
+    return b"".join((_HEADER.pack(length, time_ms, command, len(network), len(channel), len(nick), len(text)),
+                     network, channel, nick, text))
+
+
+def _decode(buffer, offset):
+    """(time in ms, command, network, channel, nick, text) of the record at offset."""
+    _, time_ms, command, network, channel, nick, text = _HEADER.unpack_from(buffer, offset)
+    start = offset + _HEADER.size
+    fields = []
+    for length in (network, channel, nick, text):
+        fields.append(buffer[start:start+length].decode("utf-8", "replace"))
+        start += length
+    return (time_ms, command) + tuple(fields)
+
+
+class Segment(object):
+    """An append-only segment file, memory-mapped. Given a size, the file is
+        the writable active segment, grown to size and written in place.
+        Otherwise it is sealed: truncated to its records and mapped read-only.
+    """
+
+    def __init__(self, path, number, size=None):
+        self.path = path
+        self.number = number
+        self.sealed = size is None
+        self.first = None
+        self.last = None
+        if size is not None and not os.path.exists(path):
+            open(path, "wb").close()
+        self._file = open(path, "rb" if self.sealed else "r+b")
+        if not self.sealed and os.path.getsize(path) < size:
+            self._file.truncate(size)
+        if os.path.getsize(path):
+            self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ if self.sealed else mmap.ACCESS_WRITE)
+        else:
+            self.map = b""
+        self.end = len(self.map) if self.sealed else self._find_end()
+
+    def _find_end(self):
+        # The length is written last, so a record cut short by a crash reads as the end.
+        offset = 0
+        size = len(self.map)
+        while offset + _HEADER.size <= size:
+            length = _LENGTH.unpack_from(self.map, offset)[0]
+            if length < _HEADER.size or offset + length > size:
+                break
+            offset += length
+        return offset
+
+    def free(self):
+        return len(self.map) - self.end
+
+    def append(self, data):
+        offset = self.end
+        self.map[offset+_LENGTH.size:offset+len(data)] = data[_LENGTH.size:]
+        self.map[offset:offset+_LENGTH.size] = data[:_LENGTH.size]
+        self.end += len(data)
+        return offset
+
+    def offsets(self, offset=0):
+        while offset < self.end:
+            yield offset
+            offset += _LENGTH.unpack_from(self.map, offset)[0]
+
+    def raw(self, offset):
+        return self.map[offset:offset+_LENGTH.unpack_from(self.map, offset)[0]]
+
+    def seal(self):
+        first, last = self.first, self.last
+        self.close()
+        self.__init__(self.path, self.number)
+        self.first, self.last = first, last
+
+    def close(self):
+        if not isinstance(self.map, mmap.mmap):
+            self._file.close()
+            return
+        if not self.sealed:
+            self.map.flush()
+        self.map.close()
+        if not self.sealed:
+            # Do not leave the unused preallocated space behind.
+            self._file.truncate(self.end)
+        self._file.close()
+
+
+class _Index(object):
+    """Per key arrays of times and positions, in time order."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, key, time_ms, position):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = (array.array("q"), array.array("q"))
+        entry[0].append(time_ms)
+        entry[1].append(position)
+
+    def extend(self, key, times, positions):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = (array.array("q"), array.array("q"))
+        entry[0].extend(times)
+        entry[1].extend(positions)
+
+    def find(self, key, start=None, end=None, limit=None):
+        """Positions of key from start (inclusive) to end (exclusive), the newest limit ones."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return []
+        times, positions = entry
+        low = 0 if start is None else bisect.bisect_left(times, start)
+        high = len(times) if end is None else bisect.bisect_left(times, end)
+        if limit is not None:
+            low = max(low, high - limit)
+        return positions[low:high]
+
+
+def _ms(seconds):
+    return None if seconds is None else int(seconds * 1000)
+
+
+class MessageStore(object):
+    """Persistent channel history: PRIVMSG, NOTICE, JOIN, PART, KICK, TOPIC,
+        QUIT and NICK messages, appended to memory-mapped segment files in
+        directory and indexed by (network, channel) and (network, nick).
+
+        append() only queues the message. Queued messages are handed to a
+        writer thread every flush_interval seconds or batch_size messages, so
+        encoding and writing stay off the event loop. They show up in
+        queries once written, sync() waits for that.
+
+        The active segment rotates when it has no room for segment_size
+        more bytes. Segments get their index saved next to them when they
+        are sealed or the store is closed, so opening a store only has to
+        scan records written after that. With max_age,
+        records older than max_age seconds are compacted away on rotation,
+        compact() does so on demand. Names are casefolded with casemapping.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, max_age=None, batch_size=1024, flush_interval=0.5,
+                 casemapping="rfc1459", loop=None, clock=time.time):
+        if segment_size < _MAX_RECORD:
+            raise ValueError("segment_size must be at least {} bytes".format(_MAX_RECORD))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._table = CASEMAPPINGS[casemapping]
+        self._loop = loop
+        self._clock = clock
+        self._pending = []
+        self._timer = None
+        self._last_time = 0
+        self._lock = threading.RLock()
+        self._segments = {}
+        self._active = None
+        self._local = None
+        self._channels = _Index()
+        self._nicks = _Index()
+        self.written = 0
+        self.errors = 0
+        self._open()
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._run, name="piebot-store", daemon=True)
+        self._writer.start()
+
+    def fold(self, name):
+        return name.translate(self._table)
+
+    def _path(self, number, suffix=".seg"):
+        return os.path.join(self.directory, "{:08d}{}".format(number, suffix))
+
+    def _open(self):
+        numbers = sorted(int(os.path.basename(path)[:-4]) for path in glob.glob(os.path.join(self.directory, "*.seg")))
+        if not numbers:
+            numbers = [1]
+        for number in numbers:
+            if number == numbers[-1]:
+                segment = self._active = Segment(self._path(number), number, self.segment_size)
+            else:
+                segment = Segment(self._path(number), number)
+            self._segments[number] = segment
+            local, end = self._load_index(segment)
+            if end < segment.end:
+                self._scan(segment, local, end)
+                if segment.sealed:
+                    self._save_index(segment, local)
+            self._merge(local, (self._channels, self._nicks))
+            if segment is self._active:
+                self._local = local
+            if segment.last is not None:
+                self._last_time = max(self._last_time, segment.last)
+
+    def _scan(self, segment, local, start=0):
+        """Indexes the records of segment from offset start on."""
+        base = segment.number << 32
+        table = self._table
+        for offset in segment.offsets(start):
+            _, time_ms, _, network, channel, nick, _ = _HEADER.unpack_from(segment.map, offset)
+            start = offset + _HEADER.size
+            network, channel, nick = (segment.map[start:start+network].decode("utf-8", "replace"),
+                                      segment.map[start+network:start+network+channel].decode("utf-8", "replace"),
+                                      segment.map[start+network+channel:start+network+channel+nick].decode("utf-8", "replace"))
+            if channel:
+                local[0].add((network, channel.translate(table)), time_ms, base | offset)
+            if nick:
+                local[1].add((network, nick.translate(table)), time_ms, base | offset)
+            if segment.first is None:
+                segment.first = time_ms
+            segment.last = time_ms
+
+    def _merge(self, local, indexes):
+        for index, source in zip(indexes, local):
+            for key, (times, positions) in source.entries.items():
+                index.extend(key, times, positions)
+
+    def _load_index(self, segment):
+        """The saved index of segment and the offset up to which it covers the
+            segment, an empty index and 0 if there is none or it does not fit.
+        """
+        try:
+            with open(self._path(segment.number, ".idx"), "rb") as f:
+                end, first, last, channels, nicks = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            end = None
+        local = (_Index(), _Index())
+        if end is None or end > segment.end:
+            return local, 0
+        segment.first, segment.last = first, last
+        local[0].entries = channels
+        local[1].entries = nicks
+        return local, end
+
+    def _save_index(self, segment, local):
+        path = self._path(segment.number, ".idx")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump((segment.end, segment.first, segment.last, local[0].entries, local[1].entries), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def append(self, network, msg, chantypes="#&"):
+        """Queues msg, received on network, if it is of a stored kind. PRIVMSGs
+            and NOTICEs are only stored if sent to a channel, i.e. a target
+            starting with one of chantypes (the server's CHANTYPES).
+        """
+        entry = _EXTRACT.get(type(msg))
+        if entry is None:
+            return
+        command, extract = entry
+        channel, nick, text = extract(msg)
+        if command in _TARGETED and (not channel or channel[0] not in chantypes):
+            return
+        # Times only move forward, the indexes are searched by bisection.
+        now = max(int(self._clock() * 1000), self._last_time)
+        self._last_time = now
+        self._pending.append((now, command, network, channel or "", nick or "", text or ""))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            loop = self._loop
+            if loop is None:
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    # Without an event loop there is nothing to batch against.
+                    self.flush()
+                    return
+            self._timer = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Hands the queued messages to the writer thread."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            self._queue.put(self._pending)
+            self._pending = []
+
+    def sync(self, timeout=None):
+        """Flushes and blocks until the writer thread has written everything queued so far."""
+        self.flush()
+        written = threading.Event()
+        self._queue.put(written.set)
+        return written.wait(timeout)
+
+    def compact(self, max_age=None):
+        """Drops records older than max_age (or the store's max_age) seconds from
+            sealed segments, in the writer thread.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is not None:
+            self.flush()
+            self._queue.put(lambda: self._compact(max_age))
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        with self._lock:
+            self._save_index(self._active, self._local)
+            for segment in self._segments.values():
+                segment.close()
+            self._segments = {}
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                if callable(item):
+                    item()
+                else:
+                    self._write(item)
+            except Exception:
+                self.errors += 1
+                logger.exception("Writing to the message store in %s failed.", self.directory)
+
+    def _write(self, batch):
+        # Only the writer thread changes segments and _local, queries just
+        # need the lock while new records are published to the indexes.
+        added = []
+        for record in batch:
+            data = _encode(*record)
+            if len(data) > self._active.free():
+                self._publish(added)
+                added = []
+                self._rotate()
+            segment = self._active
+            position = segment.number << 32 | segment.append(data)
+            time_ms, _, network, channel, nick, _ = record
+            channel = (network, self.fold(channel)) if channel else None
+            nick = (network, self.fold(nick)) if nick else None
+            if channel is not None:
+                self._local[0].add(channel, time_ms, position)
+            if nick is not None:
+                self._local[1].add(nick, time_ms, position)
+            added.append((time_ms, position, channel, nick))
+            if segment.first is None:
+                segment.first = time_ms
+            segment.last = time_ms
+        self._publish(added)
+        self.written += len(batch)
+
+    def _publish(self, added):
+        with self._lock:
+            for time_ms, position, channel, nick in added:
+                if channel is not None:
+                    self._channels.add(channel, time_ms, position)
+                if nick is not None:
+                    self._nicks.add(nick, time_ms, position)
+
+    def _rotate(self):
+        segment = self._active
+        number = segment.number + 1
+        # Written out beforehand, sealing only remaps the file.
+        segment.map.flush()
+        active = Segment(self._path(number), number, self.segment_size)
+        with self._lock:
+            segment.seal()
+            self._segments[number] = self._active = active
+        self._save_index(segment, self._local)
+        self._local = (_Index(), _Index())
+        if self.max_age is not None:
+            self._compact(self.max_age)
+
+    def _compact(self, max_age):
+        cutoff = int((self._clock() - max_age) * 1000)
+        expired = []
+        rewritten = {}
+        try:
+            for number in sorted(self._segments):
+                segment = self._segments[number]
+                if segment is self._active or segment.first is None or segment.first >= cutoff:
+                    # Segments are in time order, later ones are newer.
+                    break
+                if segment.last < cutoff:
+                    expired.append(segment)
+                else:
+                    rewritten[number] = self._rewrite(segment, cutoff)
+        except Exception:
+            for compacted, _ in rewritten.values():
+                compacted.close()
+            raise
+        if not expired and not rewritten:
+            return
+        # The new segments and indexes are built aside and swapped in at once,
+        # queries keep using the old ones meanwhile.
+        replaced = [self._segments[number] for number in rewritten]
+        segments = dict(self._segments)
+        for segment in expired:
+            del segments[segment.number]
+        indexes = (_Index(), _Index())
+        for number, segment in sorted(segments.items()):
+            if number in rewritten:
+                segments[number], local = rewritten[number]
+            elif segment is self._active:
+                local = self._local
+            else:
+                local = self._load_index(segment)[0]
+            self._merge(local, indexes)
+        with self._lock:
+            self._segments = segments
+            self._channels, self._nicks = indexes
+        for segment in expired + replaced:
+            segment.close()
+        for segment in expired:
+            os.remove(segment.path)
+            os.remove(self._path(segment.number, ".idx"))
+
+    def _rewrite(self, segment, cutoff):
+        """A sealed copy of segment with the records from cutoff on, and its
+            index. The copy replaces the file of segment, which stays readable
+            until it is closed.
+        """
+        path = segment.path + ".tmp"
+        with open(path, "wb") as f:
+            for offset in segment.offsets():
+                if _HEADER.unpack_from(segment.map, offset)[1] >= cutoff:
+                    f.write(segment.raw(offset))
+        compacted = Segment(path, segment.number)
+        try:
+            local = (_Index(), _Index())
+            self._scan(compacted, local)
+            # The old saved index covers more than the compacted file holds, so
+            # it is never loaded for it, even if saving the new one fails.
+            os.replace(path, segment.path)
+            compacted.path = segment.path
+            self._save_index(compacted, local)
+        except Exception:
+            compacted.close()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return compacted, local
+
+    def _records(self, positions):
+        records = []
+        for position in positions:
+            time_ms, command, network, channel, nick, text = _decode(self._segments[position >> 32].map,
+                                                                     position & 0xffffffff)
+            records.append(Record(time_ms / 1000.0, network, channel, nick, COMMANDS[command], text))
+        return records
+
+    def history(self, network, channel, start=None, end=None, limit=None):
+        """Records of channel on network from start (inclusive) to end (exclusive),
+            in seconds since the epoch, oldest first. limit keeps the newest ones.
+        """
+        with self._lock:
+            return self._records(self._channels.find((network, self.fold(channel)), _ms(start), _ms(end), limit))
+
+    def by_nick(self, network, nick, start=None, end=None, limit=None):
+        """Records sent by nick on network, like history()."""
+        with self._lock:
+            return self._records(self._nicks.find((network, self.fold(nick)), _ms(start), _ms(end), limit))
+
+    def last_seen(self, network, nick):
+        """The latest Record of nick on network, or None."""
+        records = self.by_nick(network, nick, limit=1)
+        return records[0] if records else None
+
+    def search(self, network, channel, text, start=None, end=None, limit=None):
+        """Records of channel whose text contains text, ignoring case, like history()."""
+        text = text.casefold()
+        found = []
+        with self._lock:
+            positions = self._channels.find((network, self.fold(channel)), _ms(start), _ms(end))
+            for position in reversed(positions):
+                record = self._records([position])[0]
+                if text in record.text.casefold():
+                    found.append(record)
+                    if limit is not None and len(found) >= limit:
+                        break
+        found.reverse()
+        return found
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import ssl
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client SSLContext that keeps the last TLS session per server name and
+        offers it on the next handshake, so reconnects resume the session
+        instead of doing a full handshake. asyncio does not pass sessions,
+        which is why this happens in wrap_bio().
+    """
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        super().__init__()
+        self.sessions = {}
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side=server_side, server_hostname=server_hostname,
+                                session=session)
+
+    def remember(self, server_hostname, ssl_object):
+        """Keeps the session of a connection's ssl_object for the next one to server_hostname."""
+        session = ssl_object.session
+        if session is not None:
+            self.sessions[server_hostname] = session
+
+
+def create_context(cafile=None, certfile=None, keyfile=None, verify=True):
+    """A ResumingSSLContext with the defaults of ssl.create_default_context().
+        cafile replaces the system CAs, certfile/keyfile set a client
+        certificate (for SASL EXTERNAL), verify=False skips certificate and
+        hostname checks.
+    """
+    context = ResumingSSLContext()
+    if cafile is not None:
+        context.load_verify_locations(cafile)
+    else:
+        context.load_default_certs()
+    if certfile is not None:
+        context.load_cert_chain(certfile, keyfile)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
@@ -1,29 +1,30 @@
 import asyncio
+import logging
+import sys
 from piebot import ConnectionManager
+from piebot.config import ConfigError, ConfigReloader
+from piebot.log import configure_logging, stop_logging
+
+configure_logging(logging.DEBUG)
 
 loop = asyncio.get_event_loop()
 
-# TODO: Move configuration into a config file!
+# Endpoints and their configs, see config.example.json. Reloaded on SIGHUP and when the file changes.
 connection_manager = ConnectionManager(loop)
-connection_manager.add_endpoint(("irc.euirc.net", 6667), {
-    "encoding": "utf-8",
-    "nick": "Pb42",
-    "ident": "foobar2000",
-    "realname": "Baz McBatzen",
-    "channels": ["#botted"]
-})
-connection_manager.add_endpoint(("irc.freenode.net", 6667), {
-    "encoding": "utf-8",
-    "nick": "Pb42",
-    "ident": "foobar2000",
-    "realname": "Baz McBatzen",
-    "channels": ["#botted"]
-})
+try:
+    reloader = ConfigReloader(loop, connection_manager, sys.argv[1] if len(sys.argv) > 1 else "config.json").start()
+except ConfigError as e:
+    for problem in e.problems:
+        logging.getLogger("piebot").error("%s: %s", e.path, problem)
+    stop_logging()
+    sys.exit(1)
 
 try:
     loop.run_forever()
 except KeyboardInterrupt:
     pass
 finally:
+    reloader.stop()
+    connection_manager.close_stores()
     loop.close()
-
+    stop_logging()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""A minimal local IRC server and fake transport for protocol tests."""
+
+import asyncio
+import base64
+
+from piebot.bot import IrcProtocol
+from piebot.flood import TokenBucket
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.writes = []
+        self.closed = False
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.closed = True
+
+    def get_extra_info(self, name, default=None):
+        if name == "peername":
+            return ("127.0.0.1", 6667)
+        return default
+
+
+class FakeConnectionManager(object):
+
+    def register_active_connection(self, endpoint, protocol):
+        pass
+
+    def unregister_active_connection(self, endpoint, protocol):
+        pass
+
+
+def make_protocol(loop=None, **config):
+    config.setdefault("encoding", "utf-8")
+    config.setdefault("nick", "Pb42")
+    config.setdefault("ident", "pie")
+    config.setdefault("realname", "Pie Bot")
+    config.setdefault("channels", [])
+    config.setdefault("flood_rate", None)
+    protocol = IrcProtocol(config=config, loop=loop, connection_manager=FakeConnectionManager(), endpoint=("127.0.0.1", 6667))
+    transport = FakeTransport()
+    protocol.connection_made(transport)
+    return protocol, transport
+
+
+class FakeClient(asyncio.Protocol):
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b""
+        self.bucket = None
+        self.sasl_mechanism = None
+        self.negotiating = False
+        self.nick_sent = False
+        if server.flood_rate:
+            self.bucket = TokenBucket(server.flood_rate, server.flood_burst, clock=server.loop.time)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.clients.append(self)
+
+    def data_received(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\r\n")
+        for line in lines:
+            if self.transport.is_closing():
+                return
+            if self.bucket is not None and not self.bucket.consume():
+                self.server.flood_kills += 1
+                self.send("ERROR :Closing Link: (Excess Flood)")
+                self.transport.close()
+                return
+            self.server.lines.append((self.server.loop.time(), line.decode("utf-8", "replace")))
+            self.server.line_received(self, line.decode("utf-8", "replace"))
+
+    def send(self, line):
+        self.transport.write(line.encode("utf-8") + b"\r\n")
+
+
+class FakeIrcServer(object):
+    """Listens on a random local port, records received lines and, if a
+        flood_rate is given, disconnects clients exceeding it like an ircd would.
+        Offers caps to CAP LS, sends the isupport tokens on registration and
+        confirms every PART and every JOIN, unless join_errors maps the channel to a
+        (numeric, reason) tuple. With an ssl context it speaks TLS, SASL PLAIN
+        checks accounts (username to password) and EXTERNAL accepts any
+        client certificate. Without answer_pings PINGs go unanswered, as on a
+        connection that silently died.
+    """
+
+    def __init__(self, loop, flood_rate=None, flood_burst=5, isupport=(), join_errors=None, caps=(), ssl=None,
+                 accounts=None, answer_pings=True):
+        self.loop = loop
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.isupport = isupport
+        self.join_errors = join_errors or {}
+        self.caps = caps
+        self.ssl = ssl
+        self.accounts = accounts or {}
+        self.answer_pings = answer_pings
+        self.logins = []
+        self.clients = []
+        self.lines = []
+        self.flood_kills = 0
+        self.port = None
+        self._server = None
+
+    def start(self):
+        self._server = self.loop.run_until_complete(
+            self.loop.create_server(lambda: FakeClient(self), "127.0.0.1", 0, ssl=self.ssl))
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        for client in self.clients:
+            client.transport.close()
+        self._server.close()
+        self.loop.run_until_complete(self._server.wait_closed())
+
+    def welcome(self, client):
+        client.send(":fake.server 001 Pb42 :Welcome")
+        if self.isupport:
+            client.send(":fake.server 005 Pb42 {} :are supported by this server".format(" ".join(self.isupport)))
+        client.send(":fake.server 376 Pb42 :End of /MOTD command.")
+
+    def line_received(self, client, line):
+        if line.startswith("NICK "):
+            client.nick_sent = True
+            if not client.negotiating:
+                self.welcome(client)
+        elif line.startswith("CAP LS"):
+            # Like a real server, registration waits for CAP END from here on.
+            client.negotiating = True
+            client.send(":fake.server CAP * LS :{}".format(" ".join(self.caps)))
+        elif line == "CAP END":
+            client.negotiating = False
+            if client.nick_sent:
+                self.welcome(client)
+        elif line.startswith("CAP REQ "):
+            requested = line[8:].lstrip(":")
+            known = [cap.partition("=")[0] for cap in self.caps]
+            reply = "ACK" if all(cap in known for cap in requested.split()) else "NAK"
+            client.send(":fake.server CAP * {} :{}".format(reply, requested))
+        elif line.startswith("AUTHENTICATE "):
+            payload = line[13:]
+            if payload in ("PLAIN", "EXTERNAL"):
+                client.sasl_mechanism = payload
+                client.send("AUTHENTICATE +")
+                return
+            if client.sasl_mechanism == "EXTERNAL":
+                account = "cert" if client.transport.get_extra_info("peercert") else None
+            else:
+                _, username, password = base64.b64decode(payload).decode("utf-8").split("\0")
+                account = username if self.accounts.get(username) == password else None
+            if account is None:
+                client.send(":fake.server 904 * :SASL authentication failed")
+            else:
+                self.logins.append((client.sasl_mechanism, account))
+                client.send(":fake.server 900 * * {} :You are now logged in as {}".format(account, account))
+                client.send(":fake.server 903 * :SASL authentication successful")
+        elif line.startswith("JOIN "):
+            for channel in line[5:].split(" ")[0].lstrip(":").split(","):
+                if channel in self.join_errors:
+                    numeric, reason = self.join_errors[channel]
+                    client.send(":fake.server {} Pb42 {} :{}".format(numeric, channel, reason))
+                else:
+                    client.send(":Pb42!pie@fake.client JOIN :{}".format(channel))
+        elif line.startswith("PART "):
+            for channel in line[5:].split(" ")[0].split(","):
+                client.send(":Pb42!pie@fake.client PART {}".format(channel))
+        elif line.startswith("PING ") and self.answer_pings:
+            client.send(":fake.server PONG fake.server " + line[5:])
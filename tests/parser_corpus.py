@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""The previous irc.parse() implementation and a generator for realistic traffic,
+    shared by the differential parser test and benchmarks/bench_parser.py.
+"""
+
+import random
+
+
+def legacy_parse(line):
+    prefix = ""
+    subject = ""
+    trailing = ""
+    command = ""
+    params = ""
+    if line[0:1] == ":":
+        prefix = ":"
+        line = line[1:]
+        if " " in line:
+            subject, line = line.split(" ", 1)
+    if " :" in line:
+        line, trailing = line.split(" :", 1)
+    if " " in line:
+        command, *middle = line.split()
+        params = middle[:]
+    else:
+        command = line
+    if subject != "" and "!" in subject:
+        s_nick, s_identname = subject.split("!", 1)
+        if "@" in s_identname:
+            s_identname, s_host = s_identname.split("@", 1)
+            s_identname = s_identname.strip("~")
+    else:
+        s_nick = s_identname = s_host = subject
+    return {
+        "prefix": prefix,
+        "subject": subject,
+        "command": command,
+        "params": params,
+        "trailing": trailing,
+        "nick": s_nick,
+        "ident": s_identname,
+        "host": s_host
+    }
+
+
+WORDS = ["duck", "hello", "world", "http://example.com/x?y=1", "o/", ":)", "ünïcödé", "ok:", "a:b", "::", "~", "!", "@"]
+
+MIXES = {
+    "privmsg": {"privmsg": 80, "notice": 5, "join": 5, "part": 5, "ping": 5},
+    "numeric": {"numeric": 85, "privmsg": 10, "ping": 5},
+    "joinpart": {"join": 40, "part": 30, "quit": 25, "privmsg": 5},
+    "mixed": {"privmsg": 50, "numeric": 20, "join": 10, "part": 8, "quit": 5, "mode": 4, "ping": 3},
+}
+
+
+def _hostmask(rnd):
+    # Users keep their hostmask, so the subject cache sees realistic repetition.
+    user = rnd.randrange(500)
+    return "nick{0}!{1}id{0}@host{2}.example.net".format(user, ["~", "", "~~"][user % 3], user % 100)
+
+
+def _text(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(0, 12)))
+
+
+def _line(rnd, kind):
+    if kind == "privmsg":
+        return ":{} PRIVMSG #chan{} :{}".format(_hostmask(rnd), rnd.randrange(20), _text(rnd))
+    if kind == "notice":
+        return ":{} NOTICE Pb42 :{}".format(_hostmask(rnd), _text(rnd))
+    if kind == "join":
+        return ":{} JOIN {}#chan{}".format(_hostmask(rnd), rnd.choice(["", ":"]), rnd.randrange(20))
+    if kind == "part":
+        return ":{} PART #chan{} :{}".format(_hostmask(rnd), rnd.randrange(20), _text(rnd))
+    if kind == "quit":
+        return ":{} QUIT :{}".format(_hostmask(rnd), rnd.choice(["*.net *.split", _text(rnd)]))
+    if kind == "mode":
+        return ":{} MODE #chan{} +ov nick{} nick{}".format(_hostmask(rnd), rnd.randrange(20), rnd.randrange(500), rnd.randrange(500))
+    if kind == "ping":
+        return "PING :irc{}.example.net".format(rnd.randrange(5))
+    numeric = rnd.choice(["001", "005", "353", "352", "366", "372", "375", "376"])
+    if numeric == "353":
+        return ":irc.example.net 353 Pb42 = #chan{} :{}".format(rnd.randrange(20), " ".join(
+            rnd.choice(["", "@", "+"]) + "nick{}".format(rnd.randrange(500)) for _ in range(rnd.randrange(1, 30))))
+    if numeric == "352":
+        return ":irc.example.net 352 Pb42 #chan1 ~id host.net irc.example.net nick{} H@ :0 Real Name".format(rnd.randrange(500))
+    if numeric == "005":
+        return ":irc.example.net 005 Pb42 CHANTYPES=# PREFIX=(ov)@+ NETWORK=Example :are supported by this server"
+    return ":irc.example.net {} Pb42 :{}".format(numeric, _text(rnd))
+
+
+def generate_lines(count, mix="mixed", seed=42):
+    """Returns count generated lines with the traffic mix of MIXES[mix]."""
+    rnd = random.Random(seed)
+    kinds = []
+    for kind, weight in sorted(MIXES[mix].items()):
+        kinds.extend([kind] * weight)
+    return [_line(rnd, rnd.choice(kinds)) for _ in range(count)]
+
+
+def generate_garbage(count, seed=42):
+    """Returns count random lines built from IRC-significant characters."""
+    rnd = random.Random(seed)
+    alphabet = [":", " ", " ", " ", "!", "@", "~", "#", "a", "b", "1", "\t", "x", "PRIVMSG", "376"]
+    return ["".join(rnd.choice(alphabet) for _ in range(rnd.randrange(1, 25))) for _ in range(count)]
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot import irc
+
+from fakeserver import make_protocol
+
+
+class Tags(unittest.TestCase):
+
+    def test_round_trip(self):
+        value = "a; b\\c\r\n"
+        self.assertEqual(irc.unescape_tag_value(irc.escape_tag_value(value)), value)
+        self.assertEqual(irc.escape_tag_value(value), "a\\:\\sb\\\\c\\r\\n")
+        msg = irc.Privmsg("#chan", "hi")
+        msg.update({"tags": {"+draft/reply": "a b", "+typing": ""}})
+        self.assertEqual(str(msg), "@+draft/reply=a\\sb;+typing PRIVMSG #chan :hi")
+        parsed = irc.Message.from_string(str(msg))
+        self.assertEqual(parsed.get("tags"), {"+draft/reply": "a b", "+typing": ""})
+        self.assertEqual(parsed.message, "hi")
+
+
+class Negotiation(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol, self.transport = make_protocol()
+
+    def receive(self, *lines):
+        del self.transport.writes[:]
+        for line in lines:
+            self.protocol.data_received(line.encode("utf-8") + b"\r\n")
+        return b"".join(self.transport.writes).decode("utf-8").split("\r\n")[:-1]
+
+    def test_ls_req_end(self):
+        self.assertEqual(self.transport.writes[0], b"CAP LS :302\r\n")
+        sent = self.receive(":srv CAP * LS * :multi-prefix sasl=PLAIN,EXTERNAL account-tag",
+                            ":srv CAP * LS :batch echo-message server-time")
+        self.assertEqual(sent, ["CAP REQ :multi-prefix batch echo-message server-time"])
+        self.assertEqual(self.protocol.caps.available["sasl"], "PLAIN,EXTERNAL")
+        self.assertFalse(self.protocol.caps.done)
+        sent = self.receive(":srv CAP Pb42 ACK :multi-prefix batch echo-message server-time")
+        self.assertEqual(sent, ["CAP END"])
+        self.assertEqual(self.protocol.caps.enabled, {"multi-prefix", "batch", "echo-message", "server-time"})
+        self.assertEqual(self.receive(":srv CAP Pb42 DEL :echo-message"), [])
+        self.assertNotIn("echo-message", self.protocol.caps.enabled)
+
+    def test_nak_and_nothing_to_request(self):
+        self.assertEqual(self.receive(":srv CAP * LS :batch"), ["CAP REQ :batch"])
+        self.assertEqual(self.receive(":srv CAP * NAK :batch"), ["CAP END"])
+        self.assertEqual(self.protocol.caps.enabled, set())
+        protocol, transport = make_protocol()
+        del transport.writes[:]
+        protocol.data_received(b":srv CAP * LS :sasl\r\n")
+        self.assertEqual(b"".join(transport.writes), b"CAP END\r\n")
+
+    def test_server_without_cap(self):
+        self.assertEqual(self.receive(":srv 421 Pb42 CAP :Unknown command", ":srv 001 Pb42 :Welcome"), [])
+        self.assertTrue(self.protocol.caps.done)
+
+    def test_disabled(self):
+        protocol, transport = make_protocol(caps=())
+        self.assertTrue(transport.writes[0].startswith(b"USER"))
+
+    def test_names_with_multi_prefix_and_userhost(self):
+        self.receive(":Pb42!pie@bot JOIN #chan", ":srv 353 Pb42 = #chan :@+alice!a@host.example bob!b@h")
+        state = self.protocol.state
+        self.assertEqual(state.modes_of("alice", "#chan"), {"o", "v"})
+        self.assertEqual(state.user("alice").host, "host.example")
+
+    def test_echo_is_ignored(self):
+        self.assertEqual(self.receive(":Pb42!pie@bot PRIVMSG #chan :-cycle"), [])
+        self.assertEqual(self.receive(":alice!a@h PRIVMSG #chan :-cycle"), ["PART #chan :Hop!", "JOIN :#chan"])
+
+
+class Batches(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol, self.transport = make_protocol()
+        self.batches = []
+        self.quits = []
+        self.protocol.handlers.register(irc.Batch, lambda protocol, msg: self.batches.append(msg))
+        self.protocol.handlers.register(irc.Quit, lambda protocol, msg: self.quits.append(msg))
+        self.receive(":Pb42!pie@bot JOIN #chan", ":srv 353 Pb42 = #chan :alice bob carol")
+
+    def receive(self, *lines):
+        for line in lines:
+            self.protocol.data_received(line.encode("utf-8") + b"\r\n")
+
+    def test_netsplit_is_handed_over_at_once(self):
+        self.receive(":srv BATCH +split netsplit a.net b.net",
+                     "@batch=split :alice!a@h QUIT :a.net b.net",
+                     "@batch=split :bob!b@h QUIT :a.net b.net")
+        self.assertEqual(self.batches, [])
+        self.assertTrue(self.protocol.state.is_on("alice", "#chan"))
+        self.receive(":srv BATCH -split")
+        self.assertEqual(len(self.batches), 1)
+        batch = self.batches[0]
+        self.assertEqual((batch.type, batch.arguments), ("netsplit", ["a.net", "b.net"]))
+        self.assertEqual([msg.nick for msg in batch.messages], ["alice", "bob"])
+        self.assertEqual(self.quits, [])
+        self.assertFalse(self.protocol.state.is_on("alice", "#chan"))
+        self.assertTrue(self.protocol.state.is_on("carol", "#chan"))
+        self.assertEqual(self.protocol._batches, {})
+
+    def test_nested(self):
+        self.receive(":srv BATCH +outer example",
+                     "@batch=outer :srv BATCH +inner netsplit a.net b.net",
+                     "@batch=inner :alice!a@h QUIT :a.net b.net",
+                     ":srv BATCH -inner",
+                     "@batch=outer :carol!c@h QUIT :bye",
+                     ":srv BATCH -outer")
+        self.assertEqual(len(self.batches), 1)
+        inner, quit = self.batches[0].messages
+        self.assertEqual([msg.nick for msg in inner.messages], ["alice"])
+        self.assertEqual(quit.nick, "carol")
+        self.assertEqual(list(self.protocol.state.channel("#chan").members), ["pb42", "bob"])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot.commands import Command, CommandRouter, UsageError
+
+from fakeserver import make_protocol
+
+
+class Arguments(unittest.TestCase):
+
+    def test_spec(self):
+        command = Command("seen", None, "nick count:int? *text")
+        self.assertEqual(command.parse("bob"), {"nick": "bob", "count": None, "text": ""})
+        self.assertEqual(command.parse("bob 3 said  hi there"), {"nick": "bob", "count": 3, "text": "said  hi there"})
+        with self.assertRaises(UsageError):
+            command.parse("")
+        with self.assertRaises(UsageError):
+            command.parse("bob three")
+        with self.assertRaises(UsageError):
+            Command("x", None, "a").parse("a b")
+        with self.assertRaises(ValueError):
+            Command("x", None, "a:list")
+
+
+class Routing(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [100.0]
+        self.calls = []
+        self.router = CommandRouter(prefix="!", user_rate=1, user_burst=2, max_users=2, clock=lambda: self.now[0])
+        self.protocol, self.transport = make_protocol()
+        self.protocol.commands = self.router
+        del self.transport.writes[:]
+
+    def receive(self, line):
+        self.protocol.data_received(line.encode("utf-8") + b"\r\n")
+        data = b"".join(self.transport.writes).decode("utf-8")
+        del self.transport.writes[:]
+        return data
+
+    def echo(self, protocol, msg, args):
+        self.calls.append(args)
+        return args["text"]
+
+    def test_triggers_and_replies(self):
+        self.router.add("echo", self.echo, "*text", aliases=("say",))
+        self.assertEqual(self.receive(":u!i@h PRIVMSG #pie :!echo hello world"), "PRIVMSG #pie :hello world\r\n")
+        self.assertEqual(self.receive(":u!i@h PRIVMSG Pb42 :!SAY hi"), "PRIVMSG u :hi\r\n")
+        self.assertEqual(self.receive(":v!i@h PRIVMSG #pie :Pb42: echo addressed"), "PRIVMSG #pie :addressed\r\n")
+        self.assertEqual(self.receive(":v!i@h PRIVMSG #pie :!unknown"), "")
+        self.assertEqual(self.receive(":v!i@h PRIVMSG #pie :echo no prefix"), "")
+        with self.assertRaises(ValueError):
+            self.router.add("say", self.echo)
+        self.router.remove("echo")
+        self.assertIsNone(self.router.get("say"))
+
+    def test_usage_errors_reply(self):
+        self.router.add("add", lambda protocol, msg, args: str(args["a"] + args["b"]), "a:int b:int")
+        self.assertEqual(self.receive(":u!i@h PRIVMSG #pie :!add 1 2"), "PRIVMSG #pie :3\r\n")
+        self.assertEqual(self.receive(":u!i@h PRIVMSG #pie :!add 1"), "PRIVMSG #pie :missing b (usage: !add a:int b:int)\r\n")
+
+    def test_cooldown(self):
+        self.router.add("echo", self.echo, "*text", cooldown=10)
+        self.receive(":u!i@h PRIVMSG #pie :!echo one")
+        self.now[0] += 5
+        self.assertEqual(self.receive(":v!i@h PRIVMSG #pie :!echo two"), "")
+        self.now[0] += 5
+        self.assertEqual(self.receive(":v!i@h PRIVMSG #pie :!echo three"), "PRIVMSG #pie :three\r\n")
+        self.assertEqual(self.router.limited, 1)
+
+    def test_user_rate_limit(self):
+        self.router.add("echo", self.echo, "*text")
+        for i in range(4):
+            self.receive(":u!i@h PRIVMSG #pie :!echo {}".format(i))
+        self.receive(":other!i@h PRIVMSG #pie :!echo other")
+        self.assertEqual([args["text"] for args in self.calls], ["0", "1", "other"])
+        self.now[0] += 1
+        self.receive(":U!i@h PRIVMSG #pie :!echo later")
+        self.assertEqual(self.calls[-1]["text"], "later")
+        # Only the most recently seen users are tracked.
+        self.receive(":third!i@h PRIVMSG #pie :!echo third")
+        self.assertEqual(len(self.router._users), 2)
+        self.assertNotIn(("127.0.0.1:6667", "other"), self.router._users)
+
+    def test_builtin_ctcp_and_cycle(self):
+        protocol, transport = make_protocol()
+        protocol.data_received(b":u!i@h PRIVMSG Pb42 :\x01PING 12345\x01\r\n:u!i@h PRIVMSG Pb42 :\x01TIME\x01\r\n")
+        protocol.data_received(b":u!i@h PRIVMSG #pie :-cycle\r\n")
+        lines = b"".join(transport.writes).decode("utf-8").split("\r\n")
+        self.assertIn("NOTICE u :\x01PING 12345\x01", lines)
+        self.assertTrue(any(line.startswith("NOTICE u :\x01TIME ") for line in lines))
+        self.assertEqual(lines[-3:], ["PART #pie :Hop!", "JOIN :#pie", ""])
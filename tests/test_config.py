@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from piebot.bot import ConnectionManager
+from piebot.config import ConfigError, ConfigReloader, load_config, parse_config
+
+from fakeserver import FakeIrcServer
+
+
+def config(*endpoints, **defaults):
+    base = {"nick": "Pb42", "ident": "pie", "realname": "Pie", "greeting": None, "flood_rate": None, "caps": []}
+    base.update(defaults)
+    return {"defaults": base, "endpoints": list(endpoints)}
+
+
+class Validation(unittest.TestCase):
+
+    def test_defaults_and_overrides(self):
+        configs = parse_config(config({"host": "a"}, {"host": "b", "port": 6697, "ssl": True, "nick": "Other"},
+                                      channels=["#pie"]))
+        self.assertEqual(sorted(configs), [("a", 6667), ("b", 6697)])
+        self.assertEqual(configs[("a", 6667)]["nick"], "Pb42")
+        self.assertEqual(configs[("b", 6697)]["nick"], "Other")
+        self.assertNotIn("host", configs[("b", 6697)])
+        self.assertIsNot(configs[("a", 6667)]["channels"], configs[("b", 6697)]["channels"])
+
+    def test_all_problems_are_reported(self):
+        with self.assertRaises(ConfigError) as raised:
+            parse_config(config({"host": "a", "port": 70000, "channels": "#one"}, {"nick": "x"}, {"host": "c"},
+                                {"host": "c", "encoding": "nope", "colour": True}))
+        self.assertEqual(raised.exception.problems, [
+            "endpoints[0]: channels must be a list of channel names, not '#one'",
+            "endpoints[0]: port must be a port number, not 70000",
+            "endpoints[1] has no host",
+            "endpoints[3]: unknown key colour",
+            "endpoints[3]: encoding must be a known encoding, not 'nope'",
+            "endpoints[3]: c:6667 is configured twice",
+        ])
+
+    def test_unreadable_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "config.json")
+            with self.assertRaises(ConfigError):
+                load_config(path)
+            with open(path, "w") as f:
+                f.write("{")
+            with self.assertRaises(ConfigError) as raised:
+                load_config(path)
+            self.assertTrue(raised.exception.problems[0].startswith("invalid JSON"))
+
+
+class Reloading(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "config.json")
+        self.servers = [FakeIrcServer(self.loop).start() for _ in range(3)]
+        self.manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+
+    def tearDown(self):
+        for endpoint in list(self.manager.configs()):
+            self.manager.remove_endpoint(endpoint)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        for server in self.servers:
+            server.stop()
+        self.loop.close()
+        self.directory.cleanup()
+
+    def write(self, *endpoints, **defaults):
+        with open(self.path, "w") as f:
+            json.dump(config(*endpoints, **defaults), f)
+
+    def endpoint(self, server, **options):
+        options.update({"host": "127.0.0.1", "port": server.port})
+        return options
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = self.loop.time() + timeout
+        while not condition() and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def connected(self, server):
+        protocol = self.manager._active_connections.get(("127.0.0.1", server.port))
+        return protocol is not None and protocol.joins is not None and protocol.joins.done
+
+    def received(self, server):
+        return [line for _, line in server.lines if line.startswith(("JOIN", "PART"))]
+
+    def test_reload_applies_only_the_difference(self):
+        a, b, c = self.servers
+        self.write(self.endpoint(a, channels=["#one", "#two"]), self.endpoint(b))
+        reloader = ConfigReloader(self.loop, self.manager, self.path, poll_interval=None).start()
+        self.run_until(lambda: self.connected(a) and self.connected(b))
+        first_a = self.manager._active_connections[("127.0.0.1", a.port)]
+        first_b = self.manager._active_connections[("127.0.0.1", b.port)]
+        self.assertEqual(self.received(a), ["JOIN #one,#two"])
+
+        self.write(self.endpoint(a, channels=["#two", "#three"], channel_keys={"#three": "key"}),
+                   self.endpoint(c), nick="Pb42")
+        self.assertTrue(reloader.reload())
+        self.run_until(lambda: self.connected(c) and ("127.0.0.1", b.port) not in self.manager._active_connections)
+        # Channel changes are JOINs and PARTs on the same connection, b is gone and c is new.
+        self.assertIs(self.manager._active_connections[("127.0.0.1", a.port)], first_a)
+        self.assertEqual(self.received(a), ["JOIN #one,#two", "JOIN #three key", "PART #one"])
+        self.run_until(lambda: first_a.state.channel("#one") is None)
+        self.assertEqual(sorted(first_a.state.channels), ["#three", "#two"])
+        self.assertTrue(first_b._transport.is_closing())
+        self.assertEqual(sorted(self.manager.configs()), sorted([("127.0.0.1", a.port), ("127.0.0.1", c.port)]))
+
+        # Anything else reconnects.
+        self.write(self.endpoint(a, channels=["#two", "#three"], channel_keys={"#three": "key"}),
+                   self.endpoint(c), realname="Changed")
+        self.assertTrue(reloader.reload())
+        self.run_until(lambda: self.manager._active_connections.get(("127.0.0.1", a.port)) not in (None, first_a))
+        self.assertEqual(len(a.clients), 2)
+        reloader.stop()
+
+    def test_reconnect_is_not_raced_by_the_old_connection(self):
+        a = self.servers[0]
+        endpoint = ("127.0.0.1", a.port)
+        self.write(self.endpoint(a))
+        reloader = ConfigReloader(self.loop, self.manager, self.path, poll_interval=None).start()
+        self.run_until(lambda: self.connected(a))
+        first = self.manager._active_connections[endpoint]
+        self.write(self.endpoint(a), realname="Changed")
+        self.assertTrue(reloader.reload())
+        self.run_until(lambda: self.manager._active_connections.get(endpoint) not in (None, first)
+                       and self.connected(a))
+        # Give the old connection's loss time to arrive.
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(len(a.clients), 2)
+        self.assertEqual([client.transport.is_closing() for client in a.clients], [True, False])
+        self.assertEqual(self.manager.reconnects.state(endpoint)["failures"], 0)
+        self.assertIsNot(self.manager._active_connections[endpoint], first)
+        reloader.stop()
+
+    def test_store_directory(self):
+        a, b = self.servers[:2]
+        directory = os.path.join(self.directory.name, "store")
+        self.write(self.endpoint(a), self.endpoint(b), store=directory)
+        reloader = ConfigReloader(self.loop, self.manager, self.path, poll_interval=None).start()
+        self.run_until(lambda: self.connected(a) and self.connected(b))
+        stores = [self.manager._active_connections[("127.0.0.1", server.port)].store for server in (a, b)]
+        # One store for both endpoints, told apart by network.
+        self.assertIs(stores[0], stores[1])
+        self.assertEqual(stores[0].directory, directory)
+        reloader.stop()
+        for endpoint in list(self.manager.configs()):
+            self.manager.remove_endpoint(endpoint)
+        self.manager.close_stores()
+
+    def test_invalid_config_changes_nothing(self):
+        a = self.servers[0]
+        self.write(self.endpoint(a))
+        reloader = ConfigReloader(self.loop, self.manager, self.path, poll_interval=None).start()
+        before = self.manager.configs()
+        self.write(self.endpoint(a, channels=["#ok"]), {"host": "elsewhere", "port": "x"})
+        with self.assertLogs("piebot.config", "ERROR"):
+            self.assertFalse(reloader.reload())
+        self.assertEqual(self.manager.configs(), before)
+        with self.assertRaises(ConfigError):
+            ConfigReloader(self.loop, ConnectionManager(self.loop), self.path).start()
+        reloader.stop()
+
+    def test_file_changes_are_picked_up(self):
+        a, b = self.servers[:2]
+        self.write(self.endpoint(a))
+        reloader = ConfigReloader(self.loop, self.manager, self.path, poll_interval=0.01).start()
+        self.write(self.endpoint(a), self.endpoint(b))
+        # Make sure the modification time differs on coarse file systems.
+        os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 10**9))
+        self.run_until(lambda: len(self.manager.configs()) == 2)
+        self.assertEqual(len(self.manager.configs()), 2)
+        reloader.stop()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot import irc
+from piebot.decoding import Decoder, sender_of
+
+from fakeserver import make_protocol
+
+
+class Decoding(unittest.TestCase):
+
+    def test_sender(self):
+        self.assertEqual(sender_of(b":Bob!i@h PRIVMSG #pie :x"), b"bob")
+        self.assertEqual(sender_of(b"@time=1  :irc.example.net 001 Pb42 :x"), b"irc.example.net")
+        self.assertEqual(sender_of(b"PING :x"), b"")
+        self.assertEqual(sender_of(b"@time=1"), b"")
+
+    def test_utf8_and_fallbacks(self):
+        decoder = Decoder()
+        self.assertEqual(decoder.decode(":a!i@h PRIVMSG #pie :äöü €".encode("utf-8")), ":a!i@h PRIVMSG #pie :äöü €")
+        self.assertEqual(decoder.fallback_lines, 0)
+        self.assertEqual(decoder.decode(":b!i@h PRIVMSG #pie :äöü €".encode("cp1252")), ":b!i@h PRIVMSG #pie :äöü €")
+        # 0x81 is undefined in cp1252, latin-1 takes it.
+        self.assertEqual(decoder.decode(b":C!i@h PRIVMSG #pie :\xe4\x81"), ":C!i@h PRIVMSG #pie :ä\x81")
+        self.assertEqual(decoder.sender_encoding("B"), "cp1252")
+        self.assertEqual(decoder.sender_encoding("c"), "latin-1")
+        self.assertIsNone(decoder.sender_encoding("a"))
+        self.assertEqual(decoder.fallback_lines, 2)
+
+    def test_replacement_without_fallbacks(self):
+        decoder = Decoder(fallbacks=("latin-1", "utf8"))
+        self.assertEqual(decoder.fallbacks, ("latin-1",))
+        decoder = Decoder(fallbacks=())
+        self.assertEqual(decoder.decode(b"PRIVMSG #pie :\xe4"), "PRIVMSG #pie :�")
+        self.assertEqual(decoder.replaced_lines, 1)
+
+    def test_senders_are_limited(self):
+        decoder = Decoder(max_senders=2)
+        for nick in (b"a", b"b", b"a", b"c"):
+            decoder.decode(b":" + nick + b"!i@h PRIVMSG #pie :\xe4")
+        self.assertEqual(list(decoder._senders), [b"a", b"c"])
+
+
+class ReceivedLines(unittest.TestCase):
+
+    def test_latin1_users_are_readable(self):
+        protocol, transport = make_protocol()
+        received = []
+        protocol.handlers.register(irc.Privmsg, lambda protocol, msg: received.append(msg.message))
+        protocol.data_received(":u!i@h PRIVMSG #pie :Grüße\r\n".encode("latin-1") + ":v!i@h PRIVMSG #pie :Grüße\r\n".encode("utf-8"))
+        self.assertEqual(received, ["Grüße", "Grüße"])
+        self.assertEqual(protocol.decoder.fallback_lines, 1)
+
+    def test_lazy_decoding(self):
+        protocol, transport = make_protocol(lazy_decode=True)
+        received = []
+        protocol.handlers.register(irc.Message, lambda protocol, msg: received.append(msg))
+        protocol.data_received(b":irc.example.net 372 Pb42 :- Gr\xfc\xdfe\r\n")
+        msg = received[0]
+        # Dispatched by the raw command, nothing looked at the fields yet.
+        self.assertIsInstance(msg._line, irc.RawLine)
+        self.assertEqual(repr(msg), "<Message ':irc.example.net 372 Pb42 :- Grüße'>")
+        self.assertEqual(msg.get("trailing"), "- Grüße")
+        self.assertIsNone(msg._line)
+        # Lines whose command needs a closer look are decoded right away.
+        self.assertIs(type(irc.Message.from_bytes(b"@a :b", protocol.decode)), irc.Message)
+        self.assertIs(type(irc.Message.from_bytes(b"@a PING :x", protocol.decode)), irc.Ping)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot import irc
+from piebot.events import HandlerRegistry, resolve_command
+
+
+class FakeProtocol(object):
+
+    def __init__(self, loop=None):
+        self._loop = loop
+
+
+class Events(unittest.TestCase):
+
+    def test_resolve_command(self):
+        self.assertIs(resolve_command("privmsg"), irc.Privmsg)
+        self.assertIs(resolve_command("376"), irc.Numeric376)
+        self.assertIs(resolve_command(irc.Kick), irc.Kick)
+        with self.assertRaises(KeyError):
+            resolve_command("NOSUCHCOMMAND")
+
+    def test_dispatch_only_to_subscribers(self):
+        handlers = HandlerRegistry()
+        calls = []
+        handlers.register("PRIVMSG", lambda protocol, msg: calls.append(("privmsg", msg.message)))
+        handlers.register(irc.Ping, lambda protocol, msg: calls.append(("ping", msg.payload)))
+        for raw in [":a!b@c PRIVMSG #x :hi", "PING :p", ":a!b@c NOTICE #x :no", ":srv 001 me :Welcome"]:
+            handlers.dispatch(FakeProtocol(), irc.Message.from_string(raw))
+        self.assertEqual(calls, [("privmsg", "hi"), ("ping", "p")])
+
+    def test_register_at_runtime(self):
+        handlers = HandlerRegistry()
+        calls = []
+
+        @handlers.on("JOIN")
+        def on_join(protocol, msg):
+            calls.append(msg.channel)
+            handlers.unregister("JOIN", on_join)
+
+        msg = irc.Message.from_string(":a!b@c JOIN #x")
+        handlers.dispatch(FakeProtocol(), msg)
+        handlers.dispatch(FakeProtocol(), msg)
+        self.assertEqual(calls, ["#x"])
+        self.assertEqual(handlers.handlers_for(irc.Join), ())
+
+    def test_failing_handler_does_not_stop_dispatch(self):
+        handlers = HandlerRegistry()
+        calls = []
+        handlers.register(irc.Ping, lambda protocol, msg: 1 / 0)
+        handlers.register(irc.Ping, lambda protocol, msg: calls.append(msg))
+        handlers.dispatch(FakeProtocol(), irc.Ping("x"))
+        self.assertEqual(len(calls), 1)
+
+    def test_async_handler_is_scheduled(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        handlers = HandlerRegistry()
+        calls = []
+
+        @handlers.on(irc.Ping)
+        async def on_ping(protocol, msg):
+            await asyncio.sleep(0)
+            calls.append(msg.payload)
+
+        handlers.dispatch(FakeProtocol(loop), irc.Ping("x"))
+        self.assertEqual(calls, [])
+        loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(calls, ["x"])
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import unittest
+from piebot import irc
+from piebot.events import HandlerRegistry
+from piebot.executors import HandlerExecutor, THREAD, PROCESS
+
+
+class FakeProtocol(object):
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.sent = []
+
+    def send_msg(self, msg):
+        self.sent.append(str(msg))
+
+
+def shout(msg):
+    return irc.Privmsg(msg.target, msg.message.upper())
+
+
+release = threading.Event()
+
+
+def blocking(msg):
+    release.wait(5)
+    return [irc.Notice(msg.source, "done"), irc.Notice(msg.source, "really")]
+
+
+class Executors(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = HandlerExecutor(thread_workers=1, process_workers=1, max_pending=2)
+        self.handlers = HandlerRegistry(self.executor)
+        self.protocol = FakeProtocol(self.loop)
+
+    def tearDown(self):
+        release.set()
+        self.executor.shutdown()
+        self.loop.close()
+
+    def settle(self, condition, timeout=10):
+        deadline = self.loop.time() + timeout
+        while not condition() and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_thread_handler_replies_through_protocol(self):
+        self.handlers.register(irc.Privmsg, shout, mode=THREAD)
+        self.handlers.dispatch(self.protocol, irc.Message.from_string(":a!b@c PRIVMSG #x :hi"))
+        self.assertEqual(self.protocol.sent, [])
+        self.settle(lambda: self.protocol.sent)
+        self.assertEqual(self.protocol.sent, ["PRIVMSG #x :HI"])
+        self.assertEqual(self.executor.completed[THREAD], 1)
+
+    def test_lazy_messages_are_parsed_before_offloading(self):
+        release.clear()
+        self.handlers.register(irc.Privmsg, blocking, mode=THREAD)
+        msg = irc.Message.from_string(":a!b@c PRIVMSG #x :hi")
+        self.assertIsNotNone(msg._line)
+        self.handlers.dispatch(self.protocol, msg)
+        self.assertIsNone(msg._line)
+        release.set()
+        self.settle(lambda: len(self.protocol.sent) == 2)
+
+    def test_process_handler_replies_through_protocol(self):
+        self.handlers.register(irc.Privmsg, shout, mode=PROCESS)
+        self.handlers.dispatch(self.protocol, irc.Message.from_string(":a!b@c PRIVMSG #x :hi"))
+        self.settle(lambda: self.protocol.sent)
+        self.assertEqual(self.protocol.sent, ["PRIVMSG #x :HI"])
+
+    def test_overflow_is_rejected(self):
+        release.clear()
+        self.handlers.register(irc.Privmsg, blocking, mode=THREAD)
+        msg = irc.Message.from_string(":a!b@c PRIVMSG #x :hi")
+        for _ in range(5):
+            self.handlers.dispatch(self.protocol, msg)
+        self.assertEqual(self.executor.pending[THREAD], 2)
+        self.assertEqual(self.executor.rejected[THREAD], 3)
+        release.set()
+        self.settle(lambda: len(self.protocol.sent) == 4)
+        self.assertEqual(self.protocol.sent, ["NOTICE a :done", "NOTICE a :really"] * 2)
+        self.assertEqual(self.executor.pending[THREAD], 0)
+
+    def test_unregister_offloaded_handler(self):
+        self.handlers.register(irc.Privmsg, shout, mode=THREAD)
+        self.handlers.unregister(irc.Privmsg, shout)
+        self.assertEqual(self.handlers.handlers_for(irc.Privmsg), ())
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot import irc
+from piebot.bot import IrcProtocol
+from piebot.flood import TokenBucket, FloodControl, PRIORITY_KEEPALIVE, PRIORITY_BULK
+
+from fakeserver import FakeIrcServer, FakeConnectionManager
+
+
+class FakeTimer(object):
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeLoop(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        timer = FakeTimer(self.now + delay, callback)
+        self.timers.append(timer)
+        return timer
+
+    def advance(self, seconds):
+        self.now += seconds
+        while True:
+            self.timers = [t for t in self.timers if not t.cancelled]
+            due = [t for t in self.timers if t.when <= self.now]
+            if not due:
+                break
+            for timer in due:
+                self.timers.remove(timer)
+                timer.callback()
+
+
+class Flood(unittest.TestCase):
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+        self.assertTrue(all(bucket.consume() for _ in range(3)))
+        self.assertFalse(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 0.5)
+        now[0] = 0.5
+        self.assertTrue(bucket.consume())
+        now[0] = 100
+        self.assertEqual(sum(bucket.consume() for _ in range(10)), 3)
+
+    def test_burst_then_rate(self):
+        loop = FakeLoop()
+        sent = []
+        flood = FloodControl(loop, sent.append, rate=1, burst=2)
+        for i in range(5):
+            flood.push(i, PRIORITY_BULK)
+        self.assertEqual(sent, [0, 1])
+        self.assertEqual(len(flood), 3)
+        loop.advance(1)
+        self.assertEqual(sent, [0, 1, 2])
+        loop.advance(2)
+        self.assertEqual(sent, [0, 1, 2, 3, 4])
+        self.assertEqual(len(loop.timers), 0)
+
+    def test_keepalive_skips_bulk(self):
+        loop = FakeLoop()
+        sent = []
+        flood = FloodControl(loop, sent.append, rate=1, burst=1)
+        flood.push("privmsg 1", PRIORITY_BULK)
+        flood.push("privmsg 2", PRIORITY_BULK)
+        flood.push("privmsg 3", PRIORITY_BULK)
+        flood.push("pong", PRIORITY_KEEPALIVE)
+        loop.advance(1)
+        self.assertEqual(sent, ["privmsg 1", "pong"])
+
+    def test_clear(self):
+        loop = FakeLoop()
+        sent = []
+        flood = FloodControl(loop, sent.append, rate=1, burst=1)
+        flood.push("a")
+        flood.push("b")
+        flood.clear()
+        loop.advance(5)
+        self.assertEqual(sent, ["a"])
+
+
+class FloodAgainstServer(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = FakeIrcServer(self.loop, flood_rate=50, flood_burst=7).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.loop.close()
+
+    def connect(self, **config):
+        config.update({"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": []})
+        protocol = IrcProtocol(config=config, loop=self.loop, connection_manager=FakeConnectionManager(),
+                               endpoint=("127.0.0.1", self.server.port))
+        self.loop.run_until_complete(self.loop.create_connection(lambda: protocol, "127.0.0.1", self.server.port))
+        return protocol
+
+    def wait_for_lines(self, count, timeout=5):
+        deadline = self.loop.time() + timeout
+        while len(self.server.lines) < count and not self.server.flood_kills and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_sustained_rate_without_kill(self):
+        protocol = self.connect(flood_rate=50, flood_burst=5)
+        start = self.loop.time()
+        for i in range(60):
+            protocol.send_msg(irc.Privmsg("#chan", "line {}".format(i)))
+        self.wait_for_lines(62)
+        elapsed = self.loop.time() - start
+        self.assertEqual(self.server.flood_kills, 0)
+        self.assertEqual(len(self.server.lines), 62)
+        # USER, NICK and 60 lines minus the burst, at 50 lines per second.
+        self.assertGreater(elapsed, 57 / 50.0 * 0.9)
+        self.assertLess(elapsed, 57 / 50.0 * 2)
+
+    def test_unlimited_sending_gets_killed(self):
+        protocol = self.connect(flood_rate=None)
+        for i in range(60):
+            protocol.send_msg(irc.Privmsg("#chan", "line {}".format(i)))
+        self.wait_for_lines(62, timeout=1)
+        self.assertEqual(self.server.flood_kills, 1)
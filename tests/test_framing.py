@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot.framing import LineBuffer
+
+
+class Framing(unittest.TestCase):
+
+    def test_crlf_lines(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.feed(b"PING :a\r\nPING :b\r\n"), [b"PING :a", b"PING :b"])
+        self.assertEqual(len(buf), 0)
+
+    def test_bare_lf_lines(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.feed(b"PING :a\nPING :b\r\nPING :c\n"), [b"PING :a", b"PING :b", b"PING :c"])
+
+    def test_partial_lines(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.feed(b"PRIVMSG #a :hel"), [])
+        self.assertEqual(buf.feed(b"lo\r"), [])
+        self.assertEqual(buf.feed(b"\nPING"), [b"PRIVMSG #a :hello"])
+        self.assertEqual(len(buf), 4)
+        self.assertEqual(buf.feed(b" :x\r\n"), [b"PING :x"])
+
+    def test_empty_lines(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.feed(b"\r\n\nPING :a\r\n"), [b"", b"", b"PING :a"])
+
+    def test_overlong_complete_line_dropped(self):
+        buf = LineBuffer(max_line_length=10)
+        self.assertEqual(buf.feed(b"0123456789ABC\r\nPING :a\r\n"), [b"PING :a"])
+        self.assertEqual(buf.dropped, 1)
+
+    def test_overlong_partial_line_does_not_grow_buffer(self):
+        buf = LineBuffer(max_line_length=10)
+        for _ in range(100):
+            self.assertEqual(buf.feed(b"xxxxxxxx"), [])
+            self.assertLessEqual(len(buf), 10)
+        self.assertEqual(buf.feed(b"tail\r\nPING :a\r\n"), [b"PING :a"])
+        self.assertEqual(buf.dropped, 1)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot import irc
+from piebot.isupport import ISupport
+
+from fakeserver import make_protocol
+
+ISUPPORT = [
+    ":server 005 Pb42 CASEMAPPING=ascii CHANMODES=beI,kf,l,imnpst PREFIX=(qaohv)~&@%+ NETWORK=Example\\x20Net"
+    " :are supported by this server",
+    ":server 005 Pb42 MAXTARGETS=4 TARGMAX=PRIVMSG:3,NOTICE:3,JOIN:,KICK:1 LINELEN=100 EXCEPTS"
+    " :are supported by this server",
+]
+
+
+class ISupportParsing(unittest.TestCase):
+
+    def test_tokens(self):
+        msg = irc.Message.from_string(ISUPPORT[0])
+        self.assertIsInstance(msg, irc.Numeric005)
+        self.assertEqual(msg.tokens["NETWORK"], "Example Net")
+        self.assertEqual(msg.tokens["PREFIX"], "(qaohv)~&@%+")
+        msg = irc.Message.from_string(":server 005 Pb42 -EXCEPTS SAFELIST :are supported")
+        self.assertEqual(msg.tokens, {"EXCEPTS": None, "SAFELIST": ""})
+
+    def test_isupport(self):
+        isupport = ISupport()
+        self.assertEqual(isupport.max_targets("PRIVMSG"), 1)
+        self.assertIsNone(isupport.max_targets("JOIN"))
+        self.assertEqual(isupport.linelen, 512)
+        for line in ISUPPORT:
+            isupport.update(irc.Message.from_string(line).tokens)
+        self.assertEqual(isupport.casemapping, "ascii")
+        self.assertEqual(isupport.chanmodes, ("beI", "kf", "l", "imnpst"))
+        self.assertEqual(isupport.prefix, ("qaohv", "~&@%+"))
+        self.assertEqual(isupport.network, "Example Net")
+        self.assertEqual(isupport.max_targets("privmsg"), 3)
+        self.assertIsNone(isupport.max_targets("JOIN"))
+        self.assertEqual(isupport.max_targets("KICK"), 1)
+        self.assertEqual(isupport.linelen, 100)
+        isupport.update({"TARGMAX": None})
+        self.assertEqual(isupport.max_targets("PRIVMSG"), 4)
+
+    def test_mode_uses_isupport(self):
+        isupport = ISupport()
+        for line in ISUPPORT:
+            isupport.update(irc.Message.from_string(line).tokens)
+        line = ":op!o@h MODE #chan +qf-h alice [5j#R10]:15 bob"
+        msg = irc.Message.from_string(line)
+        msg.use_isupport(isupport)
+        self.assertEqual(msg.flags, [("q", True, "alice"), ("f", True, "[5j#R10]:15"), ("h", False, "bob")])
+        # Without it, q, f and h are taken for modes without arguments.
+        self.assertEqual(irc.Message.from_string(line).flags, [("q", True), ("f", True), ("h", False)])
+        self.assertTrue(irc.Message.from_string(":Pb42 MODE Pb42 :+i").usermode)
+
+
+class Batching(unittest.TestCase):
+
+    def test_batch_targets(self):
+        channels = ["#chan{}".format(i) for i in range(10)]
+        messages = irc.batch_targets("JOIN", channels, max_targets=4)
+        self.assertEqual([str(msg) for msg in messages], [
+            "JOIN #chan0,#chan1,#chan2,#chan3", "JOIN #chan4,#chan5,#chan6,#chan7", "JOIN #chan8,#chan9"])
+        self.assertIsInstance(messages[0], irc.Join)
+        messages = irc.batch_targets("JOIN", channels, max_length=32)
+        self.assertEqual([str(msg) for msg in messages], [
+            "JOIN #chan0,#chan1,#chan2,#chan3", "JOIN #chan4,#chan5,#chan6,#chan7", "JOIN #chan8,#chan9"])
+        self.assertTrue(all(len(str(msg)) <= 32 for msg in messages))
+
+    def test_keys_and_trailing(self):
+        messages = irc.batch_targets("JOIN", ["#a", "#b", "#c"], keys=["k1", "k2", "k3"], max_length=16)
+        self.assertEqual([str(msg) for msg in messages], ["JOIN #a,#b k1,k2", "JOIN #c k3"])
+        messages = irc.batch_targets("PRIVMSG", ["alice", "bob", "carol"], trailing="hi", max_targets=2)
+        self.assertEqual([str(msg) for msg in messages], ["PRIVMSG alice,bob :hi", "PRIVMSG carol :hi"])
+        self.assertIsInstance(messages[0], irc.Privmsg)
+
+    def test_protocol_uses_server_limits(self):
+        protocol, transport = make_protocol()
+        for line in ISUPPORT:
+            protocol.data_received(line.encode("utf-8") + b"\r\n")
+        self.assertEqual(protocol.isupport.max_targets("PRIVMSG"), 3)
+        self.assertEqual(protocol.state.casemapping, "ascii")
+        del transport.writes[:]
+        protocol.send_to(["a", "b", "c", "d"], "hi")
+        protocol.join(["#{}".format(i) for i in range(40)], keys={"#1": "secret"})
+        lines = b"".join(transport.writes).decode("utf-8").split("\r\n")[:-1]
+        self.assertEqual(lines[:3], ["PRIVMSG a,b,c :hi", "PRIVMSG d :hi", "JOIN #1 secret"])
+        # The other 39 channels need two lines of at most LINELEN bytes including CRLF.
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all(len(line) <= 98 for line in lines))
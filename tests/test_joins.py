@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot.bot import ConnectionManager
+
+from fakeserver import FakeIrcServer, make_protocol
+
+
+class StagedJoins(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def connect(self, server, **config):
+        endpoint = ("127.0.0.1", server.port)
+        manager = ConnectionManager(self.loop)
+        config.update({"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie"})
+        manager.add_endpoint(endpoint, config)
+        return manager, endpoint
+
+    def run_until(self, condition, timeout=10.0):
+        deadline = self.loop.time() + timeout
+        while not condition() and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_500_channels(self):
+        server = FakeIrcServer(self.loop, flood_rate=50, flood_burst=5, isupport=["TARGMAX=JOIN:100"]).start()
+        channels = ["#channel{}".format(i) for i in range(500)]
+        # Below the server's rate, so arrival jitter does not get the client killed for flooding.
+        manager, endpoint = self.connect(server, channels=channels, greeting=None, flood_rate=40)
+        self.run_until(lambda: endpoint in manager._active_connections)
+        protocol = manager._active_connections[endpoint]
+        start = self.loop.time()
+        self.run_until(lambda: protocol.joins is not None and protocol.joins.done)
+        elapsed = self.loop.time() - start
+        joins = [line for _, line in server.lines if line.startswith("JOIN ")]
+        # 500 JOIN lines unbatched, 12 lines of at most 510 bytes (about 5900 bytes of channels) now.
+        self.assertEqual(len(joins), 12)
+        self.assertTrue(all(len(line) <= 510 for line in joins))
+        self.assertEqual(protocol.joins.stages, 12)
+        self.assertEqual(sorted(protocol.joins.joined), sorted(channels))
+        self.assertEqual(len(protocol.state.channels), 500)
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(server.flood_kills, 0)
+        manager.remove_endpoint(endpoint)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        server.stop()
+
+    def test_stages_wait_and_failures_are_reported(self):
+        server = FakeIrcServer(self.loop, isupport=["TARGMAX=JOIN:2"],
+                               join_errors={"#banned": ("474", "Cannot join channel (+b)")}).start()
+        manager, endpoint = self.connect(server, channels=["#a", "#banned", "#c"], flood_rate=None)
+        self.run_until(lambda: endpoint in manager._active_connections and manager._active_connections[endpoint].joins
+                       is not None and manager._active_connections[endpoint].joins.done)
+        protocol = manager._active_connections[endpoint]
+        self.assertEqual(protocol.joins.failed, {"#banned": "Cannot join channel (+b)"})
+        self.assertEqual(protocol.joins.joined, ["#a", "#c"])
+        lines = [line for _, line in server.lines if not line.startswith(("CAP", "USER", "NICK"))]
+        self.assertEqual(lines, ["JOIN #a,#banned", "PRIVMSG #a :Hallo Welt!", "JOIN #c", "PRIVMSG #c :Hallo Welt!"])
+        manager.remove_endpoint(endpoint)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        server.stop()
+
+    def test_timeout(self):
+        protocol, transport = make_protocol(self.loop, channels=["#a", "#b"], join_timeout=0.01, greeting=None)
+        protocol.data_received(b":srv 005 Pb42 TARGMAX=JOIN:1 :are supported\r\n:srv 376 Pb42 :End\r\n")
+        protocol.data_received(b":Pb42!pie@bot JOIN #a\r\n")
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertTrue(protocol.joins.done)
+        self.assertEqual(protocol.joins.joined, ["#a"])
+        self.assertEqual(list(protocol.joins.failed), ["#b"])
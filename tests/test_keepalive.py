@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot import irc
+from piebot.bot import ConnectionManager
+from piebot.keepalive import Keepalive, TimerWheel, shared_wheel
+
+from fakeserver import FakeIrcServer, make_protocol
+
+
+class Wheel(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.wheel = TimerWheel(self.loop, resolution=0.01, slots=4)
+        self.fired = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_for(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def schedule(self, delay, name):
+        start = self.loop.time()
+        return self.wheel.call_later(delay, lambda: self.fired.append((name, self.loop.time() - start, delay)))
+
+    def test_timers_fire_in_order_and_never_early(self):
+        for delay, name in [(0.07, "c"), (0.005, "a"), (0.03, "b")]:
+            self.schedule(delay, name)
+        self.assertEqual(len(self.wheel), 3)
+        self.run_for(0.15)
+        # The delays span several turns of the four slots.
+        self.assertEqual([name for name, _, _ in self.fired], ["a", "b", "c"])
+        for _, waited, delay in self.fired:
+            self.assertGreaterEqual(waited, delay)
+        self.assertEqual(len(self.wheel), 0)
+        self.assertIsNone(self.wheel._handle)
+
+    def test_cancel(self):
+        timer = self.schedule(0.02, "a")
+        self.schedule(0.03, "b").cancel()
+        timer.cancel()
+        timer.cancel()
+        self.assertEqual(len(self.wheel), 0)
+        # Nothing left, so the wheel stopped ticking.
+        self.assertIsNone(self.wheel._handle)
+        self.schedule(0.01, "c")
+        self.run_for(0.05)
+        self.assertEqual([name for name, _, _ in self.fired], ["c"])
+
+    def test_cancel_from_a_callback_of_the_same_tick(self):
+        timers = {}
+        timers["a"] = self.wheel.call_later(0.01, lambda: (self.fired.append(("a", 0, 0)), timers["b"].cancel()))
+        timers["b"] = self.schedule(0.01, "b")
+        self.schedule(0.05, "c")
+        self.run_for(0.02)
+        self.assertEqual([name for name, _, _ in self.fired], ["a"])
+        self.assertEqual(len(self.wheel), 1)
+        self.run_for(0.08)
+        self.assertEqual([name for name, _, _ in self.fired], ["a", "c"])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertIsNone(self.wheel._handle)
+
+    def test_failing_callbacks_do_not_stop_the_wheel(self):
+        self.wheel.call_later(0.01, lambda: 1 / 0)
+        self.schedule(0.01, "a")
+        with self.assertLogs("piebot.keepalive", "ERROR"):
+            self.run_for(0.05)
+        self.assertEqual([name for name, _, _ in self.fired], ["a"])
+
+    def test_shared_per_loop(self):
+        self.assertIs(shared_wheel(self.loop), shared_wheel(self.loop))
+
+
+class Lag(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.wheel = TimerWheel(self.loop, resolution=0.01)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_lag_from_pongs(self):
+        protocol, transport = make_protocol(self.loop)
+        keepalive = Keepalive(protocol, self.wheel, interval=0.01, timeout=1.0)
+        keepalive.start()
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertIsNone(keepalive.last_lag)
+        self.assertGreater(keepalive.lag, 0.0)
+        ping = [line for line in b"".join(transport.writes).decode("utf-8").split("\r\n") if line.startswith("PING")]
+        self.assertEqual(len(ping), 1)
+        self.assertFalse(keepalive.on_pong(irc.Pong(payload="fake.server")))
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertTrue(keepalive.on_pong(irc.Pong(payload=ping[0][6:])))
+        self.assertEqual(keepalive.samples, 1)
+        self.assertGreaterEqual(keepalive.last_lag, 0.02)
+        self.assertEqual(keepalive.lag, keepalive.last_lag)
+        self.assertEqual(keepalive.average_lag, keepalive.max_lag)
+        keepalive.stop()
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_thousands_of_connections_share_one_timer(self):
+        keepalives = []
+        for _ in range(2000):
+            protocol, _ = make_protocol(self.loop)
+            keepalives.append(Keepalive(protocol, self.wheel, interval=30.0))
+            keepalives[-1].start()
+        self.assertEqual(len(self.wheel), 2000)
+        self.assertEqual(len(self.loop._scheduled), 1)
+        for keepalive in keepalives:
+            keepalive.stop()
+        self.assertEqual(len(self.wheel), 0)
+
+
+class DeadConnections(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+        self.config = {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": [],
+                       "flood_rate": None, "caps": [], "ping_interval": 0.02, "ping_timeout": 0.1,
+                       "timer_wheel": TimerWheel(self.loop, resolution=0.01)}
+
+    def tearDown(self):
+        for endpoint in list(self.manager.configs()):
+            self.manager.remove_endpoint(endpoint)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.server.stop()
+        self.loop.close()
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = self.loop.time() + timeout
+        while not condition() and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_lag_is_exported(self):
+        self.server = FakeIrcServer(self.loop).start()
+        endpoint = ("127.0.0.1", self.server.port)
+        self.manager.add_endpoint(endpoint, self.config)
+        protocol = lambda: self.manager._active_connections.get(endpoint)
+        self.run_until(lambda: protocol() is not None and protocol().keepalive is not None
+                       and protocol().keepalive.samples >= 2)
+        self.assertGreaterEqual(protocol().keepalive.samples, 2)
+        self.assertIn("piebot_lag_seconds{", self.manager.render_metrics())
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_unanswered_pings_reconnect(self):
+        self.server = FakeIrcServer(self.loop, answer_pings=False).start()
+        endpoint = ("127.0.0.1", self.server.port)
+        self.manager.add_endpoint(endpoint, self.config)
+        with self.assertLogs("piebot.bot", "WARNING") as logs:
+            self.run_until(lambda: len(self.server.clients) >= 2)
+        self.assertEqual(len(self.server.clients), 2)
+        self.assertTrue(any("No PONG" in line for line in logs.output))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import unittest
+from piebot import irc, log
+
+from fakeserver import make_protocol
+
+
+class CountingRepr(irc.Privmsg):
+    __slots__ = ()
+    reprs = 0
+
+    def __repr__(self):
+        CountingRepr.reprs += 1
+        return super().__repr__()
+
+
+def log_in_worker(settings, text):
+    log.configure_worker_logging(settings)
+    logging.getLogger("piebot.test").info(text)
+    log.stop_logging()
+
+
+class Logging(unittest.TestCase):
+
+    def setUp(self):
+        self.level = logging.getLogger().level
+        self.addCleanup(logging.getLogger().setLevel, self.level)
+        self.addCleanup(log.stop_logging)
+
+    def test_no_formatting_when_disabled(self):
+        logging.getLogger().setLevel(logging.INFO)
+        protocol, _ = make_protocol()
+        CountingRepr.reprs = 0
+        protocol.send_msg(CountingRepr("#botted", "Hallo Welt!"))
+        self.assertEqual(CountingRepr.reprs, 0)
+
+    def test_formatting_when_enabled(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        log.configure_logging(logging.DEBUG, filename=path)
+        protocol, _ = make_protocol()
+        CountingRepr.reprs = 0
+        protocol.send_msg(CountingRepr("#botted", "Hallo Welt!"))
+        self.assertGreater(CountingRepr.reprs, 0)
+        log.stop_logging()
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        self.assertIn("[DEBUG]", content)
+        self.assertIn("Hallo Welt!", content)
+
+    def test_configure_is_opt_in(self):
+        handlers = list(logging.getLogger().handlers)
+        import piebot.bot  # noqa: F401
+        self.assertEqual(logging.getLogger().handlers, handlers)
+        log.configure_logging()
+        self.assertEqual(len(logging.getLogger().handlers), len(handlers) + 1)
+        log.stop_logging()
+        self.assertEqual(logging.getLogger().handlers, handlers)
+
+    def test_workers_configure_their_own_logging(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        log.configure_logging(logging.INFO, filename=path)
+        self.assertEqual(log.settings()["filename"], path)
+        for method in ["fork", "spawn"]:
+            context = multiprocessing.get_context(method)
+            worker = context.Process(target=log_in_worker, args=(log.settings(), "Hallo from " + method))
+            worker.start()
+            worker.join(10)
+            self.assertEqual(worker.exitcode, 0)
+        log.stop_logging()
+        self.assertIsNone(log.settings())
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        self.assertIn("Hallo from fork", content)
+        self.assertIn("Hallo from spawn", content)
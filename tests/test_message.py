@@ -170,3 +170,60 @@ class Message(unittest.TestCase):
         msg = irc.Quit(message="Good bye!")
         self.assertEqual(str(msg), "QUIT :Good bye!")
 
+
+    def test_messages_have_no_instance_dict(self):
+        for raw in [":a!~b@c PRIVMSG #x :hi", ":srv 001 me :Welcome", ":d!e@f KICK #x a :bye", "PING :x"]:
+            msg = irc.Message.from_string(raw)
+            self.assertFalse(hasattr(msg, "__dict__"), msg=type(msg).__name__)
+
+    def test_data_compatibility(self):
+        msg = irc.Message.from_string(":a!~b@c PRIVMSG #x :hi")
+        self.assertEqual(msg.data["trailing"], "hi")
+        self.assertEqual(msg.data["params"], ["#x"])
+        self.assertEqual(msg.get("tags"), {})
+        with self.assertRaises(TypeError):
+            msg.data["trailing"] = "changed"
+        msg.update({"trailing": "changed"})
+        self.assertEqual(msg.data["trailing"], "changed")
+
+    def test_lazy_parsing(self):
+        raw = ":a!~b@c PRIVMSG #x :hi"
+        msg = irc.Message.from_string(raw)
+        self.assertIsInstance(msg, irc.Privmsg)
+        self.assertEqual(msg._line, raw)
+        self.assertEqual(msg.message, "hi")
+        self.assertIsNone(msg._line)
+        self.assertEqual(msg.get("nick"), "a")
+        self.assertEqual(str(msg), raw)
+
+    def test_update_of_lazy_message(self):
+        msg = irc.Message.from_string(":a!b@c PRIVMSG #x :hi")
+        msg.update({"trailing": "changed"})
+        self.assertEqual(msg.message, "changed")
+        self.assertEqual(msg.source, "a")
+        self.assertEqual(str(msg), ":a!b@c PRIVMSG #x :changed")
+
+    def test_lazy_parsing_missing_attribute(self):
+        msg = irc.Message.from_string(":srv 001 me :Welcome")
+        with self.assertRaises(AttributeError):
+            msg.message
+        self.assertEqual(msg.get("trailing"), "Welcome")
+
+    def test_construct_fields_without_reparse(self):
+        msg = irc.Privmsg(target="#example", message="How dee ho!")
+        self.assertEqual(msg.target, "#example")
+        self.assertEqual(msg.message, "How dee ho!")
+        self.assertEqual(msg.get("params"), ["#example"])
+        msg.update({"prefix": ":", "subject": "me!~id@host"})
+        self.assertEqual(msg.source, "me")
+        self.assertEqual(msg.get("ident"), "id")
+        self.assertEqual(str(msg), ":me!~id@host PRIVMSG #example :How dee ho!")
+
+    def test_encode_is_cached(self):
+        msg = irc.Privmsg(target="#example", message="Grüße")
+        data = msg.encode("utf-8")
+        self.assertEqual(data, "PRIVMSG #example :Grüße\r\n".encode("utf-8"))
+        self.assertIs(msg.encode("utf-8"), data)
+        self.assertEqual(msg.encode("latin-1"), "PRIVMSG #example :Grüße\r\n".encode("latin-1"))
+        msg.update({"trailing": "changed"})
+        self.assertEqual(msg.encode("utf-8"), b"PRIVMSG #example :changed\r\n")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot.bot import ConnectionManager
+from piebot.metrics import Histogram, ProtocolMetrics, MetricsServer, render_prometheus
+
+from fakeserver import FakeIrcServer, make_protocol
+
+
+class Metrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 2))
+        for value in [0.5, 1, 1.5, 3]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 6)
+
+    def test_histogram_quantile(self):
+        histogram = Histogram(buckets=(1, 2, 4))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in [0.5, 0.5, 1.5, 3]:
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.25), 0.5)
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertEqual(histogram.quantile(0.75), 2)
+        self.assertEqual(histogram.quantile(1), 4)
+        histogram.observe(10)
+        self.assertEqual(histogram.quantile(1), 4)
+
+    def test_protocol_counters(self):
+        protocol, transport = make_protocol(metrics_sample_every=2)
+        data = b"PING :a\r\n:a!b@c PRIVMSG #x :hi\r\n:srv 001 me :hi\r\n:srv 002 me :hi\r\n"
+        protocol.data_received(data)
+        metrics = protocol.metrics
+        self.assertEqual(metrics.bytes_in, len(data))
+        self.assertEqual(metrics.lines_parsed, 4)
+        self.assertEqual(metrics.dispatched, {"Ping": 1, "Privmsg": 1, "Numeric001": 1, "Message": 1})
+        self.assertEqual(metrics.parse_time.count, 2)
+        self.assertEqual(metrics.handler_latency.count, 2)
+        self.assertEqual(metrics.bytes_out, sum(len(data) for data in transport.writes))
+
+    def test_metrics_can_be_disabled(self):
+        protocol, transport = make_protocol(metrics=False)
+        protocol.data_received(b"PING :a\r\n")
+        self.assertIsNone(protocol.metrics)
+
+    def test_render_prometheus(self):
+        metrics = ProtocolMetrics()
+        metrics.bytes_in = 10
+        metrics.dispatched["Privmsg"] = 3
+        metrics.parse_time.observe(0.00002)
+        text = render_prometheus({"irc.example.net:6667": (metrics, {"connected": 1})})
+        self.assertIn('piebot_bytes_received_total{endpoint="irc.example.net:6667"} 10\n', text)
+        self.assertIn('piebot_messages_dispatched_total{endpoint="irc.example.net:6667",command="Privmsg"} 3\n', text)
+        self.assertIn('piebot_parse_seconds_bucket{endpoint="irc.example.net:6667",le="1e-05"} 0\n', text)
+        self.assertIn('piebot_parse_seconds_bucket{endpoint="irc.example.net:6667",le="+Inf"} 1\n', text)
+        self.assertIn('piebot_connected{endpoint="irc.example.net:6667"} 1\n', text)
+        self.assertIn("# TYPE piebot_parse_seconds histogram\n", text)
+
+
+class MetricsEndpoint(unittest.TestCase):
+
+    def test_http_snapshot_survives_reconnect(self):
+        loop = asyncio.new_event_loop()
+        server = FakeIrcServer(loop).start()
+        manager = ConnectionManager(loop, base_delay=0.01, max_delay=0.02)
+        endpoint = ("127.0.0.1", server.port)
+        manager.add_endpoint(endpoint, {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": []})
+        loop.run_until_complete(asyncio.sleep(0.1))
+        server.clients[0].transport.close()
+        loop.run_until_complete(asyncio.sleep(0.1))
+        metrics_server = loop.run_until_complete(MetricsServer(manager, port=0).start())
+
+        async def fetch():
+            reader, writer = await asyncio.open_connection("127.0.0.1", metrics_server.port)
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            data = await reader.read()
+            writer.close()
+            return data.decode("utf-8")
+
+        response = loop.run_until_complete(fetch())
+        label = 'endpoint="127.0.0.1:{}"'.format(server.port)
+        self.assertTrue(response.startswith("HTTP/1.0 200 OK"))
+        # Two connections, each answered with CAP LS, 001 and 376.
+        self.assertIn("piebot_lines_parsed_total{" + label + "} 6\n", response)
+        self.assertIn("piebot_reconnect_attempts_total{" + label + "} 2\n", response)
+        metrics_server.close()
+        manager.remove_endpoint(endpoint)
+        loop.run_until_complete(asyncio.sleep(0.05))
+        server.stop()
+        loop.close()
@@ -44,3 +44,17 @@ class Parser(unittest.TestCase):
         self.assertEqual(msg.get("nick"), "peter", msg="Incorrect nick!")
         self.assertEqual(msg.get("ident"), "per", msg="Incorrect ident!")
         self.assertEqual(msg.get("host"), "griffin.com", msg="Incorrect host!")
+
+    def test_parse_tagged_message(self):
+        raw = "@time=2016-01-01T00:00:00.000Z;msgid=a\\:b\\sc\\\\d;+draft/flag :nick!~user@host PRIVMSG #chan :hi there"
+        data = irc.parse(raw)
+        self.assertEqual(data["tags"], {"time": "2016-01-01T00:00:00.000Z", "msgid": "a;b c\\d", "+draft/flag": ""})
+        self.assertEqual(data["subject"], "nick!~user@host")
+        self.assertEqual(data["command"], "PRIVMSG")
+        self.assertEqual(data["params"], ["#chan"])
+        self.assertEqual(data["trailing"], "hi there")
+        self.assertEqual(data["nick"], "nick")
+
+    def test_parse_subject_without_host(self):
+        data = irc.parse(":nick!user PRIVMSG #chan :hi")
+        self.assertEqual((data["nick"], data["ident"], data["host"]), ("nick", "user", ""))
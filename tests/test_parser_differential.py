@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot import irc
+
+from parser_corpus import legacy_parse, generate_lines, generate_garbage, MIXES
+
+
+class ParserDifferential(unittest.TestCase):
+
+    def assertSameAsLegacy(self, line):
+        if line.startswith("@"):
+            # Tagged lines were not supported by the legacy parser.
+            irc.parse(line)
+            return
+        try:
+            expected = legacy_parse(line)
+        except (ValueError, NameError):
+            # The legacy parser crashes on these, the new one must not.
+            irc.parse(line)
+            return
+        result = irc.parse(line)
+        self.assertEqual(result.pop("tags"), {}, msg=repr(line))
+        self.assertEqual(result, expected, msg=repr(line))
+
+    def assertCommandOfMatches(self, line):
+        command = irc.command_of(line)
+        if command is not None:
+            self.assertEqual(command, irc.tokenize(line)[2], msg=repr(line))
+
+    def test_known_lines(self):
+        for line in [
+            ":someserver.net 123 one two three :Let's parse a generic formatted msg!",
+            ":ralf!~wiggum@simpsons.net PRIVMSG #channel :duck duck duck duck",
+            ":peter!~per@griffin.com MODE peter +ix",
+            "USER ident * * :real name",
+            "PING :payload",
+            "PING",
+            ":server",
+            "",
+            ":a  CMD  x  y",
+            "CMD\tx y",
+            "CMD ",
+            "CMD :",
+        ]:
+            self.assertSameAsLegacy(line)
+
+    def test_generated_corpus(self):
+        for mix in sorted(MIXES):
+            for line in generate_lines(20000, mix=mix):
+                self.assertSameAsLegacy(line)
+                self.assertCommandOfMatches(line)
+
+    def test_garbage_corpus(self):
+        for line in generate_garbage(50000):
+            self.assertSameAsLegacy(line)
+            self.assertCommandOfMatches(line)
+        for line in generate_garbage(50000, seed=7):
+            self.assertCommandOfMatches("@a=b " + line)
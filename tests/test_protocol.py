@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot import irc
+
+from fakeserver import make_protocol
+
+
+class OutputQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_writes_are_coalesced_per_tick(self):
+        protocol, transport = make_protocol(self.loop)
+        self.run_once()
+        del transport.writes[:]
+        for channel in ["#a", "#b", "#c"]:
+            protocol.send_msg(irc.Join(channel))
+        self.assertEqual(transport.writes, [])
+        self.assertEqual(protocol.queue_depth, 3)
+        self.run_once()
+        self.assertEqual(transport.writes, [b"JOIN :#a\r\nJOIN :#b\r\nJOIN :#c\r\n"])
+        self.assertEqual(protocol.queue_depth, 0)
+
+    def test_pause_and_resume_writing(self):
+        protocol, transport = make_protocol(self.loop)
+        self.run_once()
+        del transport.writes[:]
+        flushed = protocol.bytes_flushed
+        protocol.pause_writing()
+        protocol.send_msg(irc.Ping("a"))
+        self.run_once()
+        self.assertEqual(transport.writes, [])
+        protocol.send_msg(irc.Ping("b"))
+        protocol.resume_writing()
+        self.assertEqual(transport.writes, [b"PING :a\r\nPING :b\r\n"])
+        self.assertEqual(protocol.bytes_flushed - flushed, 18)
+
+    def test_destroy_flushes_queue(self):
+        protocol, transport = make_protocol(self.loop)
+        protocol.send_msg(irc.Quit("bye"))
+        protocol.destroy()
+        self.assertTrue(transport.writes[-1].endswith(b"QUIT :bye\r\n"))
+        self.assertTrue(transport.closed)
+
+
+class BuiltinHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol, self.transport = make_protocol(channels=["#a"])
+        del self.transport.writes[:]
+
+    def receive(self, raw):
+        self.protocol.data_received(raw.encode("utf-8") + b"\r\n")
+        data = b"".join(self.transport.writes)
+        del self.transport.writes[:]
+        return data
+
+    def test_ping(self):
+        self.assertEqual(self.receive("PING :abc"), b"PONG :abc\r\n")
+
+    def test_end_of_motd_joins(self):
+        self.assertEqual(self.receive(":srv 376 Pb42 :End"), b"JOIN #a\r\n")
+        self.assertEqual(self.receive(":Pb42!pie@bot JOIN #a"), b"PRIVMSG #a :Hallo Welt!\r\n")
+        self.assertTrue(self.protocol.joins.done)
+
+    def test_kick_rejoins(self):
+        self.assertEqual(self.receive(":op!o@h KICK #a Pb42 :out"), b"JOIN :#a\r\nPRIVMSG #a :Hey, das war nicht nett!\r\n")
+        self.assertEqual(self.receive(":op!o@h KICK #a other :out"), b"")
+
+    def test_ctcp_version(self):
+        self.assertTrue(self.receive(":u!i@h PRIVMSG Pb42 :\x01VERSION\x01").startswith(b"NOTICE u :\x01VERSION "))
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import errno
+import socket
+import unittest
+from piebot.bot import ConnectionManager
+from piebot.reconnect import ReconnectScheduler
+
+from fakeserver import FakeIrcServer
+
+
+class Reconnect(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_for(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_backoff_is_exponential_capped_and_jittered(self):
+        scheduler = ReconnectScheduler(self.loop, None, base_delay=1, max_delay=10, random=lambda: 1.0)
+        scheduler.schedule(("a", 1))
+        state = scheduler._states[("a", 1)]
+        delays = []
+        for failures in range(6):
+            state.failures = failures
+            delays.append(scheduler.delay(("a", 1)))
+        self.assertEqual(delays, [1, 2, 4, 8, 10, 10])
+        scheduler._random = lambda: 0.0
+        self.assertEqual(scheduler.delay(("a", 1)), 5)
+        scheduler.forget(("a", 1))
+
+    def test_failures_are_counted_per_endpoint(self):
+        async def connect(endpoint):
+            if endpoint == ("bad", 1):
+                raise OSError("refused")
+
+        scheduler = ReconnectScheduler(self.loop, connect, base_delay=0.01, max_delay=0.02)
+        scheduler.schedule(("bad", 1), immediately=True)
+        scheduler.schedule(("good", 1), immediately=True)
+        self.run_for(0.2)
+        self.assertGreater(scheduler.state(("bad", 1))["failures"], 2)
+        self.assertEqual(scheduler.state(("bad", 1))["last_error"], "refused")
+        self.assertEqual(scheduler.state(("good", 1))["failures"], 0)
+        self.assertEqual(scheduler.state(("good", 1))["attempts"], 1)
+        scheduler.forget(("bad", 1))
+        self.run_for(0.05)
+
+    def test_errors_other_than_network_errors_are_not_retried(self):
+        async def connect(endpoint):
+            raise KeyError("encoding")
+
+        scheduler = ReconnectScheduler(self.loop, connect, base_delay=0.01, max_delay=0.02)
+        with self.assertLogs("piebot.reconnect", "ERROR") as logs:
+            scheduler.schedule(("a", 1), immediately=True)
+            self.run_for(0.1)
+        state = scheduler.state(("a", 1))
+        self.assertEqual(state["attempts"], 1)
+        self.assertEqual(state["failures"], 1)
+        self.assertEqual(state["last_error"], "KeyError: 'encoding'")
+        self.assertTrue(state["failed"])
+        self.assertIsNone(state["next_attempt"])
+        self.assertIn("Connecting a:1 failed, not retrying.", logs.output[0])
+        scheduler.schedule(("a", 1))
+        self.assertFalse(scheduler.state(("a", 1))["failed"])
+        scheduler.forget(("a", 1))
+
+    def test_forget_drops_the_running_attempt(self):
+        async def connect(endpoint):
+            await asyncio.sleep(1)
+
+        scheduler = ReconnectScheduler(self.loop, connect)
+        scheduler.schedule(("a", 1), immediately=True)
+        self.run_for(0.01)
+        self.assertEqual(len(scheduler._tasks), 1)
+        scheduler.forget(("a", 1))
+        self.assertEqual(scheduler._tasks, {})
+        self.run_for(0.01)
+
+    def test_attempts_in_flight_are_capped(self):
+        release = asyncio.Event()
+        running = []
+
+        async def connect(endpoint):
+            running.append(endpoint)
+            await release.wait()
+
+        scheduler = ReconnectScheduler(self.loop, connect, max_in_flight=2)
+        endpoints = [("host{}".format(i), 6667) for i in range(5)]
+        for endpoint in endpoints:
+            scheduler.schedule(endpoint, immediately=True)
+        self.run_for(0.01)
+        self.assertEqual(running, endpoints[:2])
+        self.assertEqual(scheduler.in_flight, 2)
+        release.set()
+        self.run_for(0.01)
+        self.assertEqual(running, endpoints)
+        self.assertEqual(scheduler.in_flight, 0)
+
+    def test_unstable_connections_back_off(self):
+        async def connect(endpoint):
+            pass
+
+        scheduler = ReconnectScheduler(self.loop, connect, stable_after=60)
+        scheduler.schedule(("a", 1), immediately=True)
+        self.run_for(0)
+        for _ in range(3):
+            scheduler.connected(("a", 1))
+            scheduler.disconnected(("a", 1))
+        self.assertEqual(scheduler.state(("a", 1))["failures"], 3)
+        scheduler._states[("a", 1)].connected_since = self.loop.time() - 61
+        scheduler.disconnected(("a", 1))
+        self.assertEqual(scheduler.state(("a", 1))["failures"], 0)
+        scheduler.forget(("a", 1))
+
+    def test_manager_keeps_retrying_unreachable_endpoint(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        endpoint = listener.getsockname()
+        listener.close()
+        manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+        manager.add_endpoint(endpoint, {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": []})
+        self.run_for(0.2)
+        self.assertIn(endpoint, manager._configs)
+        self.assertGreater(manager.reconnects.state(endpoint)["failures"], 1)
+        self.assertEqual(manager.reconnects.state(endpoint)["last_error"], str(ConnectionRefusedError(
+            errno.ECONNREFUSED, "Connect call failed {}".format(endpoint))))
+        manager.remove_endpoint(endpoint)
+
+    def test_manager_marks_broken_config_failed(self):
+        manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+        endpoint = ("127.0.0.1", 1)
+        with self.assertLogs("piebot.reconnect", "ERROR"):
+            manager.add_endpoint(endpoint, {"nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": []})
+            self.run_for(0.05)
+        state = manager.reconnects.state(endpoint)
+        self.assertTrue(state["failed"])
+        self.assertEqual(state["failures"], 1)
+        self.assertEqual(state["last_error"], "KeyError: 'encoding'")
+        manager.remove_endpoint(endpoint)
+
+    def test_manager_reconnects_dropped_connection(self):
+        server = FakeIrcServer(self.loop).start()
+        endpoint = ("127.0.0.1", server.port)
+        manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+        manager.add_endpoint(endpoint, {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": []})
+        self.run_for(0.1)
+        self.assertEqual(len(server.clients), 1)
+        server.clients[0].transport.close()
+        self.run_for(0.2)
+        self.assertEqual(len(server.clients), 2)
+        self.assertEqual(manager.reconnects.state(endpoint)["attempts"], 2)
+        self.assertTrue(manager.reconnects.state(endpoint)["connected"])
+        manager.remove_endpoint(endpoint)
+        self.run_for(0.05)
+        server.stop()
+
+    def test_manager_close_all(self):
+        server = FakeIrcServer(self.loop).start()
+        manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+        manager.add_endpoint(("127.0.0.1", server.port), {"encoding": "utf-8", "nick": "Pb42", "ident": "pie",
+                                                         "realname": "Pie", "channels": []})
+        self.run_for(0.1)
+        manager.close_all()
+        self.run_for(0.1)
+        # Closed for good, nothing is reconnected.
+        self.assertEqual(len(server.clients), 1)
+        self.assertTrue(server.clients[0].transport.is_closing())
+        self.assertEqual(manager.configs(), {})
+        self.assertEqual(manager.reconnects.states(), {})
+        server.stop()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from piebot.recorder import RECEIVED, SENT, Recorder, read_recording
+
+from fakeserver import make_protocol
+
+
+class Recording(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory.name, "session.rec")
+        now = [10.0]
+        recorder = Recorder(path, clock=lambda: now[0])
+        recorder.record([b":srv 001 Pb42 :Welcome", b"PING :srv"])
+        now[0] += 1.5
+        recorder.record([b"PONG :srv"], SENT)
+        recorder.record([b"x" * 70000])
+        recorder.close()
+        self.assertFalse(recorder._writer.is_alive())
+        self.assertEqual(list(read_recording(path)), [
+            (0.0, RECEIVED, b":srv 001 Pb42 :Welcome"), (0.0, RECEIVED, b"PING :srv"),
+            (1.5, SENT, b"PONG :srv"), (0.0, RECEIVED, b"x" * 0xffff)])
+
+    def test_not_a_recording(self):
+        path = os.path.join(self.directory.name, "other")
+        with open(path, "wb") as f:
+            f.write(b"nope")
+        with self.assertRaises(OSError):
+            list(read_recording(path))
+
+    def test_protocol_records_both_directions(self):
+        template = os.path.join(self.directory.name, "{host}-{port}.rec")
+        protocol, transport = make_protocol(record=template)
+        protocol.data_received(b"PING :srv\r\n")
+        protocol.connection_lost(None)
+        records = [(direction, line) for _, direction, line in read_recording(template.format(host="127.0.0.1", port=6667))]
+        self.assertEqual(records, [
+            (SENT, b"CAP LS :302"), (SENT, b"USER pie * * :Pie Bot"), (SENT, b"NICK :Pb42"), (RECEIVED, b"PING :srv"), (SENT, b"PONG :srv")])
+        self.assertIsNone(protocol.recorder)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from piebot.config import ConfigReloader
+from piebot.sharding import ShardedConnectionManager
+
+from fakeserver import FakeIrcServer
+
+
+def config():
+    return {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": []}
+
+
+class Sharding(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.servers = [FakeIrcServer(self.loop).start() for _ in range(2)]
+        self.manager = ShardedConnectionManager(self.loop, workers=2, check_interval=0.05)
+
+    def tearDown(self):
+        self.manager.stop()
+        for server in self.servers:
+            server.stop()
+        self.loop.close()
+
+    def settle(self, condition, timeout=10):
+        deadline = self.loop.time() + timeout
+        while not condition() and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertTrue(condition())
+
+    def nicks(self, server):
+        return [line for _, line in server.lines if line.startswith("NICK")]
+
+    def test_endpoints_are_spread_and_restarted(self):
+        endpoints = [("127.0.0.1", server.port) for server in self.servers]
+        for endpoint in endpoints:
+            self.manager.add_endpoint(endpoint, config())
+        self.assertEqual(sorted(self.manager.shard_of(endpoint) for endpoint in endpoints), [0, 1])
+        self.settle(lambda: all(len(self.nicks(server)) == 1 for server in self.servers))
+        self.settle(lambda: all(stats.get("active") == 1 for stats in self.manager.stats().values()))
+
+        crashed = self.manager.shard_of(endpoints[0])
+        pid = self.manager.stats()[crashed]["pid"]
+        self.manager._shards[crashed].process.kill()
+        self.settle(lambda: len(self.nicks(self.servers[0])) == 2)
+        stats = self.manager.stats()[crashed]
+        self.assertEqual(stats["restarts"], 1)
+        self.assertNotEqual(stats["pid"], pid)
+        self.assertEqual(len(self.nicks(self.servers[1])), 1)
+
+    def test_remove_endpoint(self):
+        endpoint = ("127.0.0.1", self.servers[0].port)
+        self.manager.add_endpoint(endpoint, config())
+        self.settle(lambda: len(self.servers[0].clients) == 1)
+        self.manager.remove_endpoint(endpoint)
+        self.settle(lambda: self.servers[0].clients[0].transport.is_closing())
+        self.assertEqual(self.manager.stats()[self.manager._shards[0].index]["endpoints"], 0)
+
+    def test_config_reloading(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "config.json")
+        a, b = self.servers
+
+        def write(*endpoints):
+            with open(path, "w") as f:
+                json.dump({"defaults": {"nick": "Pb42", "ident": "pie", "realname": "Pie"},
+                           "endpoints": [dict(endpoint, host="127.0.0.1", port=server.port)
+                                         for server, endpoint in endpoints]}, f)
+
+        def received(server, *prefixes):
+            return [line for _, line in server.lines if line.startswith(prefixes)]
+
+        write((a, {"channels": ["#one"]}), (b, {}))
+        reloader = ConfigReloader(self.loop, self.manager, path, poll_interval=None).start()
+        self.assertEqual(sorted(self.manager.configs()), sorted([("127.0.0.1", a.port), ("127.0.0.1", b.port)]))
+        self.settle(lambda: received(a, "JOIN") == ["JOIN #one"] and len(self.nicks(b)) == 1)
+
+        # Live changes reach the worker of the endpoint, without reconnecting.
+        write((a, {"channels": ["#two"]}))
+        self.assertTrue(reloader.reload())
+        self.settle(lambda: received(a, "JOIN", "PART") == ["JOIN #one", "JOIN #two", "PART #one"])
+        self.settle(lambda: b.clients[0].transport.is_closing())
+        self.assertEqual(len(self.nicks(a)), 1)
+        self.assertEqual(self.manager.configs()[("127.0.0.1", a.port)]["channels"], ["#two"])
+        self.assertEqual(list(self.manager.configs()), [("127.0.0.1", a.port)])
+        reloader.stop()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from piebot import irc
+
+from fakeserver import make_protocol
+
+
+class SplitText(unittest.TestCase):
+
+    def test_short_text_is_one_piece(self):
+        self.assertEqual(irc.split_text(b"hello world", 20), [b"hello world"])
+        self.assertEqual(irc.split_text(b"", 20), [])
+
+    def test_word_breaks(self):
+        self.assertEqual(irc.split_text(b"aaaa bbbb cccc dddd", 9), [b"aaaa bbbb", b"cccc dddd"])
+        self.assertEqual(irc.split_text(b"aaaa bbbbbbbbbbbb", 9), [b"aaaa", b"bbbbbbbbb", b"bbb"])
+
+    def test_line_breaks(self):
+        self.assertEqual(irc.split_text(b"one\r\ntwo\n\nthree\rfour", 20), [b"one", b"two", b"three", b"four"])
+
+    def test_multibyte_characters_stay_whole(self):
+        text = "äöü€𝄞" * 50
+        for limit in range(4, 30):
+            pieces = irc.split_text(text.encode("utf-8"), limit)
+            self.assertTrue(all(len(piece) <= limit for piece in pieces))
+            self.assertEqual("".join(piece.decode("utf-8") for piece in pieces), text)
+
+    def test_single_byte_encodings(self):
+        self.assertEqual(irc.split_text("äöüäöü".encode("latin-1"), 4, utf8=False), ["äöüä".encode("latin-1"), "öü".encode("latin-1")])
+
+    def test_limit(self):
+        with self.assertRaises(ValueError):
+            irc.split_text(b"abc", 3)
+
+
+class SplitMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol, self.transport = make_protocol()
+        self.protocol.data_received(b":srv 001 Pb42 :Welcome\r\n:Pb42!pie@bot.example JOIN #pie\r\n")
+        del self.transport.writes[:]
+
+    def sent(self):
+        lines = b"".join(self.transport.writes).split(b"\r\n")[:-1]
+        del self.transport.writes[:]
+        return lines
+
+    def relayed_length(self, line):
+        # As the server sends it to others: prefix, line and CRLF.
+        return len(b":Pb42!pie@bot.example ") + len(line) + 2
+
+    def test_short_messages_are_untouched(self):
+        msg = irc.Privmsg("#pie", "hello")
+        self.protocol.send_msg(msg)
+        self.assertEqual(self.sent(), [b"PRIVMSG #pie :hello"])
+
+    def test_long_message_fits_linelen_with_prefix(self):
+        words = ["wörd{}".format(i) for i in range(400)]
+        self.protocol.send_msg(irc.Privmsg("#pie", " ".join(words)))
+        lines = self.sent()
+        self.assertGreater(len(lines), 1)
+        for line in lines:
+            self.assertTrue(line.startswith(b"PRIVMSG #pie :"))
+            self.assertLessEqual(self.relayed_length(line), 512)
+        # The first line is filled up to the word that does not fit anymore.
+        self.assertGreater(self.relayed_length(lines[0]), 512 - len(words[-1].encode("utf-8")) - 1)
+        self.assertEqual(" ".join(line[14:].decode("utf-8") for line in lines), " ".join(words))
+
+    def test_linelen_and_unknown_host(self):
+        protocol, transport = make_protocol()
+        protocol.data_received(b":srv 005 Pb42 LINELEN=1024 :are supported\r\n")
+        del transport.writes[:]
+        protocol.send_msg(irc.Notice("bob", "x" * 1500))
+        lines = b"".join(transport.writes).split(b"\r\n")[:-1]
+        self.assertEqual(len(lines), 2)
+        # Without a known host the longest one is assumed.
+        self.assertEqual(len(b":Pb42!~pie@" + b"h" * 63 + b" ") + len(lines[0]) + 2, 1024)
+
+    def test_unidented_prefix(self):
+        protocol, transport = make_protocol()
+        protocol.data_received(b":srv 001 Pb42 :Welcome\r\n:Pb42!~pie@some.host.example JOIN #a\r\n")
+        del transport.writes[:]
+        self.assertEqual(protocol.prefix_length(), len(b":Pb42!~pie@some.host.example "))
+        protocol.send_msg(irc.Privmsg("#a", "x" * 1000))
+        lines = b"".join(transport.writes).split(b"\r\n")[:-1]
+        self.assertEqual(len(b":Pb42!~pie@some.host.example ") + len(lines[0]) + 2, 512)
+
+    def test_ctcp_action_is_split_into_actions(self):
+        self.protocol.send_msg(irc.Privmsg("#pie", "\x01ACTION " + "ü" * 600 + "\x01"))
+        lines = self.sent()
+        self.assertEqual(len(lines), 3)
+        for line in lines:
+            self.assertTrue(line.startswith(b"PRIVMSG #pie :\x01ACTION "))
+            self.assertTrue(line.endswith(b"\x01"))
+            self.assertLessEqual(self.relayed_length(line), 512)
+
+    def test_newlines_can_not_inject_commands(self):
+        self.protocol.send_msg(irc.Privmsg("#pie", "one\r\nQUIT :bye"))
+        self.assertEqual(self.sent(), [b"PRIVMSG #pie :one", b"PRIVMSG #pie :QUIT :bye"])
+
+    def test_pieces_go_through_flood_control(self):
+        loop = asyncio.new_event_loop()
+        protocol, transport = make_protocol(loop, flood_rate=1, flood_burst=5)
+        protocol.send_msg(irc.Privmsg("#pie", "x" * 2000))
+        # CAP LS, USER and NICK took three lines of the burst, three of the five pieces have to wait.
+        self.assertEqual(len(protocol._flood), 3)
+        protocol.connection_lost(None)
+        loop.close()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from piebot import irc
+from piebot.state import NetworkState
+
+from fakeserver import make_protocol
+
+
+def feed(state, *lines):
+    for line in lines:
+        state.update(irc.Message.from_string(line))
+
+
+class ParseModes(unittest.TestCase):
+
+    def test_arguments(self):
+        self.assertEqual(irc.parse_modes("+ov-l+k", ["a", "b", "key"]), [
+            (True, "o", "a"), (True, "v", "b"), (False, "l", None), (True, "k", "key")])
+
+    def test_list_modes_and_missing_arguments(self):
+        self.assertEqual(irc.parse_modes("-b+nb", ["*!*@x"]), [
+            (False, "b", "*!*@x"), (True, "n", None), (True, "b", None)])
+
+
+class State(unittest.TestCase):
+
+    def setUp(self):
+        self.state = NetworkState("Pb42")
+        feed(self.state,
+             ":Pb42!pie@bot JOIN #Chan",
+             ":server 353 Pb42 = #chan :@Pb42 +alice bob",
+             ":server 366 Pb42 #chan :End of /NAMES list.",
+             ":Pb42!pie@bot JOIN #other",
+             ":alice!a@host JOIN :#other")
+
+    def test_membership(self):
+        self.assertTrue(self.state.is_on("ALICE", "#CHAN"))
+        self.assertTrue(self.state.is_on("bob", "#chan"))
+        self.assertFalse(self.state.is_on("bob", "#other"))
+        self.assertFalse(self.state.is_on("bob", "#nowhere"))
+        self.assertTrue(self.state.channel("#chan").synced)
+        self.assertEqual(self.state.modes_of("Pb42", "#chan"), {"o"})
+        self.assertEqual(self.state.modes_of("alice", "#chan"), {"v"})
+        self.assertEqual(sorted(self.state.channels_of("alice")), ["#Chan", "#other"])
+        self.assertEqual(self.state.common_channels("alice", "bob"), ["#Chan"])
+        self.assertEqual(self.state.user("alice").host, "host")
+
+    def test_casemapping(self):
+        feed(self.state, ":x!x@x JOIN #chan", ":x!x@x NICK Nick[a]")
+        self.assertTrue(self.state.is_on("nick{A}", "#chan"))
+        feed(self.state, ":server 005 Pb42 CASEMAPPING=ascii :are supported by this server")
+        self.assertFalse(self.state.is_on("nick{A}", "#chan"))
+        self.assertTrue(self.state.is_on("NICK[A]", "#chan"))
+        self.assertTrue(self.state.is_on("alice", "#OTHER"))
+
+    def test_part_kick_quit(self):
+        feed(self.state, ":bob!b@h PART #chan :bye")
+        self.assertFalse(self.state.is_on("bob", "#chan"))
+        self.assertIsNone(self.state.user("bob"))
+        feed(self.state, ":op!o@h KICK #other alice :out")
+        self.assertEqual(self.state.channels_of("alice"), ["#Chan"])
+        feed(self.state, ":alice!a@host QUIT :gone")
+        self.assertIsNone(self.state.user("alice"))
+        self.assertEqual(list(self.state.channel("#chan").members), ["pb42"])
+
+    def test_own_part_and_kick(self):
+        feed(self.state, ":Pb42!pie@bot PART #chan")
+        self.assertIsNone(self.state.channel("#chan"))
+        self.assertIsNone(self.state.user("bob"))
+        self.assertEqual(self.state.channels_of("alice"), ["#other"])
+        feed(self.state, ":op!o@h KICK #other Pb42 :out")
+        self.assertEqual(self.state.channels, {})
+        self.assertEqual(self.state.users, {})
+
+    def test_nick_changes(self):
+        feed(self.state, ":alice!a@host NICK :Carol")
+        self.assertTrue(self.state.is_on("carol", "#chan"))
+        self.assertFalse(self.state.is_on("alice", "#chan"))
+        self.assertEqual(self.state.modes_of("carol", "#chan"), {"v"})
+        feed(self.state, ":Pb42!pie@bot NICK :Pb43")
+        self.assertEqual(self.state.nick, "Pb43")
+        self.assertTrue(self.state.is_on("pb43", "#chan"))
+
+    def test_modes(self):
+        feed(self.state,
+             ":op!o@h MODE #chan +o-v+lk bob alice 10 secret",
+             ":op!o@h MODE #chan +b *!*@x",
+             ":Pb42 MODE Pb42 :+iw",
+             ":Pb42 MODE Pb42 :-w")
+        self.assertEqual(self.state.modes_of("bob", "#chan"), {"o"})
+        self.assertEqual(self.state.modes_of("alice", "#chan"), set())
+        self.assertEqual(self.state.channel("#chan").modes, {"l": "10", "k": "secret"})
+        self.assertEqual(self.state.modes, {"i"})
+
+    def test_who_and_topic(self):
+        feed(self.state,
+             ":server 352 Pb42 #chan b host.example srv bob H@ :0 Bob Builder",
+             ":server 332 Pb42 #chan :Welcome",
+             ":bob!b@h TOPIC #chan :Changed")
+        self.assertEqual(self.state.user("bob").realname, "Bob Builder")
+        self.assertEqual(self.state.modes_of("bob", "#chan"), {"o"})
+        self.assertEqual(self.state.channel("#chan").topic, "Changed")
+
+    def test_netsplit(self):
+        nicks = ["user{}".format(i) for i in range(2000)]
+        feed(self.state, *(":{0}!u@h JOIN #chan".format(nick) for nick in nicks))
+        self.assertEqual(len(self.state.channel("#chan").members), 2003)
+        feed(self.state, *(":{0}!u@h QUIT :a.net b.net".format(nick) for nick in nicks))
+        self.assertEqual(len(self.state.channel("#chan").members), 3)
+
+
+class ProtocolState(unittest.TestCase):
+
+    def test_protocol_tracks_state(self):
+        protocol, _ = make_protocol()
+        protocol.data_received(b":server 001 Pb42_ :Welcome\r\n:Pb42_!pie@bot JOIN #chan\r\n")
+        self.assertEqual(protocol.nick, "Pb42_")
+        self.assertTrue(protocol.state.is_on("pb42_", "#chan"))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import glob
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from piebot import irc
+from piebot.store import MessageStore
+
+from fakeserver import make_protocol
+
+
+def privmsg(nick, channel, text):
+    return irc.Message.from_string(":{0}!u@h PRIVMSG {1} :{2}".format(nick, channel, text))
+
+
+class Store(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.now = [1000.0]
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.directory.cleanup()
+
+    def open(self, **options):
+        options.setdefault("clock", lambda: self.now[0])
+        store = MessageStore(self.directory.name, **options)
+        self.stores.append(store)
+        return store
+
+    def reopen(self, store, **options):
+        store.close()
+        self.stores.remove(store)
+        return self.open(**options)
+
+    def fill(self, store, count, channels=("#a", "#b"), text="line {}"):
+        for i in range(count):
+            self.now[0] += 1
+            store.append("net", privmsg("nick{}".format(i % 3), channels[i % len(channels)], text.format(i)))
+        store.sync()
+
+    def test_history_and_nicks(self):
+        store = self.open()
+        self.fill(store, 10)
+        store.append("net", irc.Message.from_string(":Nick1!u@h NICK :other"))
+        store.append("net", irc.Message.from_string(":nick2!u@h QUIT :bye"))
+        store.append("net", irc.Message.from_string("PING :ignored"))
+        store.append("net", privmsg("nick0", "Pb42", "private"))
+        store.append("net", privmsg("nick9", "+c", "modeless"), chantypes="#+")
+        store.sync()
+        self.assertEqual(store.history("net", "Pb42"), [])
+        self.assertEqual([record.text for record in store.history("net", "+c")], ["modeless"])
+        self.assertEqual([record.text for record in store.history("net", "#A")], ["line {}".format(i) for i in range(0, 10, 2)])
+        self.assertEqual([record.text for record in store.history("net", "#a", start=1003, end=1007)], ["line 2", "line 4"])
+        self.assertEqual([record.text for record in store.history("net", "#a", limit=2)], ["line 6", "line 8"])
+        self.assertEqual(store.history("other", "#a"), [])
+        seen = store.last_seen("net", "NICK1")
+        self.assertEqual((seen.command, seen.channel, seen.text), ("NICK", "", "other"))
+        self.assertEqual(store.last_seen("net", "nick2").command, "QUIT")
+        self.assertEqual(len(store.by_nick("net", "nick0")), 4)
+        self.assertIsNone(store.last_seen("net", "nobody"))
+        self.assertEqual([record.text for record in store.search("net", "#b", "LINE 7")], ["line 7"])
+
+    def test_reopen_scans_active_and_loads_sealed_indexes(self):
+        store = self.open(segment_size=2**17)
+        self.fill(store, 600, text="{}" + "x" * 500)
+        self.assertGreater(len(glob.glob(os.path.join(self.directory.name, "*.idx"))), 1)
+        before = [(record.time, record.text) for record in store.history("net", "#a")]
+        store = self.reopen(store, segment_size=2**17)
+        self.assertEqual([(record.time, record.text) for record in store.history("net", "#a")], before)
+        self.assertEqual(len(before), 300)
+        self.fill(store, 2)
+        self.assertEqual(len(store.history("net", "#a")), 301)
+        # As after a crash: the saved index misses the latest records, which are scanned.
+        crashed = MessageStore(self.directory.name, segment_size=2**17)
+        self.stores.append(crashed)
+        self.assertEqual(len(crashed.history("net", "#a")), 301)
+
+    def test_non_ascii_names(self):
+        store = self.open()
+        self.fill(store, 4, channels=("#möp",))
+        store = self.reopen(store)
+        self.assertEqual(len(store.history("net", "#möp")), 4)
+
+    def test_truncated_record_is_ignored(self):
+        store = self.open()
+        self.fill(store, 3)
+        store.close()
+        self.stores.remove(store)
+        path = os.path.join(self.directory.name, "00000001.seg")
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 1)
+        store = self.open()
+        self.assertEqual([record.text for record in store.by_nick("net", "nick0")], ["line 0"])
+
+    def test_compaction(self):
+        store = self.open(segment_size=2**17, max_age=300)
+        self.fill(store, 600, text="{}" + "x" * 500)
+        # Rotation compacted everything older than 300s.
+        oldest = store.history("net", "#a")[0].time
+        self.assertGreaterEqual(oldest, self.now[0] - 300 - 250)
+        before = [record.time for record in store.history("net", "#a")]
+        self.now[0] += 10000
+        store.compact()
+        store.sync()
+        # Only the active segment is left.
+        self.assertEqual(len(glob.glob(os.path.join(self.directory.name, "*.seg"))), 1)
+        after = [record.time for record in store.history("net", "#a")]
+        self.assertLess(len(after), len(before))
+        self.assertEqual(after, before[-len(after):])
+        store = self.reopen(store, segment_size=2**17)
+        self.assertEqual([record.time for record in store.history("net", "#a")], after)
+
+    def test_queries_do_not_wait_for_compaction(self):
+        store = self.open(segment_size=2**17)
+        self.fill(store, 600, text="{}" + "x" * 500)
+        before = [record.time for record in store.history("net", "#a")]
+        rewriting = threading.Event()
+        release = threading.Event()
+        rewrite = store._rewrite
+
+        def slow_rewrite(segment, cutoff):
+            rewriting.set()
+            release.wait(10)
+            return rewrite(segment, cutoff)
+
+        store._rewrite = slow_rewrite
+        store.compact(max_age=self.now[0] - 1000 - 150)
+        self.assertTrue(rewriting.wait(10))
+        self.assertEqual([record.time for record in store.history("net", "#a")], before)
+        release.set()
+        store.sync()
+        after = [record.time for record in store.history("net", "#a")]
+        self.assertEqual(after, [time for time in before if time >= 1150])
+
+    def test_failed_compaction_keeps_the_store_readable(self):
+        store = self.open(segment_size=2**17)
+        self.fill(store, 600, text="{}" + "x" * 500)
+        before = [record.time for record in store.history("net", "#a")]
+        with mock.patch("piebot.store.os.replace", side_effect=OSError("disk full")):
+            store.compact(max_age=self.now[0] - 1000 - 150)
+            store.sync()
+        self.assertEqual(store.errors, 1)
+        self.assertEqual([record.time for record in store.history("net", "#a")], before)
+        self.assertEqual(glob.glob(os.path.join(self.directory.name, "*.tmp")), [])
+        store.compact(max_age=self.now[0] - 1000 - 150)
+        store.sync()
+        self.assertEqual([record.time for record in store.history("net", "#a")],
+                         [time for time in before if time >= 1150])
+
+    def test_appends_are_batched_on_the_loop(self):
+        loop = asyncio.new_event_loop()
+        store = self.open(loop=loop, flush_interval=0.01, batch_size=3)
+        store.append("net", privmsg("nick", "#a", "one"))
+        self.assertEqual(len(store._pending), 1)
+        store.append("net", privmsg("nick", "#a", "two"))
+        store.append("net", privmsg("nick", "#a", "three"))
+        self.assertEqual(store._pending, [])
+        store.append("net", privmsg("nick", "#a", "four"))
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(store._pending, [])
+        store.sync()
+        self.assertEqual(store.written, 4)
+        loop.close()
+
+    def test_protocol_feeds_store(self):
+        store = self.open()
+        protocol, transport = make_protocol(store=store, network="testnet")
+        protocol.data_received(b":alice!a@h JOIN #pie\r\n:alice!a@h PRIVMSG #pie :hello\r\n")
+        protocol.data_received(b"@batch=x :srv BATCH +x netjoin\r\n@batch=x :bob!b@h JOIN #pie\r\n:srv BATCH -x\r\n")
+        store.sync()
+        self.assertEqual([(record.nick, record.command) for record in store.history("testnet", "#pie")],
+                         [("alice", "JOIN"), ("alice", "PRIVMSG"), ("bob", "JOIN")])
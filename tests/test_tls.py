@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import ssl
+import unittest
+from piebot.bot import ConnectionManager
+from piebot.tls import ResumingSSLContext, create_context
+
+from fakeserver import FakeIrcServer, make_protocol
+
+CERTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tls")
+
+
+def server_context(client_certs=False):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(os.path.join(CERTS, "cert.pem"), os.path.join(CERTS, "key.pem"))
+    if client_certs:
+        context.verify_mode = ssl.CERT_OPTIONAL
+        context.load_verify_locations(os.path.join(CERTS, "client-cert.pem"))
+    return context
+
+
+class TLS(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = self.loop.time() + timeout
+        while not condition() and self.loop.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def connect(self, server, **config):
+        endpoint = ("127.0.0.1", server.port)
+        manager = ConnectionManager(self.loop, base_delay=0.01, max_delay=0.02)
+        defaults = {"encoding": "utf-8", "nick": "Pb42", "ident": "pie", "realname": "Pie", "channels": [],
+                    "ssl": True, "ssl_cafile": os.path.join(CERTS, "cert.pem"), "ssl_server_hostname": "localhost",
+                    "flood_rate": None}
+        defaults.update(config)
+        manager.add_endpoint(endpoint, defaults)
+        return manager, endpoint
+
+    def registered(self, manager, endpoint):
+        # ready() runs on RPL_ENDOFMOTD, i.e. after CAP END.
+        return endpoint in manager._active_connections and manager._active_connections[endpoint].joins is not None
+
+    def stop(self, manager, endpoint, server):
+        manager.remove_endpoint(endpoint)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        server.stop()
+
+    def test_create_context(self):
+        context = create_context()
+        self.assertIsInstance(context, ResumingSSLContext)
+        self.assertTrue(context.check_hostname)
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertEqual(create_context(verify=False).verify_mode, ssl.CERT_NONE)
+
+    def test_sessions_are_resumed_across_reconnects(self):
+        server = FakeIrcServer(self.loop, ssl=server_context()).start()
+        manager, endpoint = self.connect(server)
+        self.run_until(lambda: self.registered(manager, endpoint))
+        first = manager._active_connections[endpoint]
+        self.assertIs(first.tls_resumed, False)
+        self.assertEqual(server.lines[0][1], "CAP LS :302")
+        server.clients[0].transport.close()
+        self.run_until(lambda: manager._active_connections.get(endpoint) not in (None, first))
+        self.assertIs(manager._active_connections[endpoint].tls_resumed, True)
+        self.assertEqual(len(server.clients), 2)
+        self.stop(manager, endpoint, server)
+
+    def test_untrusted_certificate_fails(self):
+        server = FakeIrcServer(self.loop, ssl=server_context()).start()
+        manager, endpoint = self.connect(server, ssl_cafile=None)
+        self.run_until(lambda: manager.reconnects.state(endpoint)["failures"] > 0)
+        self.assertIn("CERTIFICATE_VERIFY_FAILED", manager.reconnects.state(endpoint)["last_error"])
+        self.stop(manager, endpoint, server)
+
+    def test_sasl_plain(self):
+        server = FakeIrcServer(self.loop, caps=["sasl=PLAIN,EXTERNAL", "batch"], ssl=server_context(),
+                               accounts={"pie": "secret"}).start()
+        manager, endpoint = self.connect(server, sasl={"mechanism": "PLAIN", "username": "pie", "password": "secret"})
+        self.run_until(lambda: self.registered(manager, endpoint))
+        protocol = manager._active_connections[endpoint]
+        self.assertTrue(protocol.sasl.succeeded)
+        self.assertEqual(protocol.sasl.account, "pie")
+        self.assertEqual(server.logins, [("PLAIN", "pie")])
+        lines = [line for _, line in server.lines]
+        self.assertEqual(lines[lines.index("CAP REQ :batch sasl"):], [
+            "CAP REQ :batch sasl", "AUTHENTICATE PLAIN", "AUTHENTICATE cGllAHBpZQBzZWNyZXQ=", "CAP END"])
+        self.stop(manager, endpoint, server)
+
+    def test_sasl_required_by_server_without_sasl(self):
+        server = FakeIrcServer(self.loop, caps=["batch"], ssl=server_context()).start()
+        manager, endpoint = self.connect(server, sasl={"username": "pie", "password": "secret", "required": True})
+        with self.assertLogs("piebot.bot", "ERROR"):
+            self.run_until(lambda: len(server.clients) >= 2)
+        lines = [line for _, line in server.lines]
+        self.assertNotIn("CAP END", lines)
+        self.assertNotIn("CAP REQ :batch", lines)
+        self.assertFalse(self.registered(manager, endpoint))
+        self.stop(manager, endpoint, server)
+
+    def test_sasl_external(self):
+        server = FakeIrcServer(self.loop, caps=["sasl"], ssl=server_context(client_certs=True)).start()
+        manager, endpoint = self.connect(server, sasl={"mechanism": "EXTERNAL"},
+                                         ssl_certfile=os.path.join(CERTS, "client-cert.pem"),
+                                         ssl_keyfile=os.path.join(CERTS, "client-key.pem"))
+        self.run_until(lambda: self.registered(manager, endpoint))
+        self.assertTrue(manager._active_connections[endpoint].sasl.succeeded)
+        self.assertEqual(server.logins, [("EXTERNAL", "cert")])
+        self.assertIn("AUTHENTICATE +", [line for _, line in server.lines])
+        self.stop(manager, endpoint, server)
+
+
+class Sasl(unittest.TestCase):
+
+    def receive(self, protocol, transport, line):
+        del transport.writes[:]
+        protocol.data_received(line.encode("utf-8") + b"\r\n")
+        return b"".join(transport.writes).decode("utf-8").split("\r\n")[:-1]
+
+    def test_failure_continues_registration(self):
+        protocol, transport = make_protocol(sasl={"username": "pie", "password": "wrong"})
+        self.assertEqual(self.receive(protocol, transport, ":srv CAP * LS :sasl"), ["CAP REQ :sasl"])
+        self.assertEqual(self.receive(protocol, transport, ":srv CAP * ACK :sasl"), ["AUTHENTICATE PLAIN"])
+        self.assertEqual(self.receive(protocol, transport, "AUTHENTICATE +"), ["AUTHENTICATE cGllAHBpZQB3cm9uZw=="])
+        self.assertEqual(self.receive(protocol, transport, ":srv 904 * :SASL authentication failed"), ["CAP END"])
+        self.assertFalse(protocol.sasl.succeeded)
+
+    def test_required_failure_disconnects(self):
+        protocol, transport = make_protocol(sasl={"username": "pie", "password": "wrong", "required": True})
+        self.receive(protocol, transport, ":srv CAP * LS :sasl")
+        self.receive(protocol, transport, ":srv CAP * ACK :sasl")
+        self.assertEqual(self.receive(protocol, transport, ":srv 904 * :SASL authentication failed"), [])
+        self.assertTrue(transport.closed)
+
+    def test_required_but_not_offered_disconnects(self):
+        protocol, transport = make_protocol(sasl={"username": "pie", "password": "secret", "required": True})
+        self.assertEqual(self.receive(protocol, transport, ":srv CAP * LS * :multi-prefix"), [])
+        self.assertFalse(transport.closed)
+        self.assertEqual(self.receive(protocol, transport, ":srv CAP * LS :batch"), [])
+        self.assertTrue(transport.closed)
+
+    def test_required_but_refused_disconnects(self):
+        protocol, transport = make_protocol(sasl={"username": "pie", "password": "secret", "required": True})
+        self.receive(protocol, transport, ":srv CAP * LS :sasl")
+        self.assertEqual(self.receive(protocol, transport, ":srv CAP * NAK :sasl"), [])
+        self.assertTrue(transport.closed)
+
+    def test_required_without_cap_support_disconnects(self):
+        protocol, transport = make_protocol(sasl={"username": "pie", "password": "secret", "required": True})
+        self.receive(protocol, transport, ":srv 001 Pb42 :Welcome")
+        self.assertTrue(transport.closed)
+
+    def test_long_payloads_are_chunked(self):
+        protocol, transport = make_protocol(sasl={"username": "u" * 100, "password": "p" * 98})
+        self.receive(protocol, transport, ":srv CAP * LS :sasl")
+        self.receive(protocol, transport, ":srv CAP * ACK :sasl")
+        sent = self.receive(protocol, transport, "AUTHENTICATE +")
+        # 100 + 1 + 100 + 1 + 98 bytes are 400 bytes of base64, followed by a terminating "+".
+        self.assertEqual([len(line) for line in sent], [13 + 400, 14])